@@ -47,18 +47,72 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from collections import OrderedDict
-from hashlib import md5
+import bz2
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import errno
+import gzip
+from hashlib import md5, sha1
+import io
+from itertools import chain
+import json
+import mmap
+import multiprocessing
+from multiprocessing import cpu_count
 import os
 import re
+import signal
+import socket
+import stat
+import struct
 import sys
+import tempfile
+import threading
+import time
+from timeit import default_timer
 import traceback
+import zlib
+try:
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+try:
+    import fcntl
+except ImportError:
+    # Windows, only needed for --host-map
+    fcntl = None
+try:
+    import socketserver
+except ImportError:
+    # Python 2
+    import SocketServer as socketserver
+try:
+    import lzma
+except ImportError:
+    # Python 2, only needed for xz compressed files
+    lzma = None
+try:
+    # optional, only needed for zstd compressed files
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    # optional alternative regex engines for --regex-engine
+    import regex as regex_module
+except ImportError:
+    regex_module = None
+try:
+    import re2 as re2_module
+except ImportError:
+    re2_module = None
 srcdir = os.path.abspath(os.path.dirname(__file__))
 libdir = os.path.join(srcdir, 'pylib')
 sys.path.append(libdir)
 try:
     # pylint: disable=wrong-import-position
     from harisekhon.utils import \
+        die, \
         isJavaException, \
         isPythonTraceback, \
         isPythonMinVersion, \
@@ -67,7 +121,9 @@ try:
         log, \
         log_option, \
         strip_ansi_escape_codes, \
-        validate_file
+        validate_file, \
+        validate_float, \
+        validate_int
     # used dynamically
     # pylint: disable=unused-import
     from harisekhon.utils import \
@@ -99,6 +155,453 @@ __version__ = '0.10.12'
 ip_regex = r'(?!127\.0\.0\.)' + ip_regex
 subnet_mask_regex = r'(?!127\.0\.0\.)' + subnet_mask_regex
 
+
+class FilteredRegex(object):
+    """
+    Wraps a compiled regex to only substitute matches accepted by a filter function,
+    retrying from the next position on rejection as a failed lookaround would
+    """
+
+    def __init__(self, regex, accept):
+        self.regex = regex
+        self.pattern = regex.pattern
+        self.accept = accept
+
+    def subn(self, repl, string, count=0):
+        search = self.regex.search
+        accept = self.accept
+        parts = []
+        last = 0
+        pos = 0
+        num = 0
+        while pos <= len(string):
+            match = search(string, pos)
+            if not match:
+                break
+            start = match.start()
+            if not accept(match):
+                pos = start + 1
+                continue
+            parts.append(string[last:start])
+            parts.append(repl(match) if callable(repl) else match.expand(repl))
+            last = match.end()
+            pos = last if last > start else last + 1
+            num += 1
+            if num == count:
+                break
+        if not num:
+            return (string, 0)
+        parts.append(string[last:])
+        # string[:0] is '' or b'' to join text or --bytes parts
+        return (string[:0].join(parts), num)
+
+    def sub(self, repl, string, count=0):
+        return self.subn(repl, string, count)[0]
+
+    def search(self, string, pos=0):
+        search = self.regex.search
+        accept = self.accept
+        while pos <= len(string):
+            match = search(string, pos)
+            if not match or accept(match):
+                return match
+            pos = match.start() + 1
+        return None
+
+
+class AsciiMatch(object):
+    """
+    Presents a match of a bytes regex on an ASCII line as a text match to the host filters and
+    replacement functions, which are written for text
+    """
+
+    __slots__ = ('match',)
+
+    def __init__(self, match):
+        self.match = match
+
+    @property
+    def string(self):
+        return self.match.string.decode('ascii')
+
+    def group(self, *args):
+        group = self.match.group(*args)
+        if isinstance(group, tuple):
+            return tuple([_ if _ is None else _.decode('ascii') for _ in group])
+        return group if group is None else group.decode('ascii')
+
+    def start(self, group=0):
+        return self.match.start(group)
+
+    def end(self, group=0):
+        return self.match.end(group)
+
+
+class RegexBackend(object):
+    """
+    A regex engine for --regex-engine to compile the rules with, this base being the stdlib re
+
+    Compiled regex must support search(string, pos), sub(), subn() with \\1 and function replacements, .pattern
+    and match objects with group(), start(), end() and expand() the same as re
+    """
+
+    name = 're'
+    module = re
+
+    def is_available(self):
+        return self.module is not None
+
+    def supports(self, pattern):  # pylint: disable=unused-argument,no-self-use
+        return True
+
+    def compile(self, pattern):
+        return self.module.compile(pattern, re.I | re.M)
+
+
+class RegexModuleBackend(RegexBackend):
+    """
+    The regex module, a re compatible engine supporting everything the rules use
+    """
+
+    name = 'regex'
+    module = regex_module
+
+    def compile(self, pattern):
+        return self.module.compile(pattern, self.module.I | self.module.M)
+
+
+class RE2Backend(RegexBackend):
+    """
+    Google RE2, which matches in linear time so can't backtrack pathologically, but has no lookaround or
+    backreferences so rules using them are left on re
+    """
+
+    name = 're2'
+    module = re2_module
+    re_unsupported = re.compile(r'\(\?<?[=!]|\\[1-9]|\(\?P=|\(\?\(|\\Z')
+
+    def supports(self, pattern):
+        if self.re_unsupported.search(pattern):
+            return False
+        try:
+            self.compile(pattern)
+        except Exception:  # pylint: disable=broad-except
+            # the bindings raise different errors for anything else RE2 doesn't support
+            return False
+        return True
+
+    def compile(self, pattern):
+        # flags inline as the RE2 bindings don't all take re style flags
+        return self.module.compile('(?im)' + pattern)
+
+
+class RuleTimeout(Exception):
+    pass
+
+
+class HostMap(object):
+    """
+    Append only file of 'hashed_hostname<tab>hostname' lines shared by the processes hashing hostnames, eg. --jobs
+    workers and concurrent runs, so each hostname is recorded once and the file can be used to privately
+    de-anonymize the output
+
+    New lines from other processes are read via mmap and appended under an exclusive flock
+    """
+
+    def __init__(self, path, salt):
+        self.path = path
+        self.hosts = {}
+        # the first line, so hashes from different salts are never mixed, without revealing the salt
+        fingerprint = sha1(salt.encode('utf-8')).hexdigest()[:12]
+        self.header = '# anonymize.py --host-map, salt fingerprint {}'.format(fingerprint)
+        self.offset = 0
+        self.fd = None
+        self.open()
+        with self.lock():
+            if not os.fstat(self.fd).st_size:
+                os.write(self.fd, (self.header + '\n').encode('utf-8'))
+            self.refresh()
+
+    def open(self):
+        # the hostnames are what was anonymized so only readable by the user
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+
+    def reopen(self):
+        """
+        Must be called in forked processes as flock locks belong to the open file, which is shared with the parent
+        """
+        os.close(self.fd)
+        self.open()
+
+    @contextmanager
+    def lock(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def refresh(self):
+        size = os.fstat(self.fd).st_size
+        if size <= self.offset:
+            return
+        mapped = mmap.mmap(self.fd, size, access=mmap.ACCESS_READ)
+        try:
+            data = mapped[self.offset:size]
+        finally:
+            mapped.close()
+        if self.offset == 0 and data.split(b'\n', 1)[0].decode('utf-8') != self.header:
+            raise ValueError('host map {} was created with a different hash salt or is not a host map'
+                             .format(self.path))
+        self.offset = size
+        for line in data.decode('utf-8').splitlines():
+            if line.startswith('#'):
+                continue
+            (hashed_hostname, host) = line.split('\t', 1)
+            self.hosts[host] = hashed_hostname
+
+    def add(self, host, hashed_hostname):
+        """
+        Records the hashed hostname if no process has already, returning the recorded one
+        """
+        with self.lock():
+            self.refresh()
+            if host not in self.hosts:
+                line = '{}\t{}\n'.format(hashed_hostname, host).encode('utf-8')
+                os.write(self.fd, line)
+                self.offset += len(line)
+                self.hosts[host] = hashed_hostname
+        return self.hosts[host]
+
+
+if hasattr(bytes, 'isascii'):
+    # Python 3.7+ is much faster
+    is_ascii = bytes.isascii  # pylint: disable=invalid-name,no-member
+else:
+    def is_ascii(data):
+        try:
+            data.decode('ascii')
+        except UnicodeDecodeError:
+            return False
+        return True
+
+
+# same as xml.sax.saxutils escape() / unescape(), which would import urllib.request, http.client and email
+# adding ~40ms to the startup of every run
+def xml_escape(text, entities=None):
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    for (char, entity) in (entities or {}).items():
+        text = text.replace(char, entity)
+    return text
+
+
+def xml_unescape(text, entities=None):
+    text = text.replace('&lt;', '<').replace('&gt;', '>')
+    for (entity, char) in (entities or {}).items():
+        text = text.replace(entity, char)
+    # last so that eg. &amp;lt; becomes &lt; rather than <
+    return text.replace('&amp;', '&')
+
+
+class DecompressingReader(io.RawIOBase):
+    """
+    Raw reader of a compressed file decompressed by a background thread, which keeps the decompression off the
+    thread running the regex, zlib / bz2 / lzma release the GIL while decompressing so this runs in parallel
+    """
+
+    block_size = 1024 * 1024
+
+    def __init__(self, binary, new_decompressor):
+        super(DecompressingReader, self).__init__()
+        self.binary = binary
+        self.new_decompressor = new_decompressor
+        # bounded to keep memory flat if the regex can't keep up with decompression
+        self.blocks = queue.Queue(maxsize=16)
+        self.buffer = b''
+        self.offset = 0
+        self.eof = False
+        thread = threading.Thread(target=self.decompress)
+        thread.daemon = True
+        thread.start()
+
+    def decompress(self):
+        try:
+            decompressor = self.new_decompressor()
+            while True:
+                data = self.binary.read(self.block_size)
+                if not data:
+                    break
+                while data:
+                    self.blocks.put(decompressor.decompress(data))
+                    # concatenated compressed streams eg. from pigz / pbzip2 or cat-ing compressed files together
+                    data = getattr(decompressor, 'unused_data', b'')
+                    if data:
+                        decompressor = self.new_decompressor()
+            if hasattr(decompressor, 'flush'):
+                self.blocks.put(decompressor.flush())
+            # otherwise a truncated or corrupt file would silently give partial output
+            # (Python 2 zlib and older zstandard decompressors don't say)
+            if not getattr(decompressor, 'eof', True):
+                raise IOError('truncated compressed stream')
+        except Exception as _:  # pylint: disable=broad-except
+            self.blocks.put(_)
+        self.blocks.put(None)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while self.offset >= len(self.buffer) and not self.eof:
+            block = self.blocks.get()
+            if block is None:
+                self.eof = True
+            elif isinstance(block, Exception):
+                raise IOError('decompression failed: {}'.format(block))
+            else:
+                self.buffer = block
+                self.offset = 0
+        size = min(len(buf), len(self.buffer) - self.offset)
+        buf[:size] = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+    def close(self):
+        if self.binary is not getattr(sys.stdin, 'buffer', None):
+            self.binary.close()
+        super(DecompressingReader, self).close()
+
+
+class ProfiledRegex(object):
+    """
+    Wraps a compiled or filtered regex to accumulate the time taken, number of calls
+    and number of substitutions made by subn() in to a [seconds, calls, substitutions] list
+    """
+
+    def __init__(self, regex, stats):
+        self.regex = regex
+        self.pattern = regex.pattern
+        self.stats = stats
+
+    def subn(self, repl, string, count=0):
+        start = default_timer()
+        result = self.regex.subn(repl, string, count)
+        stats = self.stats
+        stats[0] += default_timer() - start
+        stats[1] += 1
+        stats[2] += result[1]
+        return result
+
+    def sub(self, repl, string, count=0):
+        return self.subn(repl, string, count)[0]
+
+    def search(self, string, pos=0):
+        start = default_timer()
+        match = self.regex.search(string, pos)
+        stats = self.stats
+        stats[0] += default_timer() - start
+        stats[1] += 1
+        if match:
+            stats[2] += 1
+        return match
+
+
+# set to the Anonymize instance before forking the --jobs worker pool so each worker inherits the compiled regex
+worker_anonymizer = None
+
+
+def init_worker():
+    # interval timers are not inherited across fork() so each worker must start its own --rule-timeout watchdog
+    if worker_anonymizer.rule_timeout:
+        worker_anonymizer.start_rule_watchdog()
+    if worker_anonymizer.host_map:
+        worker_anonymizer.host_map.reopen()
+
+
+def anonymize_chunk(args):
+    """
+    Returns the anonymized chunk along with the line cache and rule profiling stats
+    for the parent process to total and report since workers each have their own
+    """
+    (filename, lineno, lines) = args
+    anonymizer = worker_anonymizer
+    if anonymizer.block_size:
+        try:
+            return (anonymizer.anonymize_block(''.join(lines)), anonymizer.take_stats())
+        except RuleTimeout as _:
+            raise RuleTimeout('lines {}-{}: {}'.format(lineno + 1, lineno + len(lines), _))
+    anonymize = anonymizer.get_line_anonymizer()
+    output = []
+    try:
+        for line in lines:
+            lineno += 1
+            output.append(anonymize(line))
+    except AssertionError as _:
+        raise AssertionError('{} line {}: {}'.format(filename, lineno, _))
+    except RuleTimeout as _:
+        raise RuleTimeout('line {}: {}'.format(lineno, _))
+    empty = b'' if anonymizer.bytes_mode else ''
+    return (empty.join(output), anonymizer.take_stats())
+
+
+def read_frame(filehandle):
+    """
+    Reads a --serve protocol message, JSON prefixed by its length in bytes as a 4 byte big endian unsigned int,
+    returning None at end of stream
+    """
+    header = filehandle.read(4)
+    if not header:
+        return None
+    if len(header) < 4:
+        raise ValueError('truncated message header')
+    (length,) = struct.unpack('>I', header)
+    data = filehandle.read(length)
+    if len(data) < length:
+        raise ValueError('truncated message, expected {} bytes but got {}'.format(length, len(data)))
+    return json.loads(data.decode('utf-8'))
+
+
+def write_frame(filehandle, message):
+    data = json.dumps(message).encode('utf-8')
+    filehandle.write(struct.pack('>I', len(data)) + data)
+    filehandle.flush()
+
+
+class AnonymizeRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answers each request on a --serve connection in turn until the client closes it
+    """
+
+    def handle(self):
+        anonymizer = self.server.anonymizer
+        while True:
+            try:
+                request = read_frame(self.rfile)
+            except ValueError as _:
+                # can't find the start of the next message after a bad one so give up on the connection
+                write_frame(self.wfile, {'error': 'invalid message: {}'.format(_)})
+                return
+            if request is None:
+                return
+            try:
+                response = {'text': anonymizer.serve_request(request)}
+            except ValueError as _:
+                response = {'error': str(_)}
+            write_frame(self.wfile, response)
+
+
+def anonymize_file(filename):
+    """
+    Anonymizes a whole file in a --recursive --jobs worker, returning its throughput and stats
+    """
+    anonymizer = worker_anonymizer
+    try:
+        return anonymizer.process_file_timed(filename) + (anonymizer.take_stats(),)
+    except SystemExit:
+        # die() has already printed the error, raise something the pool passes back to the parent rather than
+        # the worker exiting and the parent waiting forever for the result
+        raise RuntimeError('failed to anonymize {}'.format(filename))
+
+
 class Anonymize(CLI):
 
     def __init__(self):
@@ -109,13 +612,117 @@ class Anonymize(CLI):
         self.timeout_default = None
         self.custom_anonymization_file = os.path.join(srcdir, 'anonymize_custom.conf')
         self.custom_ignore_file = os.path.join(srcdir, 'anonymize_ignore.conf')
-        self.custom_anonymizations = set()
-        self.custom_ignores = set()
-        self.custom_ignores_raw = ''
+        self.custom_anonymizations = []
+        self.pipeline = []
+        # anonymize_ignore.conf literals by length and regex, checked at the start of each host / domain / fqdn match
+        self.ignore_literals = {}
+        self.ignore_regex = []
         self.file_list = set()
         self.re_line_ending = re.compile(r'(\r?\n)$')
+        # --bytes reads, anonymizes and writes bytes, only decoding lines / rules which need text
+        self.bytes_mode = False
+        self.bytes_pipeline = []
+        self.anonymize_uncached = self.anonymize
+        self.re_generic_python_log_line = re.compile(r'\s' + filename_regex + r'.py:\d+ - loglevel=[\w\.]+\s*$', re.I)
         self.strip_cr = False
         self.hash_salt = None
+        # --hash-hostnames hostname => hashed hostname, and the --host-map shared with other processes if any
+        self.host_hashes = {}
+        self.host_map = None
+        self.jobs = 1
+        self.pool = None
+        # size in chars of the line aligned chunks of input sent to each --jobs worker process
+        self.chunk_size = 1024 * 1024
+        # size in chars of the line aligned blocks of input anonymized at a time in --block-size mode, 0 for per line
+        self.block_size = 0
+        # LRU cache of raw line => anonymized line for repetitive logs, 0 to disable
+        self.line_cache_size = 0
+        self.line_cache = OrderedDict()
+        self.line_cache_hits = 0
+        self.line_cache_misses = 0
+        # --profile-rules stats of rule name => [seconds, calls, substitutions] and rule name => category
+        self.profile_rules = False
+        self.profile_json = None
+        self.rule_stats = OrderedDict()
+        self.rule_categories = {}
+        # CPU seconds a single rule may take on one line (or block) before --rule-timeout kicks in, 0 to disable
+        self.rule_timeout = 0
+        self.rule_timeout_chunk = False
+        # size in chars of the whitespace aligned chunks a timed out rule is re-applied to
+        self.rule_timeout_chunk_size = 1024
+        # chars a match may run past the end of a chunk, eg. the keyword of a rule which redacts to the end of the line
+        self.rule_timeout_chunk_overlap = 256
+        # incremented per apply_rules() call so the watchdog can tell if it is still on the same line at the next tick
+        self.apply_rules_count = 0
+        self.rule_watchdog_state = None
+        # lines longer than this many chars are anonymized in windows, 0 to disable
+        self.line_window = 0
+        # chars past each window a match may extend in to and still be caught, and of lookbehind context kept
+        self.window_overlap = 4096
+        # writes anonymized files here instead of to stdout, compressed the same as the input
+        self.output_dir = None
+        # --recursive input file => path relative to --output-dir mirroring its path under the input directory
+        self.recursive = False
+        self.output_paths = {}
+        # magic bytes at the start of compressed files
+        self.compression_magic = OrderedDict([
+            ('gzip', b'\x1f\x8b'),
+            ('bz2', b'BZh'),
+            ('xz', b'\xfd7zXZ\x00'),
+            ('zstd', b'\x28\xb5\x2f\xfd'),
+        ])
+        self.compression_extensions = {
+            'gzip': '.gz',
+            'bz2': '.bz2',
+            'xz': '.xz',
+            'zstd': '.zst',
+        }
+        # --follow tails the files, saving the byte offset of the last complete line read to the checkpoint file
+        self.follow = False
+        self.checkpoint_file = None
+        # max bytes read from each file per pass, and min / max secs slept between passes while there is no new data
+        self.follow_batch_size = 1024 * 1024
+        self.follow_min_delay = 0.05
+        self.poll_interval = 1.0
+        # secs between checkpoint saves while busy, always saved when idle and at exit
+        self.checkpoint_interval = 1.0
+        # --serve keeps the compiled pipeline warm for --client requests over a Unix socket
+        self.serve_socket = None
+        self.client_socket = None
+        # pipelines for the subsets of the enabled anonymizations requested by clients, by frozenset of categories
+        self.serve_pipelines = {}
+        self.serve_lock = threading.Lock()
+        # --format json / xml / yaml only anonymizes string values, replacing those of keys matching key_rules whole
+        self.document_format = None
+        self.key_rules = []
+        self.key_regex = OrderedDict()
+        self.re_key_separator = re.compile(r'[\s.-]+|(?<=[a-z0-9])(?=[A-Z])')
+        self.re_host_value = re.compile(r'^(?:{})$'.format(host_regex), re.I)
+        self.re_placeholder = re.compile(r'^<[\w.-]+>$')
+        # rules which redact everything to the end of the line, see subn_chunked()
+        self.re_end_of_line_rule = re.compile(r'(?:\.\*\??|(?<!\\)\$)\)*$')
+        # --format tokens, each named group being the kind of token passed to its handler by walk_document()
+        self.re_json_token = re.compile(r'(?P<string>"(?:[^"\\]|\\.)*")|(?P<open>[{\[])|(?P<close>[}\]])|' + \
+                                        r'(?P<literal>-?\d[\d.eE+-]*|\b(?:true|false|null)\b)')
+        self.re_json_key_follows = re.compile(r'\s*:')
+        self.re_xml_token = re.compile(r'(?P<comment><!--.*?-->)|(?P<cdata><!\[CDATA\[(.*?)\]\]>)|' + \
+                                       r'(?P<declaration><[?!].*?>)|(?P<close></[^>]*>)|' + \
+                                       r'(?P<open><([\w:.-]+)([^>]*?)(/?)>)|(?P<text>[^<]+)|(?P<lt><)', re.S)
+        self.re_yaml_token = re.compile(r'(?P<line>[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+)')
+        self.re_xml_attribute = re.compile(r'([\w:.-]+)(\s*=\s*)(["\'])(.*?)\3', re.S)
+        # indent and list item dashes, key if any, and value
+        self.re_yaml_line = re.compile(r'^(\s*(?:-\s+)*)' + \
+                                       r'(?:("[^"]*"|\'[^\']*\'|[^\s"\'#\[{&*!|>][^#]*?)(\s*:)(?=\s|$))?' + \
+                                       r'(\s*)(.*)$')
+        # --regex-engine the rules are compiled with, and the names of the rules it didn't support which used re
+        self.regex_backends = OrderedDict([(_.name, _) for _ in (RegexBackend(), RegexModuleBackend(), RE2Backend())])
+        self.regex_backend = self.regex_backends['re']
+        self.regex_fallbacks = []
+        self.benchmark_regex_engines = False
+        # segments of the pipeline as (is_line_safe, steps) applied to each block in --block-size mode
+        self.block_pipeline = []
+        # rules which might match across a newline or depend on the start / end of the string must be applied per line
+        self.re_line_unsafe = re.compile(r'\\[sWDAZnx0]|\[\^|\(\?[a-zA-Z]*s')
         # order of iteration of application matters because we must do more specific matches before less specific ones
         self.anonymizations = OrderedDict([
             ('ip_prefix', False),
@@ -153,6 +760,202 @@ class Anonymize(CLI):
         ignore_file_exts = ['java', 'py', 'sh', 'pid', 'scala', 'groovy']
         self.negative_host_lookbehind = ''.join(r'(?<!\.{})'.format(_) for _ in ignore_file_exts) + \
                                         r'(?<!\sid)'
+        # --tld-lookup equivalent of the above file extension lookbehinds, checked after matching instead
+        self.host_ignore_suffixes = tuple('.' + _ for _ in ignore_file_exts)
+        self.tld_lookup = False
+        self.tld_files = ('tlds-alpha-by-domain.txt', 'custom_tlds.txt')
+        self.tlds = frozenset()
+        self.regex_cache_dir = None
+        # newest regex cache files kept per --regex-cache-dir, one is written per combination of options and .conf files
+        self.regex_cache_max_files = 10
+        self.regex = {}
+        # literals at least one of which must be present (lowercase since regex are case insensitive) for each regex
+        # to be able to match, used to skip running the regex entirely on lines which cannot possibly match.
+        # Only list literals which are mandatory in the regex in build_regex(), regex without an entry are always run
+        self.required_literals = {
+            'aws': ('arn:',),
+            'aws2': ('arn:',),
+            'aws3': ('akia',),
+            'aws6': ('asia',),
+            'aws7': ('sg-',),
+            'aws8': ('s3://', 's3a://'),
+            'aws9': ('subnet-',),
+            'db': ('name',),
+            'db2': ('instance',),
+            'db3': ('schema',),
+            'db4': ('column', 'table', 'database', 'schema'),
+            'db5': ('warehouse',),
+            'generic': ('file://', 'fileb://'),
+            'generic2': ('key',),
+            'generic3': ('cluster',),
+            'generic4': ('function',),
+            'generic5': ('balancer',),
+            'hostname': (':',),
+            'hostname3': ('://',),
+            'hostname4': ('\\\\',),
+            'hostname5': ('host',),
+            'hostname6': ('host',),
+            'domain': ('.',),
+            'domain2': ('@',),
+            'fqdn': ('.',),
+            'group': ('group',),
+            'group2': ('group',),
+            'group3': ('group',),
+            'group4': ('group',),
+            'group5': ('arn:',),
+            'user': ('user', 'uid'),
+            'user2': ('/home/', '/user/'),
+            'user3': ('user', 'uid'),
+            'user4': ('\\',),
+            'user5': ('user',),
+            'user6': ('@',),
+            'user7': ('user', 'uid', 'owner'),
+            'user8': ('arn:',),
+            'password': ('pass',),
+            'password2': ('curl',),
+            'password3': ('pass',),
+            'password4': ('token',),
+            'ip': ('/',),
+            'ip2': ('.',),
+            'ip_prefix': ('/',),
+            'ip_prefix2': ('.',),
+            'ip_prefix3': ('ip-',),
+            'subnet_mask': ('.',),
+            'mac2': ('.',),
+            'kerberos': ('host/',),
+            'kerberos2': ('host/',),
+            'kerberos3': ('/_host@', '/http@'),
+            'kerberos4': ('@',),
+            'kerberos5': ('/krb5cc_',),
+            'email': ('@',),
+            'ldap': ('=', ':'),
+            'ldap2': (':',),
+            'ldap3': ('=',),
+            'port': (':',),
+            'proxy': ('proxy ',),
+            'proxy2': ('connected to ', ') port '),
+            'http_auth': ('@',),
+            'http_auth2': ('proxy auth using ',),
+            'http_auth3': ('authorization:',),
+            'http_auth4': ('token:',),
+            'cisco': ('username ',),
+            'cisco2': ('password ',),
+            'cisco3': ('secret',),
+            'cisco4': ('md5',),
+            'cisco5': ('community',),
+            'cisco6': ('standby',),
+            'cisco7': ('remote-as',),
+            'cisco8': ('description',),
+            'screenos': ('set admin ',),
+            'screenos2': ('set snmp ',),
+            'screenos3': (' md5 ',),
+            'screenos4': (' key ',),
+            'screenos5': ('set nsmgmt init id ',),
+            'screenos6': ('preshare ',),
+            'junos': ('pre-shared-key',),
+            'junos2': ('home',),
+            'network': ('username ',),
+            'network2': ('syscontact ',),
+            'windows': ('s-',),
+        }
+        ldap_lambda_lowercase = lambda m: r'{}<{}>'.format(m.group(1), m.group(2).lower())
+        # will auto-infer replacements to not have to be explicit, use this only for override mappings
+        self.replacements = {
+            # arn:partition:service:region:account-id:resource-id
+            # arn:partition:service:region:account-id:resource-type/resource-id
+            # arn:partition:service:region:account-id:resource-type:resource-id
+            'aws': r'\1<account_id>\2<\3>',
+            'aws2': r'\1:<resource>',
+            'aws3': r'<access_key>',
+            'aws4': r'<sts_token>',
+            'aws5': r'<secret_key>',
+            'aws6': r'<sts_access_key>',
+            'aws7': r'<sg-xxxxxxxx>',
+            'aws8': r'\1://<bucket>/',
+            'aws9': r'<subnet-xxxxxxxx>',
+            #'aws10': r'ec2-x-x-x-x.<region>\1',
+            'db': r'\1<database>',
+            'db2': r'\1<database_instance>',
+            'db3': r'\1<schema>',
+            'db4': r'\1<\2>',
+            'db5': r'/user/hive/warehouse/<database>.db/<table>',
+            'generic': r'\1://<file>',
+            'generic2': r'\1<key>',
+            'generic3': r'\1<cluster>',
+            'generic4': r'\1<function>',
+            'generic5': r'\1<load_balancer_name>',
+            'hostname': r'<hostname>:\2',
+            #'hostname2': '<aws_hostname>',
+            'hostname2': r'<ip-x-x-x-x>',
+            'hostname3': r'\1<hostname>',
+            'hostname4': r'\\\\<hostname>',
+            'hostname5': r'\1<hostname>',
+            'hostname6': r'\1<hostname>',
+            'domain2': '@<domain>',
+            'port': ':<port>',
+            'user': r'\1<user>',
+            'user2': r'/\1/<user>',
+            'user3': r'\1<user>',
+            'user4': r'<domain>\\<user>',
+            'user5': 'for user <user>',
+            'user6': '<user>@',
+            'user7': r'\1<user>',
+            'user8': r'\1<account_id>\2<user>',
+            'group': r'\1<group>',
+            'group2': r'\1<group>',
+            'group3': r'for group <group>',
+            'group4': r'\1<group>',
+            'group5': r'\1<account_id>\2<group>',
+            'password': r'\1<password>',
+            'password2': r'\1<user>:<password>',
+            'password3': r'\1<user>\2<password>',
+            'password4': r'\1<token>',
+            'ip': r'<ip_x.x.x.x>/<cidr_mask>',
+            'ip2': r'<ip_x.x.x.x>',
+            'ip3': r'<ip-x-x-x-x>',
+            'ip_prefix': r'<ip_x.x.x>.\1/<cidr_mask>',
+            'ip_prefix2': r'<ip_x.x.x>.\1',
+            'ip_prefix3': r'<ip-x-x-x>.\1',
+            'subnet_mask': r'<subnet_x.x.x.x>',
+            'kerberos': r'host/\1@<domain>',
+            'kerberos2': r'host/<instance>@<domain>',
+            'kerberos3': r'<user>/\1@<domain>',
+            'kerberos4': r'<user>/<instance>@<domain>',
+            'kerberos5': '/krb5cc_<uid>',
+            #'kerberos6': r'<kerberos_principal>',
+            'email': '<user>@<domain>',
+            'ldap': ldap_lambda_lowercase,
+            'ldap2': ldap_lambda_lowercase,
+            'ldap3': ldap_lambda_lowercase,
+            'proxy': r'proxy <proxy_host> port <proxy_port>',
+            'proxy2': r'Connected to <proxy_host> (<proxy_ip>) port <proxy_port>',
+            'proxy3': r'\1<proxy_ip>',
+            'http_auth': r'$1<user>:<password>@',
+            'http_auth2': r'\1\'<proxy_user>\2\3/',
+            'http_auth3': r'Authorization: Basic <token>',
+            'http_auth4': r'\1<token>',
+            'cisco': r'username <username> password <password>',
+            'cisco2': r'password <cisco_password>',
+            'cisco3': r'secret <secret>',
+            'cisco4': r' md5 <md5>',
+            'cisco5': r' community <community>',
+            'cisco6': r'\1 <auth>',
+            'cisco7': r'remote-as <AS>',
+            'cisco8': r'description <cisco_description>',
+            'screenos': r'set admin \1 <anonymized>',
+            'screenos2': r'set snmp \1 <anonymized>',
+            'screenos3': r' md5 <md5>',
+            'screenos4': r' key <key>',
+            'screenos5': r'set nsmgmt init id <id>',
+            'screenos6': r'preshare <psk> ',
+            'junos': r'pre-shared-key <psk>',
+            'junos2': r' home <home>',
+            'network': r'username <username>',
+            'network2': r'syscontact <syscontact>',
+            'windows': r'<windows_SID>',
+        }
+
+    def build_regex(self):
         ldap_rdn_list = [
             # country isn't exactly secret information worth anonymizing in most cases
             #'C',
@@ -442,105 +1245,23 @@ class Anonymize(CLI):
             'network2': r'syscontact .*',
             'windows': r'S-\d+-\d+-\d+-\d+-\d+-\d+-\d+'
         }
+        # LDAP attributes too generic to replace whole as --format keys, eg. Hadoop *-site.xml <description>
+        generic_keys = ('comment', 'department', 'description', 'division', 'info', 'initials', 'manager', 'mobile',
+                        'name', 'pager', 'street', 'title', 'url')
+        # --format key names, as normalized by normalize_key(), whose whole string values are replaced,
+        # checked in this order so eg. userPassword is a password rather than a user
+        self.key_regex = OrderedDict([
+            ('password', r'(?:^|_)(?:pass(?:word|phrase|wd|in)?|secret(?:_access)?(?:_key)?|' + \
+                         r'(?:api_|access_)?token|credentials?)$'),
+            ('ldap', r'^(?:{})$'.format('|'.join([re.escape(self.normalize_key(_))
+                                                  for _ in ldap_attributes if _ not in generic_keys]))),
+            ('user', r'(?:^|_)(?:user(?:_?name)?|uid|owner)$'),
+            ('group', r'(?:^|_)group(?:_?name)?$'),
+            ('hostname', r'(?:^|_)host(?:_?name)?$'),
+        ])
         # dump computer generated regexes to debug complex regex
         #import pprint
         #pprint.pprint(self.regex)
-        ldap_lambda_lowercase = lambda m: r'{}<{}>'.format(m.group(1), m.group(2).lower())
-        # will auto-infer replacements to not have to be explicit, use this only for override mappings
-        self.replacements = {
-            # arn:partition:service:region:account-id:resource-id
-            # arn:partition:service:region:account-id:resource-type/resource-id
-            # arn:partition:service:region:account-id:resource-type:resource-id
-            'aws': r'\1<account_id>\2<\3>',
-            'aws2': r'\1:<resource>',
-            'aws3': r'<access_key>',
-            'aws4': r'<sts_token>',
-            'aws5': r'<secret_key>',
-            'aws6': r'<sts_access_key>',
-            'aws7': r'<sg-xxxxxxxx>',
-            'aws8': r'\1://<bucket>/',
-            'aws9': r'<subnet-xxxxxxxx>',
-            #'aws10': r'ec2-x-x-x-x.<region>\1',
-            'db': r'\1<database>',
-            'db2': r'\1<database_instance>',
-            'db3': r'\1<schema>',
-            'db4': r'\1<\2>',
-            'db5': r'/user/hive/warehouse/<database>.db/<table>',
-            'generic': r'\1://<file>',
-            'generic2': r'\1<key>',
-            'generic3': r'\1<cluster>',
-            'generic4': r'\1<function>',
-            'generic5': r'\1<load_balancer_name>',
-            'hostname': r'<hostname>:\2',
-            #'hostname2': '<aws_hostname>',
-            'hostname2': r'<ip-x-x-x-x>',
-            'hostname3': r'\1<hostname>',
-            'hostname4': r'\\\\<hostname>',
-            'hostname5': r'\1<hostname>',
-            'hostname6': r'\1<hostname>',
-            'domain2': '@<domain>',
-            'port': ':<port>',
-            'user': r'\1<user>',
-            'user2': r'/\1/<user>',
-            'user3': r'\1<user>',
-            'user4': r'<domain>\\<user>',
-            'user5': 'for user <user>',
-            'user6': '<user>@',
-            'user7': r'\1<user>',
-            'user8': r'\1<account_id>\2<user>',
-            'group': r'\1<group>',
-            'group2': r'\1<group>',
-            'group3': r'for group <group>',
-            'group4': r'\1<group>',
-            'group5': r'\1<account_id>\2<group>',
-            'password': r'\1<password>',
-            'password2': r'\1<user>:<password>',
-            'password3': r'\1<user>\2<password>',
-            'password4': r'\1<token>',
-            'ip': r'<ip_x.x.x.x>/<cidr_mask>',
-            'ip2': r'<ip_x.x.x.x>',
-            'ip3': r'<ip-x-x-x-x>',
-            'ip_prefix': r'<ip_x.x.x>.\1/<cidr_mask>',
-            'ip_prefix2': r'<ip_x.x.x>.\1',
-            'ip_prefix3': r'<ip-x-x-x>.\1',
-            'subnet_mask': r'<subnet_x.x.x.x>',
-            'kerberos': r'host/\1@<domain>',
-            'kerberos2': r'host/<instance>@<domain>',
-            'kerberos3': r'<user>/\1@<domain>',
-            'kerberos4': r'<user>/<instance>@<domain>',
-            'kerberos5': '/krb5cc_<uid>',
-            #'kerberos6': r'<kerberos_principal>',
-            'email': '<user>@<domain>',
-            'ldap': ldap_lambda_lowercase,
-            'ldap2': ldap_lambda_lowercase,
-            'ldap3': ldap_lambda_lowercase,
-            'proxy': r'proxy <proxy_host> port <proxy_port>',
-            'proxy2': r'Connected to <proxy_host> (<proxy_ip>) port <proxy_port>',
-            'proxy3': r'\1<proxy_ip>',
-            'http_auth': r'$1<user>:<password>@',
-            'http_auth2': r'\1\'<proxy_user>\2\3/',
-            'http_auth3': r'Authorization: Basic <token>',
-            'http_auth4': r'\1<token>',
-            'cisco': r'username <username> password <password>',
-            'cisco2': r'password <cisco_password>',
-            'cisco3': r'secret <secret>',
-            'cisco4': r' md5 <md5>',
-            'cisco5': r' community <community>',
-            'cisco6': r'\1 <auth>',
-            'cisco7': r'remote-as <AS>',
-            'cisco8': r'description <cisco_description>',
-            'screenos': r'set admin \1 <anonymized>',
-            'screenos2': r'set snmp \1 <anonymized>',
-            'screenos3': r' md5 <md5>',
-            'screenos4': r' key <key>',
-            'screenos5': r'set nsmgmt init id <id>',
-            'screenos6': r'preshare <psk> ',
-            'junos': r'pre-shared-key <psk>',
-            'junos2': r' home <home>',
-            'network': r'username <username>',
-            'network2': r'syscontact <syscontact>',
-            'windows': r'<windows_SID>',
-        }
 
     def add_options(self):
         super(Anonymize, self).add_options()
@@ -585,6 +1306,14 @@ class Anonymize(CLI):
                           'container IDs, but someone with enough computing power and time could theoretically ' + \
                           'calculate the source hostnames so don\'t put these on the public internet, it is more ' + \
                           'for private vendor tickets')
+        self.add_opt('--hash-salt', metavar='<salt>', default=os.getenv('ANONYMIZE_HASH_SALT'),
+                     help='Salt for --hash-hostnames, keep this private to make the hashes hard to reverse and ' + \
+                          'set the same one wherever the same hostnames must hash the same ($ANONYMIZE_HASH_SALT, ' + \
+                          'default: derived from the source code of this program, which changes between versions)')
+        self.add_opt('--host-map', metavar='<file>',
+                     help='Record each hashed hostname and its hostname in this tab separated file shared with ' + \
+                          'any concurrent runs and --jobs workers, to be kept private and used to de-anonymize ' + \
+                          'output when needed. Requires --hash-hostnames and the same --hash-salt to reuse it')
         self.add_opt('-d', '--domain', action='store_true',
                      help='Apply domain format anonymization')
         self.add_opt('-F', '--fqdn', action='store_true',
@@ -641,6 +1370,104 @@ class Anonymize(CLI):
                      help='Skip lines with Python Tracebacks, similar to --skip-java-exceptions')
         self.add_opt('-e', '--skip-exceptions', action='store_true',
                      help='Skip both Java exceptions and Python tracebacks (recommended)')
+        self.add_opt('--tld-lookup', action='store_true',
+                     help='Faster --host / --domain / --fqdn anonymization using a generic dotted name scanner ' + \
+                          'and checking the last label against a set of IANA TLDs, instead of matching the huge ' + \
+                          'TLD regex alternation at every position, including the dotted names of host:port. May ' + \
+                          'differ from the default regex in rare edge cases such as hyphenated suffixes after a TLD')
+        self.add_opt('--regex-cache-dir', metavar='<dir>',
+                     help='Directory to cache the expanded regex pattern strings for each combination of ' + \
+                          'anonymizations in as JSON, keyed by a hash of this program, its libraries and the .conf ' + \
+                          'files, which saves building the patterns and merging the .conf files on each run but ' + \
+                          'not compiling them. Only the {} newest cache files are kept (default: disabled)'\
+                          .format(self.regex_cache_max_files))
+        self.add_opt('--regex-engine', default='re', metavar='<engine>',
+                     help='Regex engine to compile the rules with: re, regex (the regex module) or re2 ' + \
+                          '(Google RE2 bindings), falling back to re if it is not installed and, for re2, for ' + \
+                          'rules using lookaround or backreferences (default: re)')
+        self.add_opt('--benchmark-regex-engines', action='store_true',
+                     help='Anonymize the files in memory with each installed --regex-engine and print the time ' + \
+                          'each took and whether its output matched re, to choose the fastest engine for the ' + \
+                          'anonymizations given on your data, then exit')
+        self.add_opt('--jobs', default=1, type='int', metavar='<num>',
+                     help='Number of parallel worker processes to anonymize line aligned chunks of input with, ' + \
+                          'output order is preserved (default: 1, 0 means one per CPU core: {})'.format(cpu_count()))
+        self.add_opt('--block-size', default=0, type='int', metavar='<MB>',
+                     help='Anonymize input in line aligned blocks of this many MB, applying each rule in one pass ' + \
+                          'over the whole block where the rule cannot match across lines and only falling back to ' + \
+                          'line by line for the rest. Faster on large files (default: 0, anonymize line by line)')
+        self.add_opt('--bytes', action='store_true',
+                     help='Read, anonymize and write bytes instead of decoding / encoding every line, applying the ' + \
+                          'rules as bytes regex to ASCII lines. Lines with non-ASCII bytes or ANSI escape codes ' + \
+                          'are handled as text, decoded so that invalid UTF-8 and \\r\\n line endings are written ' + \
+                          'back out unchanged. Python 3 only')
+        self.add_opt('--output-dir', metavar='<dir>',
+                     help='Write the anonymized output of each file to a file of the same name in this directory ' + \
+                          'instead of to stdout. Inputs compressed with gzip, bzip2, xz or zstd, which are ' + \
+                          'always detected and decompressed automatically, are compressed the same way')
+        self.add_opt('--format', metavar='<format>',
+                     help='Anonymize the files as json, xml or yaml documents such as Ambari blueprints or Hadoop ' + \
+                          '*-site.xml configs, applying the rules only to string values and replacing the whole ' + \
+                          'value of keys named like passwords, users, groups, hosts or LDAP attributes, leaving ' + \
+                          'the keys, structure and layout unchanged. Not used with --bytes, --block-size, ' + \
+                          '--line-window, --line-cache or --follow, or --jobs without --recursive')
+        self.add_opt('-R', '--recursive', action='store_true',
+                     help='Anonymize all files under any directories given, writing each to the same relative path ' + \
+                          'under --output-dir, which is required. Files are skipped if their output is already ' + \
+                          'newer. With --jobs whole files are anonymized in parallel, largest first, instead of ' + \
+                          'chunks of each file. The throughput of each file is reported to stderr')
+        self.add_opt('--follow', action='store_true',
+                     help='Keep reading the files as they grow, like tail -F, anonymizing new lines as they are ' + \
+                          'appended and reopening files which are rotated (new inode) or truncated. Runs until ' + \
+                          'interrupted. Not used with stdin, compressed files, --jobs, --block-size or --line-window')
+        self.add_opt('--checkpoint-file', metavar='<file>',
+                     help='Save the byte offset of the last complete line anonymized from each file to this JSON ' + \
+                          'file in --follow mode and resume from it on restart instead of from the start of the ' + \
+                          'files. Outputs in --output-dir are appended to rather than overwritten')
+        self.add_opt('--poll-interval', default=self.poll_interval, type='float', metavar='<secs>',
+                     help='Max secs to sleep between checks for new data in --follow mode, the sleep starts short ' + \
+                          'and backs off up to this while the files are idle (default: {})'.format(self.poll_interval))
+        self.add_opt('--serve', metavar='<socket>',
+                     help='Run as a daemon answering anonymization requests on this Unix socket, keeping the ' + \
+                          'regex compiled between requests to avoid the startup cost per run. Clients send JSON ' + \
+                          '{"text": "...", "categories": ["email", "ip", ...]} prefixed by its length in bytes as ' + \
+                          'a 4 byte big endian int and get {"text": "..."} or {"error": "..."} back the same way. ' + \
+                          'Categories default to, and must be among, the anonymizations enabled for the server')
+        self.add_opt('--client', metavar='<socket>',
+                     help='Send the files or stdin to the anonymize.py --serve daemon on this Unix socket and ' + \
+                          'print the result, requesting the anonymizations given on the command line if any. ' + \
+                          'Options such as --hash-hostnames and --skip-exceptions are those of the server')
+        self.add_opt('--line-window', default=0, type='int', metavar='<chars>',
+                     help='Anonymize lines longer than this many chars, such as minified JSON, single line XML or ' + \
+                          'base64 blobs, in windows cut at whitespace, commas or quotes so memory and time stay ' + \
+                          'near linear with line length. Matches running past a window are still caught up to ' + \
+                          '--window-overlap chars. Not used with --block-size (default: 0, disabled)')
+        self.add_opt('--window-overlap', type='int', metavar='<chars>',
+                     help=('Chars a match may run past the end of a --line-window window and still be caught, ' + \
+                           'longer matches may be missed or truncated (default: {} or half of --line-window if ' + \
+                           'less)').format(self.window_overlap))
+        self.add_opt('--line-cache', default=0, type='int', metavar='<num>',
+                     help='Cache the anonymized output of up to this many distinct recent lines to skip the regex ' + \
+                          'for repeated lines such as heartbeats, GC and retry messages. Hits and misses are ' + \
+                          'reported to stderr at exit. Not used with --block-size (default: 0, disabled)')
+        self.add_opt('--rule-timeout', default=0, type='float', metavar='<secs>',
+                     help='Guard against regex backtracking pathologically on a line by interrupting any rule ' + \
+                          'which uses this many CPU seconds on one line (or block with --block-size) and exiting ' + \
+                          'with an error naming the rule and line. Detection may take up to twice this time ' + \
+                          '(default: 0, disabled)')
+        self.add_opt('--rule-timeout-chunk', action='store_true',
+                     help=('Instead of exiting when --rule-timeout is hit, re-apply the rule to the line in {} ' + \
+                           'char chunks split on whitespace, which bounds the backtracking. Rules which redact to ' + \
+                           'the end of the line still redact everything from the match to the real end of the ' + \
+                           'line, other matches spanning a chunk boundary are missed')\
+                          .format(self.rule_timeout_chunk_size))
+        self.add_opt('--profile-rules', action='store_true',
+                     help='Record the cumulative time, number of calls and number of substitutions of each rule ' + \
+                          'and category and print them sorted by time to stderr at exit, to find expensive rules ' + \
+                          'or rules which never match your data')
+        self.add_opt('--profile-json', metavar='<file>',
+                     help='Write the --profile-rules report to this file as JSON for comparing between runs ' + \
+                          '(implies --profile-rules)')
 
     def process_options(self):
         super(Anonymize, self).process_options()
@@ -649,6 +1476,109 @@ class Anonymize(CLI):
             self.file_list = set(files.split(','))
         self.file_list = self.file_list.union(self.args)
         self._validate_filenames()
+        self._process_options_jobs()
+        self._process_options_bytes()
+        self._process_options_output()
+        self._process_options_follow()
+        self._process_options_format()
+        self._process_options_line_window()
+        self._process_options_line_cache()
+        self._process_options_rule_timeout()
+        self._process_options_serve()
+        self._process_options_regex()
+        self._process_options_anonymizations()
+        self._process_options_host()
+        self.expand_anonymizations()
+        self._process_options_exceptions()
+        # the --client may leave it to the server
+        if not self._is_anonymization_selected() and not self.client_socket:
+            self.usage('must specify one or more anonymization types to apply')
+        if self.anonymizations['ip'] and self.anonymizations['ip_prefix']:
+            self.usage('cannot specify both --ip and --ip-prefix, they are mutually exclusive behaviours')
+
+    def _process_options_jobs(self):
+        self.jobs = self.get_opt('jobs')
+        validate_int(self.jobs, 'jobs', 0, 1000)
+        self.jobs = int(self.jobs)
+        if self.jobs == 0:
+            self.jobs = cpu_count()
+        if self.jobs > 1 and not hasattr(os, 'fork'):
+            self.usage('--jobs requires an operating system which supports fork()')
+
+    def _process_options_bytes(self):
+        block_size = self.get_opt('block_size')
+        validate_int(block_size, 'block size', 0, 1024)
+        self.block_size = int(block_size) * 1024 * 1024
+        self.bytes_mode = self.get_opt('bytes')
+        if not self.bytes_mode:
+            return
+        if not isPythonMinVersion(3):
+            self.usage('--bytes requires Python 3, Python 2 already anonymizes bytes')
+        if self.get_opt('block_size') or self.get_opt('line_window'):
+            self.usage('--bytes cannot be used with --block-size or --line-window')
+        self.anonymize_uncached = self.anonymize_bytes
+
+    def _process_options_output(self):
+        self.output_dir = self.get_opt('output_dir')
+        if self.output_dir and not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.recursive = self.get_opt('recursive')
+        if self.recursive:
+            if not self.output_dir:
+                self.usage('--recursive requires --output-dir')
+            if '-' in self.file_list:
+                self.usage('--recursive requires files or directories, not stdin')
+
+    def _process_options_line_window(self):
+        line_window = self.get_opt('line_window')
+        validate_int(line_window, 'line window', 0)
+        self.line_window = int(line_window)
+        window_overlap = self.get_opt('window_overlap')
+        if window_overlap is None:
+            if self.line_window:
+                self.window_overlap = max(1, min(self.window_overlap, self.line_window // 2))
+        else:
+            validate_int(window_overlap, 'window overlap', 1)
+            self.window_overlap = int(window_overlap)
+        if self.line_window:
+            if self.block_size:
+                self.usage('--line-window cannot be used with --block-size, which does not anonymize line by line')
+            if self.window_overlap >= self.line_window:
+                self.usage('--window-overlap must be less than --line-window')
+
+    def _process_options_line_cache(self):
+        line_cache_size = self.get_opt('line_cache')
+        validate_int(line_cache_size, 'line cache', 0, 100000000)
+        self.line_cache_size = int(line_cache_size)
+        if self.line_cache_size and self.block_size:
+            self.usage('--line-cache cannot be used with --block-size, which does not anonymize line by line')
+
+    def _process_options_rule_timeout(self):
+        self.rule_timeout = self.get_opt('rule_timeout')
+        validate_float(self.rule_timeout, 'rule timeout', 0, 3600)
+        self.rule_timeout = float(self.rule_timeout)
+        self.rule_timeout_chunk = self.get_opt('rule_timeout_chunk')
+        if self.rule_timeout_chunk and not self.rule_timeout:
+            self.usage('--rule-timeout-chunk requires --rule-timeout')
+        if self.rule_timeout and not hasattr(signal, 'setitimer'):
+            self.usage('--rule-timeout requires an operating system which supports setitimer()')
+        self.profile_json = self.get_opt('profile_json')
+        self.profile_rules = self.get_opt('profile_rules') or bool(self.profile_json)
+
+    def _process_options_regex(self):
+        self.tld_lookup = self.get_opt('tld_lookup')
+        regex_engine = self.get_opt('regex_engine')
+        if regex_engine not in self.regex_backends:
+            self.usage('invalid --regex-engine {}, must be one of: {}'
+                       .format(regex_engine, ', '.join(self.regex_backends)))
+        self.regex_backend = self.regex_backends[regex_engine]
+        if not self.regex_backend.is_available():
+            log.warning('regex engine %s is not installed, falling back to re', regex_engine)
+            self.regex_backend = self.regex_backends['re']
+        self.benchmark_regex_engines = self.get_opt('benchmark_regex_engines')
+        self.regex_cache_dir = self.get_opt('regex_cache_dir')
+
+    def _process_options_anonymizations(self):
         if self.get_opt('all'):
             for _ in self.anonymizations:
                 if _ == 'ip_prefix':
@@ -667,65 +1597,145 @@ class Anonymize(CLI):
                 else:
                     self.anonymizations[_] = self.get_opt(_)
                 log.debug('anonymization enabled %s = %s', _, bool(self.anonymizations[_]))
-        self._process_options_host()
-        self._process_options_network()
-        self._process_options_exceptions()
-        if not self._is_anonymization_selected():
-            self.usage('must specify one or more anonymization types to apply')
-        if self.anonymizations['ip'] and self.anonymizations['ip_prefix']:
-            self.usage('cannot specify both --ip and --ip-prefix, they are mutually exclusive behaviours')
-        if self.anonymizations['user']:
-            self.anonymizations['group'] = True
+
+    def _process_options_host(self):
+        if self.get_opt('hash_hostnames'):
+            self.enable_hash_hostnames(self.get_opt('hash_salt'))
+            if self.get_opt('host_map'):
+                if not fcntl:
+                    self.usage('--host-map requires an operating system which supports flock()')
+                try:
+                    self.host_map = HostMap(self.get_opt('host_map'), self.hash_salt)
+                except ValueError as _:
+                    self.usage(str(_))
+        elif self.get_opt('host_map'):
+            self.usage('--host-map requires --hash-hostnames')
+        if self.get_opt('host') or self.get_opt('hash_hostnames'):
+            for _ in ('hostname', 'fqdn', 'domain'):
+                self.anonymizations[_] = True
+
+    def _process_options_serve(self):
+        self.serve_socket = self.get_opt('serve')
+        self.client_socket = self.get_opt('client')
+        if not (self.serve_socket or self.client_socket):
+            return
+        if not hasattr(socket, 'AF_UNIX'):
+            self.usage('--serve / --client require an operating system which supports Unix sockets')
+        if self.serve_socket and self.client_socket:
+            self.usage('cannot specify both --serve and --client')
+        if self.serve_socket and (self.args or self.get_opt('files')):
+            self.usage('--serve anonymizes text sent to the socket, not files')
+        if self.jobs > 1 or self.block_size or self.line_window or self.line_cache_size or self.rule_timeout or \
+           self.bytes_mode or self.follow or self.recursive or self.output_dir or self.document_format:
+            self.usage('--serve / --client cannot be used with --jobs, --block-size, --line-window, --line-cache, ' + \
+                       '--rule-timeout, --bytes, --follow, --recursive, --output-dir or --format')
+
+    def _process_options_format(self):
+        self.document_format = self.get_opt('format')
+        if not self.document_format:
+            return
+        if self.document_format not in ('json', 'xml', 'yaml'):
+            self.usage('invalid --format {}, must be one of: json, xml, yaml'.format(self.document_format))
+        if self.bytes_mode or self.block_size or self.get_opt('line_window') or self.get_opt('line_cache') or \
+           self.follow or (self.jobs > 1 and not self.recursive):
+            self.usage('--format cannot be used with --bytes, --block-size, --line-window, --line-cache, --follow ' + \
+                       'or --jobs without --recursive')
+
+    def _process_options_follow(self):
+        self.follow = self.get_opt('follow')
+        self.checkpoint_file = self.get_opt('checkpoint_file')
+        self.poll_interval = self.get_opt('poll_interval')
+        validate_float(self.poll_interval, 'poll interval', 0.01, 3600)
+        self.poll_interval = float(self.poll_interval)
+        if not self.follow:
+            if self.checkpoint_file:
+                self.usage('--checkpoint-file requires --follow')
+            return
+        if '-' in self.file_list:
+            self.usage('--follow requires files, cannot follow stdin')
+        if self.jobs > 1 or self.get_opt('block_size') or self.get_opt('line_window') or self.recursive:
+            self.usage('--follow cannot be used with --jobs, --block-size, --line-window or --recursive')
+        for filename in self.file_list:
+            if self.get_file_compression(filename):
+                self.usage('--follow cannot be used with compressed file {}'.format(filename))
 
     def _validate_filenames(self):
         for filename in self.file_list:
             if filename == '-':
                 log_option('file', '<STDIN>')
+            elif self.get_opt('recursive') and os.path.isdir(filename):
+                log_option('directory', filename)
             else:
                 validate_file(filename)
         # use stdin
         if not self.file_list:
             self.file_list.add('-')
 
-    def _process_options_host(self):
+    def enable_hash_hostnames(self, salt=None):
+        if not salt:
+            with open(__file__, 'rb') as filehandle:
+                salt = md5(filehandle.read()).hexdigest()
+        self.hash_salt = salt
+        # will end up double hashing FQDNs that are already hashed to 12 char alnum
+        self.replacements['hostname'] = lambda match: r'{hostname}:{port}'\
+                                        .format(hostname=self.hash_host(match.group(1)), port=match.group(2))
+        self.replacements['hostname2'] = lambda match: r'{ip}'.format(ip=self.hash_host(match.group(1)))
+        self.replacements['hostname3'] = lambda match: r'{protocol}{hostname}'\
+                                         .format(protocol=match.group(1),
+                                                 hostname=self.hash_host(match.group(2))
+                                                )
+        self.replacements['hostname4'] = lambda match: r'\\{hostname}'\
+                                         .format(hostname=self.hash_host(match.group(1)))
+        self.replacements['hostname5'] = lambda match: r'{switch}{hostname}'\
+                                         .format(switch=match.group(1), hostname=self.hash_host(match.group(2)))
+        self.replacements['fqdn'] = lambda match: self.hash_host(match.group(1))
+
+    def expand_anonymizations(self):
+        """
+        Enables the anonymizations implied by those already enabled, from options or set_anonymizations()
+        """
         if self.anonymizations['ip'] or \
            self.anonymizations['ip_prefix']:
             self.anonymizations['subnet_mask'] = True
             self.anonymizations['mac'] = True
-        host = self.get_opt('host')
-        if self.get_opt('hash_hostnames'):
-            host = True
-            self.hash_salt = md5(open(__file__).read()).hexdigest()
-            # will end up double hashing FQDNs that are already hashed to 12 char alnum
-            self.replacements['hostname'] = lambda match: r'{hostname}:{port}'\
-                                            .format(hostname=self.hash_host(match.group(1)), port=match.group(2))
-            self.replacements['hostname2'] = lambda match: r'{ip}'.format(ip=self.hash_host(match.group(1)))
-            self.replacements['hostname3'] = lambda match: r'{protocol}{hostname}'\
-                                             .format(protocol=match.group(1),
-                                                     hostname=self.hash_host(match.group(2))
-                                                    )
-            self.replacements['hostname4'] = lambda match: r'\\{hostname}'\
-                                             .format(hostname=self.hash_host(match.group(1)))
-            self.replacements['hostname5'] = lambda match: r'{switch}{hostname}'\
-                                             .format(switch=match.group(1), hostname=self.hash_host(match.group(2)))
-            self.replacements['fqdn'] = lambda match: self.hash_host(match.group(1))
-        if host:
-            for _ in ('hostname', 'fqdn', 'domain'):
-                self.anonymizations[_] = True
         if self.anonymizations['kerberos']:
             self.anonymizations['email'] = True
             self.anonymizations['domain'] = True
             self.anonymizations['fqdn'] = True
         #if self.anonymizations['proxy']:
         #    self.anonymizations['http_auth'] = True
-
-    def _process_options_network(self):
         if self.anonymizations['network']:
             for _ in ('cisco', 'screenos', 'junos'):
                 self.anonymizations[_] = True
         for _ in ('cisco', 'screenos', 'junos'):
             if self.anonymizations[_]:
                 self.anonymizations['network'] = True
+        if self.anonymizations['user']:
+            self.anonymizations['group'] = True
+
+    def set_anonymizations(self, categories):
+        """
+        Enables the given anonymizations by name, plus 'all' and 'host' as per the command line options,
+        for using this class as a library without option parsing, see get_anonymizer()
+        """
+        categories = set(categories)
+        for category in categories:
+            if category == 'all':
+                for _ in self.anonymizations:
+                    self.anonymizations[_] = _ != 'ip_prefix'
+            elif category == 'host':
+                for _ in ('hostname', 'fqdn', 'domain'):
+                    self.anonymizations[_] = True
+            elif category in self.anonymizations:
+                self.anonymizations[category] = True
+            else:
+                raise ValueError('unknown anonymization: {}'.format(category))
+        if 'all' in categories and 'ip_prefix' in categories:
+            self.anonymizations['ip_prefix'] = True
+            self.anonymizations['ip'] = False
+        if self.anonymizations['ip'] and self.anonymizations['ip_prefix']:
+            raise ValueError('cannot anonymize both ip and ip_prefix, they are mutually exclusive behaviours')
+        self.expand_anonymizations()
 
     def _process_options_exceptions(self):
         if self.get_opt('skip_exceptions'):
@@ -746,7 +1756,15 @@ class Anonymize(CLI):
         #hashed_hostname = md5(self.hash_salt + shortname).hexdigest()[:12]
         #if domain:
         #    hashed_hostname += '.' + '<domain>'
-        hashed_hostname = md5(self.hash_salt + host).hexdigest()[:12]
+        # hostnames repeat a lot, especially in cluster logs
+        try:
+            return self.host_hashes[host]
+        except KeyError:
+            pass
+        hashed_hostname = md5((self.hash_salt + host).encode('utf-8')).hexdigest()[:12]
+        if self.host_map:
+            hashed_hostname = self.host_map.add(host, hashed_hostname)
+        self.host_hashes[host] = hashed_hostname
         return hashed_hostname
 
     def _is_anonymization_selected(self):
@@ -756,7 +1774,11 @@ class Anonymize(CLI):
         return False
 
     @staticmethod
-    def load_file(filename, boundary=False):
+    def add_boundary(regex):
+        return r'(?:(?<=\b)|(?<=[^A-Za-z]))' + regex + r'(?=\b|[^A-Za-z])'
+
+    @staticmethod
+    def read_patterns(filename):
         log.info('loading custom regex patterns from %s', filename)
         regex_list = []
         re_ending_pipe = re.compile(r'\|\s*$')
@@ -773,97 +1795,1527 @@ class Anonymize(CLI):
                 if not isRegex(line):
                     log.warning('ignoring invalid regex from %s: %s', os.path.basename(filename), line)
                     continue
-                if boundary:
-                    line = r'(?:(?<=\b)|(?<=[^A-Za-z]))' + line + r'(?=\b|[^A-Za-z])'
                 regex_list.append(line)
-        raw = '|'.join(regex_list)
-        #log.debug('custom_raw: %s', raw)
-        regex_list = [re.compile(_, re.I) for _ in regex_list]
-        return (regex_list, raw)
+        return regex_list
+
+    @staticmethod
+    def merge_phrases(patterns):
+        """
+        Merges a list of phrase patterns in to as few boundary wrapped regex as possible so they can be matched
+        in a single pass instead of one regex per phrase.
+
+        Runs of consecutive literal phrases are merged in to a trie regex, other regex are merged in to the same
+        alternation in file order so more specific phrases at the top still take precedence. Regex which are unsafe
+        to merge (backreferences, named groups or global inline flags) are kept as separate regex in sequence
+        """
+        re_literal = re.compile(r'^[^\\.^$*+?{}\[\]|()]+$')
+        re_unmergeable = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?[aiLmsux]+\)')
+        regex_list = []
+        alternatives = []
+        literals = []
+        num_literals = 0
+
+        def flush_literals():
+            if literals:
+                alternatives.append(Anonymize.trie_regex(literals))
+                del literals[:]
+
+        def flush_alternatives():
+            flush_literals()
+            if alternatives:
+                regex_list.append('(?:' + '|'.join(alternatives) + ')')
+                del alternatives[:]
+
+        for pattern in patterns:
+            if re_literal.match(pattern):
+                literals.append(pattern.lower())
+                num_literals += 1
+            elif re_unmergeable.search(pattern):
+                flush_alternatives()
+                regex_list.append(pattern)
+            else:
+                flush_literals()
+                alternatives.append('(?:' + pattern + ')')
+        flush_alternatives()
+        log.info('merged %s custom phrases (%s literals) in to %s regex', len(patterns), num_literals, len(regex_list))
+        return [Anonymize.add_boundary(_) for _ in regex_list]
+
+    @staticmethod
+    def trie_regex(words):
+        trie = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            # end of word marker
+            node[''] = {}
+
+        def build(node):
+            branches = [re.escape(char) + build(node[char]) for char in sorted(node) if char]
+            if not branches:
+                return ''
+            if len(branches) == 1 and '' not in node:
+                return branches[0]
+            regex = '(?:' + '|'.join(branches) + ')'
+            if '' in node:
+                regex += '?'
+            return regex
+
+        return build(trie)
+
+    def load_tlds(self):
+        tlds = set()
+        resources_dir = os.path.join(libdir, 'resources')
+        for filename in self.tld_files:
+            filename = os.path.join(resources_dir, filename)
+            if not os.path.isfile(filename):
+                continue
+            log.info('loading TLDs from %s', filename)
+            with open(filename) as filehandle:
+                for line in filehandle:
+                    line = line.split('#')[0].strip()
+                    if line:
+                        tlds.add(line.lower())
+        if not tlds:
+            die('no TLDs found to load for --tld-lookup in {}'.format(resources_dir))
+        log.info('loaded %s TLDs', len(tlds))
+        return frozenset(tlds)
 
     def run(self):
-        (self.custom_anonymizations, _) = self.load_file(self.custom_anonymization_file, boundary=True)
-        (self.custom_ignores, self.custom_ignores_raw) = self.load_file(self.custom_ignore_file)
+        if self.client_socket:
+            self.run_client()
+            return
+        if self.benchmark_regex_engines:
+            self.benchmark_engines()
+            return
         self.prepare_regex()
+        if self.rule_timeout:
+            self.start_rule_watchdog()
+        # before forking the --jobs workers so that they inherit the output paths mapped for get_output_file()
+        files = self.prepare_output_paths()
+        if self.jobs > 1:
+            self.pool = self.create_pool()
+        try:
+            self.process_input(files)
+        except BaseException:
+            if self.pool:
+                self.pool.terminate()
+            raise
+        finally:
+            if self.rule_timeout:
+                self.stop_rule_watchdog()
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+        self.report_stats()
+
+    def prepare_output_paths(self):
+        """
+        Maps the --output-dir paths for the inputs, dying if any collide, and returns the files found by --recursive
+        """
+        if self.recursive:
+            return self.find_files()
+        if self.output_dir:
+            self.check_output_paths(sorted(self.file_list))
+        return None
+
+    def process_input(self, files=None):
+        if self.follow:
+            self.follow_files()
+        elif self.serve_socket:
+            self.serve()
+        elif self.recursive:
+            self.process_tree(files)
+        else:
+            for filename in self.file_list:
+                self.process_file(filename)
+
+    def report_stats(self):
+        if self.line_cache_size:
+            self.report_line_cache()
+        if self.profile_rules:
+            self.report_rule_profile()
+
+    def benchmark_engines(self):
+        lines = []
         for filename in self.file_list:
-            self.process_file(filename)
+            (filehandle, _) = self.open_input(filename)
+            try:
+                lines.extend(filehandle)
+            finally:
+                if filehandle not in (sys.stdin, getattr(sys.stdin, 'buffer', None)):
+                    filehandle.close()
+        megabytes = sum([len(_) for _ in lines]) / 1024.0 / 1024
+        row = '{:<8} {:>10} {:>10} {:>10}  {}'
+        print(row.format('engine', 'seconds', 'MB/s', 'rules on re', 'output'))
+        expected = None
+        for backend in self.regex_backends.values():
+            if not backend.is_available():
+                print(row.format(backend.name, '', '', '', 'not installed'))
+                continue
+            self.regex_backend = backend
+            self.prepare_regex()
+            anonymize = self.anonymize_uncached
+            start = default_timer()
+            output = [anonymize(_) for _ in lines]
+            seconds = default_timer() - start
+            # re is first so is what the other engines are compared to
+            if expected is None:
+                expected = output
+            differences = len([_ for _ in zip(expected, output) if _[0] != _[1]])
+            print(row.format(backend.name, '{:.3f}'.format(seconds),
+                             '{:.2f}'.format(megabytes / seconds if seconds else 0),
+                             len(self.regex_fallbacks) if backend.name != 're' else '',
+                             '{} lines differ from re'.format(differences) if differences else 'same as re'))
+
+    def create_pool(self):
+        global worker_anonymizer  # pylint: disable=global-statement
+        log.info('starting %s worker processes', self.jobs)
+        # workers must be forked after prepare_regex() to inherit the compiled regex rather than each recompiling them
+        worker_anonymizer = self
+        try:
+            context = multiprocessing.get_context('fork')
+        except AttributeError:
+            # Python 2 always forks on Unix
+            context = multiprocessing
+        return context.Pool(processes=self.jobs, initializer=init_worker)
+
+    def start_rule_watchdog(self):
+        """
+        Ticks every --rule-timeout seconds of CPU time, interrupting any rule still running on the same line as at
+        the previous tick, including regex backtracking inside the re engine which checks for signals as it goes
+        """
+        signal.signal(signal.SIGVTALRM, self.rule_watchdog)
+        signal.setitimer(signal.ITIMER_VIRTUAL, self.rule_timeout, self.rule_timeout)
+
+    @staticmethod
+    def stop_rule_watchdog():
+        # otherwise a tick during interpreter shutdown after the handler is gone would kill the process
+        signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+
+    def rule_watchdog(self, signum, frame):  # pylint: disable=unused-argument
+        apply_rules_code = self.apply_rules.__func__.__code__
+        while frame is not None and frame.f_code is not apply_rules_code:
+            frame = frame.f_back
+        if frame is None:
+            # not applying rules, eg. reading input
+            self.rule_watchdog_state = None
+            return
+        name = frame.f_locals.get('name')
+        state = (self.apply_rules_count, name)
+        if state != self.rule_watchdog_state:
+            self.rule_watchdog_state = state
+            return
+        self.rule_watchdog_state = None
+        raise RuleTimeout('rule {} exceeded --rule-timeout of {} secs'.format(name, self.rule_timeout))
 
     # allow to easily switch pre-compilation on/off for testing
     # testing shows on a moderate sized file that it is a couple secs quicker to use pre-compiled regex
+    # re.M makes no difference to a single line but anchors ^ and $ at each line in --block-size mode
     def compile(self, name, regex):
-        self.regex[name] = re.compile(regex, re.I)
+        self.regex[name] = self.compile_rule(name, regex)
         #self.regex[name] = regex
 
+    def compile_rule(self, name, pattern):
+        backend = self.regex_backend
+        if backend.supports(pattern):
+            return backend.compile(pattern)
+        log.debug('rule %s is not supported by the %s regex engine, using re', name, backend.name)
+        self.regex_fallbacks.append(name)
+        return re.compile(pattern, re.I | re.M)
+
     def prepare_regex(self):
-        self.compile('hostname',
-                     r'(?<!\w\]\s)' + \
-                     r'(?<!\.)' + \
-                     # ignore Java methods such as SomeClass$method:20
-                     r'(?<!\$)' + \
-                     # ignore Java stack traces eg. at SomeClass(Thread.java;789)
-                     r'(?!\(\w+\.java:\d+\))' + \
-                     # don't match 2018-01-01T00:00:00 => 2018-01-<hostname>:00:00
-                     r'(?!\d+T\d+:\d+)' + \
-                     r'(?!\d+[^A-Za-z0-9]|' + \
-                     self.custom_ignores_raw + ')' + \
-                     '(' + hostname_regex + ')' + \
-                     self.negative_host_lookbehind + r':(\d{1,5}(?!\.?\w))',
-                    )
-        self.compile('domain',
-                     # don't match java -some.net.property
-                     #r'(?<!-)' + \
-                     r'(?!' + self.custom_ignores_raw + ')' + \
-                     domain_regex_strict + \
-                     # don't match java -Dsome.net.property=
-                     r'(?!=)' + \
-                     r'(?!\.[A-Za-z])(\b|$)' + \
-                     # ignore Java stack traces eg. at SomeClass(Thread.java;789)
-                     r'(?!\(\w+\.java:\d+\))' + \
-                     self.negative_host_lookbehind
-                    )
-        self.compile('fqdn',
-                     # don't match java -some.net.property
-                     #r'(?<!-)' + \
-                     r'(?!' + self.custom_ignores_raw + ')' + \
-                     '(' + fqdn_regex + ')' + \
-                     # don't match java -Dsome.net.property=
-                     r'(?!=)' + \
-                     r'(?!\.[A-Za-z])(\b|$)' + \
-                     # ignore Java stack traces eg. at SomeClass(Thread.java;789)
-                     r'(?!\(\w+\.java:\d+\))' + \
-                     self.negative_host_lookbehind
-                    )
+        cache_file = self.get_regex_cache_file()
+        patterns = self.load_regex_cache(cache_file)
+        if patterns is None:
+            patterns = self.build_patterns()
+            self.save_regex_cache(cache_file, patterns)
+        self.regex = {}
+        self.regex_fallbacks = []
+        for (name, regex) in patterns['regex'].items():
+            self.compile(name, regex)
+        self.custom_anonymizations = [self.compile_rule('custom', _) for _ in patterns['custom']]
+        if self.regex_fallbacks:
+            log.info('%s rules not supported by the %s regex engine are using re',
+                     len(self.regex_fallbacks), self.regex_backend.name)
+        (self.ignore_literals, ignore_regex) = patterns['ignore']
+        self.ignore_regex = [re.compile(_, re.I | re.M) for _ in ignore_regex]
+        self.tlds = patterns['tlds']
+        self.key_rules = [(category, re.compile(regex)) for (category, regex) in patterns['keys']]
+        for name in ('hostname', 'domain', 'fqdn'):
+            if name not in self.regex:
+                continue
+            if self.tld_lookup and name == 'hostname':
+                self.regex[name] = FilteredRegex(self.regex[name], self.is_tld_host_match)
+            elif self.tld_lookup:
+                self.regex[name] = FilteredRegex(self.regex[name], self.is_tld_match)
+            else:
+                self.regex[name] = FilteredRegex(self.regex[name], self.is_not_ignored)
+        self.pipeline = self.build_pipeline()
+        if self.block_size:
+            self.block_pipeline = self.build_block_pipeline()
+        if self.bytes_mode:
+            self.bytes_pipeline = self.build_bytes_pipeline()
+
+    def build_pipeline(self, anonymizations=None):
+        """
+        Flattens the enabled anonymizations, or the given subset of them, into an ordered list of
+        (name, subn, replacement, required_literals, is_host_rule) steps
+
+        This is done once per run so that anonymize() doesn't have to do any method dispatch,
+        numbered name formatting or dict lookups per line
+        """
+        if anonymizations is None:
+            anonymizations = self.anonymizations
+        pipeline = []
+        for category in self.anonymizations:
+            if not anonymizations[category]:
+                continue
+            if category == 'custom':
+                for (i, regex) in enumerate(self.custom_anonymizations, 1):
+                    name = 'custom{}'.format(i) if i > 1 else 'custom'
+                    regex = self.profile_regex(name, category, regex)
+                    pipeline.append((name, regex.subn, r'<custom>', None, False))
+                continue
+            # host rules are skipped on Java exception / Python traceback lines, see skip_exceptions()
+            is_host_rule = category in ('hostname', 'domain', 'fqdn')
+            for name in self.rule_names(category):
+                regex = self.profile_regex(name, category, self.regex[name])
+                replacement = self.replacements.get(name, '<{}>'.format(name))
+                pipeline.append((name, regex.subn, replacement,
+                                 self.required_literals.get(name), is_host_rule))
+        return pipeline
+
+    def profile_regex(self, name, category, regex):
+        if not self.profile_rules:
+            return regex
+        self.rule_categories[name] = category
+        return ProfiledRegex(regex, self.rule_stats.setdefault(name, [0.0, 0, 0]))
+
+    def take_stats(self):
+        """
+        Returns and resets the line cache and rule profiling counters, used by --jobs workers to pass them back
+        """
+        stats = (self.line_cache_hits, self.line_cache_misses,
+                 dict([(name, list(_)) for (name, _) in self.rule_stats.items()]))
+        self.line_cache_hits = 0
+        self.line_cache_misses = 0
+        # reset in place as these lists are shared with the ProfiledRegex in the pipeline
+        for _ in self.rule_stats.values():
+            _[:] = [0.0, 0, 0]
+        return stats
+
+    def add_stats(self, stats):
+        (hits, misses, rule_stats) = stats
+        self.line_cache_hits += hits
+        self.line_cache_misses += misses
+        for (name, (seconds, calls, subs)) in rule_stats.items():
+            totals = self.rule_stats[name]
+            totals[0] += seconds
+            totals[1] += calls
+            totals[2] += subs
+
+    def report_rule_profile(self):
+        rules = []
+        categories = OrderedDict()
+        for (name, (seconds, calls, subs)) in self.rule_stats.items():
+            category = self.rule_categories[name]
+            rules.append((name, category, seconds, calls, subs))
+            totals = categories.setdefault(category, [0.0, 0, 0])
+            totals[0] += seconds
+            totals[1] += calls
+            totals[2] += subs
+        rules.sort(key=lambda _: _[2], reverse=True)
+        total_seconds = sum([_[2] for _ in rules])
+        row = '{:<20} {:<12} {:>10} {:>6} {:>12} {:>12}'
+        print(row.format('rule', 'category', 'seconds', '%', 'calls', 'substitutions'), file=sys.stderr)
+        for (name, category, seconds, calls, subs) in rules:
+            percent = 100.0 * seconds / total_seconds if total_seconds else 0
+            print(row.format(name, category, '{:.3f}'.format(seconds), '{:.1f}'.format(percent), calls, subs),
+                  file=sys.stderr)
+        print(file=sys.stderr)
+        print(row.format('category', '', 'seconds', '%', 'calls', 'substitutions'), file=sys.stderr)
+        for (category, (seconds, calls, subs)) in sorted(categories.items(), key=lambda _: _[1][0], reverse=True):
+            percent = 100.0 * seconds / total_seconds if total_seconds else 0
+            print(row.format(category, '', '{:.3f}'.format(seconds), '{:.1f}'.format(percent), calls, subs),
+                  file=sys.stderr)
+        if self.profile_json:
+            report = {
+                'rules': dict([(name, {'category': category,
+                                       'seconds': seconds,
+                                       'calls': calls,
+                                       'substitutions': subs})
+                               for (name, category, seconds, calls, subs) in rules]),
+                'categories': dict([(category, {'seconds': seconds,
+                                                'calls': calls,
+                                                'substitutions': subs})
+                                    for (category, (seconds, calls, subs)) in categories.items()]),
+                'total_seconds': total_seconds,
+            }
+            with open(self.profile_json, 'w') as filehandle:
+                json.dump(report, filehandle, indent=4, sort_keys=True)
+            log.info('wrote rule profile to %s', self.profile_json)
+
+    def build_block_pipeline(self):
+        """
+        Splits the pipeline in to consecutive segments of rules which are safe to apply to a whole multi-line block
+        at once and those which must be applied per line, preserving the order the rules are applied in
+        """
+        # host rules check the whole line for exceptions and the ignore regex can look past the end of a line
+        host_rules_line_safe = not any(self.exceptions.values()) and \
+                               not any(self.re_line_unsafe.search(_.pattern) for _ in self.ignore_regex)
+        segments = []
+        per_line = []
+        for step in self.pipeline:
+            (name, subn, _, _, is_host_rule) = step
+            is_line_safe = not self.re_line_unsafe.search(subn.__self__.pattern)
+            if is_host_rule:
+                is_line_safe = is_line_safe and host_rules_line_safe
+            if not is_line_safe:
+                per_line.append(name)
+            if segments and segments[-1][0] == is_line_safe:
+                segments[-1][1].append(step)
+            else:
+                segments.append((is_line_safe, [step]))
+        log.info('block mode: applying %s of %s rules per line: %s',
+                 len(per_line), len(self.pipeline), ', '.join(per_line))
+        return segments
+
+    def build_bytes_pipeline(self):
+        """
+        Splits the pipeline in to segments of rules recompiled as bytes regex and those left as text,
+        which are any whose pattern can't be ASCII encoded or compiled as bytes
+        """
+        segments = []
+        text_rules = []
+        for step in self.pipeline:
+            bytes_step = None
+            try:
+                bytes_step = self.bytes_step(step)
+            except (UnicodeEncodeError, re.error) as _:
+                log.debug('cannot compile rule %s as bytes: %s', step[0], _)
+                text_rules.append(step[0])
+            is_bytes = bytes_step is not None
+            if segments and segments[-1][0] == is_bytes:
+                segments[-1][1].append(bytes_step or step)
+            else:
+                segments.append((is_bytes, [bytes_step or step]))
+        log.info('bytes mode: applying %s of %s rules as text: %s',
+                 len(text_rules), len(self.pipeline), ', '.join(text_rules))
+        return segments
+
+    def bytes_step(self, step):
+        """
+        Returns a pipeline step recompiled as a bytes regex, with any host filter and replacement function
+        given the matches as AsciiMatch since bytes rules are only applied to ASCII lines
+        """
+        (name, subn, replacement, required_literals, is_host_rule) = step
+        regex = subn.__self__
+        if isinstance(regex, ProfiledRegex):
+            regex = regex.regex
+        bytes_regex = re.compile(regex.pattern.encode('ascii'), re.I | re.M)
+        if isinstance(regex, FilteredRegex):
+            accept = regex.accept
+            bytes_regex = FilteredRegex(bytes_regex, lambda match: accept(AsciiMatch(match)))
+        bytes_regex = self.profile_regex(name, self.rule_categories.get(name), bytes_regex)
+        if callable(replacement):
+            replacement = self.bytes_replacement(replacement)
+        else:
+            replacement = replacement.encode('ascii')
+        if required_literals:
+            required_literals = tuple([_.encode('ascii') for _ in required_literals])
+        return (name, bytes_regex.subn, replacement, required_literals, is_host_rule)
+
+    @staticmethod
+    def bytes_replacement(replacement):
+        def replace(match):
+            return replacement(AsciiMatch(match)).encode('utf-8')
+        return replace
+
+    def build_patterns(self):
+        """
+        Returns the fully expanded regex pattern strings for the enabled anonymizations along with the merged
+        custom phrases and ignores, which is everything needed by prepare_regex() and what gets cached to disk
+        """
+        self.build_regex()
+        if self.tld_lookup:
+            self.prepare_regex_tld_lookup()
+        else:
+            self.prepare_regex_host()
         re_regex_ending = re.compile('_regex$')
         # auto-populate any *_regex to self.regex[name] = name_regex
         for _ in globals():
             if re_regex_ending.search(_) and \
                     re_regex_ending.sub('', _) not in self.regex:
                 self.regex[re.sub('_regex$', '', _)] = globals()[_]
-        for _ in self.regex:
-            if isStr(self.regex[_]):
-                self.compile(_, self.regex[_])
+        custom = []
+        if self.anonymizations['custom']:
+            custom = self.merge_phrases(self.read_patterns(self.custom_anonymization_file))
+        return {
+            # only the regex which will be used so the rest don't get compiled
+            'regex': dict([(_, self.regex[_]) for _ in self.enabled_rule_names()]),
+            'custom': custom,
+            'ignore': self.merge_ignores(self.read_patterns(self.custom_ignore_file)),
+            'tlds': self.tlds,
+            'keys': [(_, self.key_regex[_]) for _ in self.key_regex if self.anonymizations[_]],
+        }
+
+    def enabled_rule_names(self):
+        names = []
+        for name in self.anonymizations:
+            if self.anonymizations[name]:
+                names += self.rule_names(name)
+        return names
+
+    def rule_names(self, name):
+        """
+        Returns the regex names for a given anonymization in the order they are applied,
+        ie. the name itself followed by any numbered variants name2, name3 ... up to name100
+        """
+        names = []
+        if name in self.regex:
+            names.append(name)
+        for i in range(2, 101):
+            name2 = '{}{}'.format(name, i)
+            if name2 not in self.regex:
+                break
+            names.append(name2)
+        return names
+
+    def get_regex_cache_file(self):
+        if not self.regex_cache_dir:
+            return None
+        hasher = sha1()
+        filenames = [__file__, sys.modules[CLI.__module__].__file__, sys.modules[log_option.__module__].__file__,
+                     self.custom_anonymization_file, self.custom_ignore_file]
+        if self.tld_lookup:
+            filenames += [os.path.join(libdir, 'resources', _) for _ in self.tld_files]
+        for filename in filenames:
+            if os.path.isfile(filename):
+                with open(filename, 'rb') as filehandle:
+                    hasher.update(filehandle.read())
+        enabled = [_ for _ in self.anonymizations if self.anonymizations[_]]
+        hasher.update(repr((sys.version_info[:2], enabled, self.tld_lookup)).encode('utf-8'))
+        return os.path.join(self.regex_cache_dir, 'anonymize-{}.json'.format(hasher.hexdigest()))
+
+    @staticmethod
+    def load_regex_cache(cache_file):
+        if not cache_file or not os.path.isfile(cache_file):
+            return None
+        try:
+            with open(cache_file) as filehandle:
+                patterns = json.load(filehandle)
+            # JSON has no sets or int keys
+            (literals, ignore_regex) = patterns['ignore']
+            literals = dict([(int(length), set(_)) for (length, _) in literals.items()])
+            patterns['ignore'] = (literals, ignore_regex)
+            patterns['tlds'] = frozenset(patterns['tlds'])
+        except (IOError, OSError, ValueError, KeyError, TypeError) as _:
+            log.warning('ignoring unreadable regex cache file %s: %s', cache_file, _)
+            return None
+        try:
+            # so pruning removes the least recently used cache files
+            os.utime(cache_file, None)
+        except OSError:
+            pass
+        log.info('loaded regex from cache file %s', cache_file)
+        return patterns
+
+    def save_regex_cache(self, cache_file, patterns):
+        if not cache_file:
+            return
+        cache_dir = os.path.dirname(cache_file)
+        (literals, ignore_regex) = patterns['ignore']
+        patterns = dict(patterns)
+        patterns['ignore'] = (dict([(length, sorted(_)) for (length, _) in literals.items()]), ignore_regex)
+        patterns['tlds'] = sorted(patterns['tlds'])
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o700)
+            # write and rename so concurrent runs never read a partially written cache file
+            (filehandle, tmp_file) = tempfile.mkstemp(dir=cache_dir, prefix='.anonymize-')
+            with os.fdopen(filehandle, 'w') as filehandle:
+                json.dump(patterns, filehandle)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError) as _:
+            log.warning('failed to write regex cache file %s: %s', cache_file, _)
+            return
+        log.info('saved regex to cache file %s', cache_file)
+        self.prune_regex_cache(cache_dir)
+
+    def prune_regex_cache(self, cache_dir):
+        cache_files = [os.path.join(cache_dir, _) for _ in os.listdir(cache_dir)
+                       if _.startswith('anonymize-') and _.endswith('.json')]
+        cache_files.sort(key=os.path.getmtime, reverse=True)
+        for cache_file in cache_files[self.regex_cache_max_files:]:
+            try:
+                os.unlink(cache_file)
+            except OSError as _:
+                # eg. already removed by a concurrent run
+                log.debug('failed to remove old regex cache file %s: %s', cache_file, _)
+
+    def prepare_regex_host(self):
+        self.regex['hostname'] = (r'(?<!\w\]\s)' + \
+                                  r'(?<!\.)' + \
+                                  # ignore Java methods such as SomeClass$method:20
+                                  r'(?<!\$)' + \
+                                  # ignore Java stack traces eg. at SomeClass(Thread.java;789)
+                                  r'(?!\(\w+\.java:\d+\))' + \
+                                  # don't match 2018-01-01T00:00:00 => 2018-01-<hostname>:00:00
+                                  r'(?!\d+T\d+:\d+)' + \
+                                  r'(?!\d+[^A-Za-z0-9])' + \
+                                  '(' + hostname_regex + ')' + \
+                                  self.negative_host_lookbehind + r':(\d{1,5}(?!\.?\w))')
+        # don't match java -some.net.property
+        #r'(?<!-)' + \
+        self.regex['domain'] = (domain_regex_strict + \
+                                # don't match java -Dsome.net.property=
+                                r'(?!=)' + \
+                                r'(?!\.[A-Za-z])(\b|$)' + \
+                                # ignore Java stack traces eg. at SomeClass(Thread.java;789)
+                                r'(?!\(\w+\.java:\d+\))' + \
+                                self.negative_host_lookbehind)
+        # don't match java -some.net.property
+        #r'(?<!-)' + \
+        self.regex['fqdn'] = ('(' + fqdn_regex + ')' + \
+                              # don't match java -Dsome.net.property=
+                              r'(?!=)' + \
+                              r'(?!\.[A-Za-z])(\b|$)' + \
+                              # ignore Java stack traces eg. at SomeClass(Thread.java;789)
+                              r'(?!\(\w+\.java:\d+\))' + \
+                              self.negative_host_lookbehind)
+
+    def prepare_regex_tld_lookup(self):
+        # avoids the regex in prepare_regex_host() which contain the full IANA TLD alternation
+        self.tlds = self.load_tlds()
+        label = r'[A-Za-z0-9](?:[A-Za-z0-9_-]{0,61}[A-Za-z0-9])?'
+        tld = r'[A-Za-z][A-Za-z0-9-]*[A-Za-z0-9]'
+        self.regex['hostname'] = (r'(?<!\w\]\s)' + \
+                                  r'(?<!\.)' + \
+                                  r'(?<!\$)' + \
+                                  r'(?!\(\w+\.java:\d+\))' + \
+                                  r'(?!\d+T\d+:\d+)' + \
+                                  r'(?!\d+[^A-Za-z0-9])' + \
+                                  r'(\b{label}(?:\.{label})*)'.format(label=label) + \
+                                  self.negative_host_lookbehind + r':(\d{1,5}(?!\.?\w))')
+        # group 1 is the whole name as used by --hash-hostnames, group 2 is the last label to check against the TLDs
+        dotted_name_regex = r'(\b(?:{label}\.)+({tld}))'.format(label=label, tld=tld) + \
+                            r'(?!=)' + \
+                            r'(?!\.[A-Za-z])(\b|$)' + \
+                            r'(?!\(\w+\.java:\d+\))'
+        self.regex['domain'] = dotted_name_regex
+        self.regex['fqdn'] = dotted_name_regex
+
+    def is_tld_match(self, match):
+        if match.group(2).lower() not in self.tlds:
+            return False
+        # equivalent of self.negative_host_lookbehind
+        if match.group(1)[-8:].lower().endswith(self.host_ignore_suffixes):
+            return False
+        return self.is_not_ignored(match)
+
+    def is_tld_host_match(self, match):
+        # a dotted host:port must end in a TLD, so Java com.foo.MyClass.method:20 and db.table:5 are left alone
+        name = match.group(1)
+        if '.' in name and name[name.rindex('.') + 1:].lower() not in self.tlds:
+            return False
+        return self.is_not_ignored(match)
+
+    @staticmethod
+    def merge_ignores(patterns):
+        # applied as a filter on each host / domain / fqdn match rather than spliced in to negative lookaheads in
+        # those regex, where the whole ignore alternation was re-evaluated at every candidate position
+        re_literal = re.compile(r'^[^\\.^$*+?{}\[\]|()]+$')
+        literals = {}
+        regex_list = []
+        for pattern in patterns:
+            if re_literal.match(pattern):
+                literals.setdefault(len(pattern), set()).add(pattern.lower())
+            else:
+                regex_list.append(pattern)
+        # merge regex in to one alternation unless they contain backreferences which would be renumbered
+        # or named groups which may be redefined by another pattern
+        mergeable = [_ for _ in regex_list if not re.search(r'\\[1-9]|\(\?P[<=]', _)]
+        merged = [_ for _ in regex_list if _ not in mergeable]
+        if mergeable:
+            merged.insert(0, '|'.join('(?:{})'.format(_) for _ in mergeable))
+        log.info('merged %s ignore patterns (%s literals) in to %s regex',
+                 len(patterns), len(patterns) - len(regex_list), len(merged))
+        return (literals, merged)
+
+    def is_not_ignored(self, match):
+        # equivalent of a negative lookahead of the ignore patterns at the start of the match
+        string = match.string
+        start = match.start()
+        for (length, literals) in self.ignore_literals.items():
+            if string[start:start + length].lower() in literals:
+                return False
+        for regex in self.ignore_regex:
+            if regex.match(string, start):
+                return False
+        return True
+
+    def get_line_anonymizer(self):
+        if self.line_cache_size:
+            return self.anonymize_cached
+        return self.anonymize_uncached
+
+    def anonymize_cached(self, line):
+        # --hash-hostnames is deterministic for the salt of a given run so is safe to cache too
+        line_cache = self.line_cache
+        try:
+            # pop and re-insert to move to most recently used, OrderedDict.move_to_end() is Python 3 only
+            result = line_cache.pop(line)
+            self.line_cache_hits += 1
+        except KeyError:
+            result = self.anonymize_uncached(line)
+            self.line_cache_misses += 1
+            if len(line_cache) >= self.line_cache_size:
+                line_cache.popitem(last=False)
+        line_cache[line] = result
+        return result
+
+    def report_line_cache(self):
+        total = self.line_cache_hits + self.line_cache_misses
+        hit_rate = 100.0 * self.line_cache_hits / total if total else 0
+        print('line cache: {} hits, {} misses, {:.1f}% hit rate'
+              .format(self.line_cache_hits, self.line_cache_misses, hit_rate), file=sys.stderr)
+
+    def find_files(self):
+        """
+        Returns the files to anonymize, walking any directories and mapping each file found to its path relative
+        to the directory for get_output_file()
+        """
+        files = []
+        output_dir = os.path.realpath(self.output_dir)
+        for path in sorted(self.file_list):
+            if not os.path.isdir(path):
+                files.append(path)
+                self.output_paths[path] = os.path.basename(path)
+                continue
+            for (root, dirs, filenames) in os.walk(path):
+                # don't anonymize our own output if --output-dir is under the input directory
+                dirs[:] = [_ for _ in dirs if os.path.realpath(os.path.join(root, _)) != output_dir]
+                for filename in filenames:
+                    filename = os.path.join(root, filename)
+                    files.append(filename)
+                    self.output_paths[filename] = os.path.relpath(filename, path)
+        self.check_output_paths(files)
+        return files
+
+    def check_output_paths(self, files):
+        """
+        Dies if any two of the files would be written to the same path in --output-dir rather than one silently
+        overwriting the other, eg. a/app.log and b/app.log without --recursive
+        """
+        seen = {}
+        for filename in files:
+            output_path = self.output_paths.setdefault(filename, self.get_output_path(filename))
+            if output_path in seen:
+                die('cannot write both {} and {} to {} in --output-dir'
+                    .format(seen[output_path], filename, output_path))
+            seen[output_path] = filename
+
+    def is_up_to_date(self, filename):
+        output_file = self.get_output_file(filename, self.get_file_compression(filename))
+        return os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(filename)
+
+    def process_tree(self, files):
+        todo = [_ for _ in files if not self.is_up_to_date(_)]
+        if len(todo) < len(files):
+            log.info('skipping %s files whose output is already up to date', len(files) - len(todo))
+        # largest first so the big files aren't left running on their own at the end while the other workers are idle
+        todo.sort(key=os.path.getsize, reverse=True)
+        start = default_timer()
+        total_size = 0
+        if self.pool:
+            results = self.pool.imap_unordered(anonymize_file, todo)
+        else:
+            results = (self.process_file_timed(_) for _ in todo)
+        try:
+            for result in results:
+                if self.pool:
+                    self.add_stats(result[-1])
+                (filename, output_file, size, seconds) = result[:4]
+                total_size += size
+                self.report_throughput('{} => {}'.format(filename, output_file), size, seconds)
+        except RuntimeError as _:
+            die(str(_))
+        self.report_throughput('total {} files'.format(len(todo)), total_size, default_timer() - start)
+
+    @staticmethod
+    def report_throughput(name, size, seconds):
+        megabytes = size / 1024.0 / 1024
+        print('{}: {:.2f} MB in {:.2f} secs, {:.2f} MB/s'
+              .format(name, megabytes, seconds, megabytes / seconds if seconds else 0), file=sys.stderr)
+
+    def process_file_timed(self, filename):
+        """
+        Anonymizes a file to --output-dir, removing any partial output on failure so it isn't mistaken for up to date
+        """
+        output_file = self.get_output_file(filename, self.get_file_compression(filename))
+        start = default_timer()
+        try:
+            self.process_file(filename)
+        except BaseException:
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+            raise
+        return (filename, output_file, os.path.getsize(filename), default_timer() - start)
 
     def process_file(self, filename):
-        anonymize = self.anonymize
         # will be caught be generic handler and exit if the filename isn't readable,
         # don't want to pass on this as our output would be incomplete - better to fail in a noticeable way
+        (filehandle, compression) = self.open_input(filename)
+        try:
+            output = self.open_output(filename, compression)
+            try:
+                self.process_filehandle(filename, filehandle, output.write)
+            finally:
+                if output not in (sys.stdout, getattr(sys.stdout, 'buffer', None)):
+                    output.close()
+        finally:
+            if filehandle not in (sys.stdin, getattr(sys.stdin, 'buffer', None)):
+                filehandle.close()
+
+    def process_filehandle(self, filename, filehandle, write):
+        if self.document_format:
+            self.process_file_document(filename, filehandle, write)
+            return
+        anonymize = self.get_line_anonymizer()
+        try:
+            if self.pool:
+                self.process_file_parallel(filename, filehandle, write)
+                return
+            if self.block_size:
+                self.process_file_blocks(filehandle, write)
+                return
+        except RuleTimeout as _:
+            # already qualified with the line numbers
+            die('{} {}'.format(filename, _))
+        if self.line_window:
+            self.process_file_windowed(filename, filehandle, anonymize, write)
+        else:
+            self.process_file_lines(filename, filehandle, anonymize, write)
+
+    def process_file_document(self, filename, filehandle, write):
+        try:
+            write(self.anonymize_document(filehandle.read()))
+        except ValueError as _:
+            die('{}: invalid {} document: {}'.format(filename, self.document_format, _))
+
+    @staticmethod
+    def process_file_lines(filename, filehandle, anonymize, write):
         lineno = 0
         try:
-            if filename == '-':
-                for line in sys.stdin:
-                    lineno += 1
-                    line = anonymize(line)
-                    print(line, end='')
+            for line in filehandle:
+                lineno += 1
+                write(anonymize(line))
+        except AssertionError as _:
+            raise AssertionError('{} line {}: {}'.format(filename, lineno, _))
+        except RuleTimeout as _:
+            die('{} line {}: {}'.format(filename, lineno, _))
+
+    def follow_files(self):
+        """
+        Tails the files like tail -F until interrupted, anonymizing complete lines as they are appended
+
+        Reads up to follow_batch_size bytes per file per pass without sleeping while there is new data, backing off
+        exponentially up to --poll-interval while idle. The byte offset of the end of the last complete line written
+        out for each file is saved to the --checkpoint-file at most every checkpoint_interval secs, when idle and at
+        exit
+        """
+        checkpoints = self.load_checkpoints()
+        anonymize = self.get_line_anonymizer()
+        followed = []
+        # exit via the finally below to save the checkpoint on SIGTERM from service managers as well as on Control-C
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+        delay = self.follow_min_delay
+        unsaved = False
+        last_saved = time.time()
+        try:
+            for filename in sorted(self.file_list):
+                followed.append(self.open_followed(filename, checkpoints.get(os.path.abspath(filename))))
+            while True:
+                bytes_read = 0
+                for state in followed:
+                    bytes_read += self.follow_file(state, anonymize)
+                if bytes_read:
+                    unsaved = True
+                    delay = self.follow_min_delay
+                    if time.time() - last_saved < self.checkpoint_interval:
+                        continue
+                if unsaved:
+                    self.save_checkpoints(checkpoints, followed)
+                    unsaved = False
+                    last_saved = time.time()
+                if not bytes_read:
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.save_checkpoints(checkpoints, followed)
+            for state in followed:
+                state['filehandle'].close()
+                if state['output'] not in (sys.stdout, getattr(sys.stdout, 'buffer', None)):
+                    state['output'].close()
+
+    def open_followed(self, filename, checkpoint):
+        """
+        Opens the file in binary mode for reliable byte offsets, seeking to the checkpoint if it is still valid,
+        and returns the follow state of the file
+        """
+        filehandle = open(filename, 'rb')
+        inode = os.fstat(filehandle.fileno()).st_ino
+        offset = 0
+        if checkpoint:
+            if checkpoint['inode'] != inode:
+                log.warning('%s has been rotated since the checkpoint, reading from the start of the new file',
+                            filename)
+            elif checkpoint['offset'] > os.fstat(filehandle.fileno()).st_size:
+                log.warning('%s has been truncated since the checkpoint, reading from the start', filename)
             else:
-                with open(filename) as filehandle:
-                    for line in filehandle:
-                        lineno += 1
-                        line = anonymize(line)
-                        print(line, end='')
+                offset = checkpoint['offset']
+                log.info('resuming %s from byte offset %s', filename, offset)
+                filehandle.seek(offset)
+        # append to the output written before the checkpoint rather than overwrite it
+        output = self.open_output(filename, None, append=bool(self.checkpoint_file))
+        return {
+            'filename': filename,
+            'path': os.path.abspath(filename),
+            'filehandle': filehandle,
+            'inode': inode,
+            # end of the last complete line written out, any partial line after it is held back until completed
+            'offset': offset,
+            'partial': b'',
+            'output': output,
+        }
+
+    def follow_file(self, state, anonymize):
+        """
+        Anonymizes the complete lines in the next batch of data appended to a followed file
+        and returns the number of bytes read, reopening the file if it has been rotated or truncated
+        """
+        filehandle = state['filehandle']
+        data = filehandle.read(self.follow_batch_size)
+        if not data:
+            return self.follow_rotated(state, anonymize)
+        data = state['partial'] + data
+        end = data.rfind(b'\n') + 1
+        state['partial'] = data[end:]
+        if end:
+            self.write_followed(state, data[:end], anonymize)
+            state['offset'] = filehandle.tell() - len(state['partial'])
+        return len(data)
+
+    def follow_rotated(self, state, anonymize):
+        """
+        Checks the path of a followed file which has no new data for a new inode (rotated) or a size smaller than what
+        has been read (truncated) and reopens it or seeks back to the start, returning 1 if so to read it right away
+        """
+        filename = state['filename']
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            # rotated away and not yet recreated
+            return 0
+        if stat.st_ino != state['inode']:
+            log.info('%s has been rotated, following the new file', filename)
+            # the old file has been read to the end, so any partial last line is never going to be completed
+            if state['partial']:
+                self.write_followed(state, state['partial'] + b'\n', anonymize)
+            state['filehandle'].close()
+            state['filehandle'] = open(filename, 'rb')
+            state['inode'] = os.fstat(state['filehandle'].fileno()).st_ino
+        elif stat.st_size < state['filehandle'].tell():
+            log.warning('%s has been truncated, reading from the start', filename)
+            state['filehandle'].seek(0)
+        else:
+            return 0
+        state['offset'] = 0
+        state['partial'] = b''
+        return 1
+
+    def write_followed(self, state, data, anonymize):
+        if self.bytes_mode or not isPythonMinVersion(3):
+            lines = io.BytesIO(data)
+        else:
+            # decoded as in the one-shot text mode, but replacing undecodable bytes rather than dying part way through
+            # tailing a log, --bytes passes them through unchanged
+            lines = io.TextIOWrapper(io.BytesIO(data), errors='replace')
+        output = state['output']
+        try:
+            for line in lines:
+                output.write(anonymize(line))
+        except RuleTimeout as _:
+            die('{} byte offset {}: {}'.format(state['filename'], state['offset'], _))
+        output.flush()
+
+    def load_checkpoints(self):
+        if not self.checkpoint_file or not os.path.exists(self.checkpoint_file):
+            return {}
+        with open(self.checkpoint_file) as filehandle:
+            try:
+                return json.load(filehandle)
+            except ValueError as _:
+                die('invalid checkpoint file {}: {}'.format(self.checkpoint_file, _))
+
+    def save_checkpoints(self, checkpoints, followed):
+        """
+        Saves the offsets of the followed files to the --checkpoint-file, keeping those of any other files in it
+        """
+        if not self.checkpoint_file:
+            return
+        for state in followed:
+            checkpoints[state['path']] = {'inode': state['inode'], 'offset': state['offset']}
+        checkpoint_dir = os.path.dirname(os.path.abspath(self.checkpoint_file))
+        # write and rename so a crash part way through never leaves a corrupt checkpoint to resume from
+        (filehandle, tmp_file) = tempfile.mkstemp(dir=checkpoint_dir, prefix='.anonymize-checkpoint-')
+        with os.fdopen(filehandle, 'w') as filehandle:
+            json.dump(checkpoints, filehandle, indent=4, sort_keys=True)
+        os.rename(tmp_file, self.checkpoint_file)
+        log.debug('saved checkpoints to %s', self.checkpoint_file)
+
+    def serve(self):
+        if os.path.exists(self.serve_socket):
+            self.remove_stale_socket(self.serve_socket)
+        # the text sent may be sensitive so only the user running the server may connect, created with these
+        # permissions by bind() rather than chmod-ed after, which would leave a window for others to connect
+        umask = os.umask(0o077)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(self.serve_socket, AnonymizeRequestHandler)
+        finally:
+            os.umask(umask)
+        server.daemon_threads = True
+        server.anonymizer = self
+        try:
+            # exit via the finally below to remove the socket on SIGTERM from service managers as well as on Control-C
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+            log.info('serving anonymization requests on %s', self.serve_socket)
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(self.serve_socket)
+
+    def serve_request(self, request):
+        """
+        Returns the anonymized text of a --serve request, raising ValueError if it is invalid
+        """
+        if not isinstance(request, dict) or not isStr(request.get('text')):
+            raise ValueError("request must be a JSON object with a 'text' string")
+        pipeline = self.get_serve_pipeline(request.get('categories'))
+        # split on \n only as when reading files, str.splitlines() would also split on \r, \f and others
+        return ''.join([self.anonymize(line, pipeline) for line in io.StringIO(request['text'])])
+
+    def get_serve_pipeline(self, categories):
+        if categories is None:
+            return self.pipeline
+        if not isinstance(categories, list) or not categories or [_ for _ in categories if not isStr(_)]:
+            raise ValueError("request 'categories' must be a non-empty list of strings")
+        key = frozenset(categories)
+        # requests are handled in threads
+        with self.serve_lock:
+            if key not in self.serve_pipelines:
+                not_enabled = sorted([_ for _ in key if not self.anonymizations.get(_)])
+                if not_enabled:
+                    raise ValueError('anonymizations not enabled on this server: {}'.format(', '.join(not_enabled)))
+                self.serve_pipelines[key] = \
+                    self.build_pipeline(OrderedDict([(_, _ in key) for _ in self.anonymizations]))
+            return self.serve_pipelines[key]
+
+    @staticmethod
+    def remove_stale_socket(path):
+        """
+        Removes a socket left by a server which died, but not one still in use or anything which isn't a socket
+        """
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            die('{} already exists and is not a socket, refusing to replace it'.format(path))
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error as _:
+            if _.errno != errno.ECONNREFUSED:
+                die('cannot check whether socket {} is in use: {}'.format(path, _))
+            os.unlink(path)
+        else:
+            die('another server is already listening on {}'.format(path))
+        finally:
+            probe.close()
+
+    def run_client(self):
+        categories = [_ for _ in self.anonymizations if self.anonymizations[_]] or None
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(self.client_socket)
+        except socket.error as _:
+            die('failed to connect to anonymize.py --serve socket {}: {}'.format(self.client_socket, _))
+        try:
+            rfile = client.makefile('rb')
+            wfile = client.makefile('wb')
+            for filename in self.file_list:
+                (filehandle, _) = self.open_input(filename)
+                try:
+                    text = filehandle.read()
+                finally:
+                    if filehandle not in (sys.stdin, getattr(sys.stdin, 'buffer', None)):
+                        filehandle.close()
+                if not isPythonMinVersion(3):
+                    text = text.decode('utf-8')
+                write_frame(wfile, {'text': text, 'categories': categories})
+                response = read_frame(rfile)
+                if response is None:
+                    die('anonymize.py --serve closed the connection without responding')
+                if 'error' in response:
+                    die('anonymize.py --serve error for {}: {}'.format(filename, response['error']))
+                sys.stdout.write(response['text'])
+        finally:
+            client.close()
+
+    def normalize_key(self, key):
+        # eg. javax.jdo.option.ConnectionPassword => javax_jdo_option_connection_password
+        return self.re_key_separator.sub('_', key).lower()
+
+    def anonymize_value(self, key, value):
+        """
+        Returns a --format document's string value, replaced whole if its key matches one of the key_rules
+        or else with the regex pipeline applied
+        """
+        if not value.strip() or self.re_placeholder.match(value):
+            return value
+        if key:
+            anonymized = self.anonymize_key_value(key, value)
+            if anonymized is not None:
+                return anonymized
+        return self.apply_rules(value, self.pipeline)
+
+    def anonymize_key_value(self, key, value):
+        """
+        Returns the replacement for a value whose key matches one of the key_rules, otherwise None
+        """
+        normalized_key = self.normalize_key(key)
+        for (category, key_regex) in self.key_rules:
+            if not key_regex.search(normalized_key):
+                continue
+            if category == 'hostname':
+                # leave values which aren't hostnames such as Ambari %HOSTGROUP::...% tokens to the pipeline
+                if not self.re_host_value.match(value):
+                    return None
+                if self.hash_salt:
+                    return self.hash_host(value)
+            if category == 'ldap':
+                return '<{}>'.format(key.lower())
+            return '<{}>'.format(category)
+        return None
+
+    def anonymize_document(self, text):
+        """
+        Anonymizes the string values of a --format document in a single pass, leaving the keys, numbers,
+        structure and layout exactly as they were
+        """
+        return getattr(self, 'anonymize_' + self.document_format)(text)
+
+    @staticmethod
+    def walk_document(text, regex, handlers, stack, unclosed=None):
+        """
+        Walks the tokens of a --format document matched by regex, keeping the text between them as it is
+
+        Each token is passed to the leaf handler for the name of the regex group it matched, along with the stack
+        of its enclosing containers starting from the root and the parts of the output so far. Handlers return the
+        text to output for the token, or None to output it unchanged as are tokens without a handler. unclosed is
+        the format of the error for containers still open at the end of the document
+        """
+        parts = []
+        last = 0
+        for match in regex.finditer(text):
+            parts.append(text[last:match.start()])
+            handler = handlers.get(match.lastgroup)
+            replacement = handler(match, stack, parts) if handler else None
+            parts.append(match.group(0) if replacement is None else replacement)
+            last = match.end()
+        if unclosed and len(stack) > 1:
+            raise ValueError(('unclosed ' + unclosed + ' at end of document').format(stack[-1][0]))
+        parts.append(text[last:])
+        return ''.join(parts)
+
+    @staticmethod
+    def close_container(stack, name, token, match):
+        if len(stack) < 2 or stack[-1][0] != name:
+            raise ValueError('unexpected {} at offset {}'.format(token, match.start()))
+        return stack.pop()
+
+    def anonymize_json(self, text):
+        # [bracket, key] of the root and each enclosing object / array, array elements taking the key of the array
+        return self.walk_document(text, self.re_json_token, {
+            'string': self.json_string,
+            'open': self.json_open,
+            'close': self.json_close,
+            'literal': self.json_literal,
+        }, [[None, None]], "'{}'")
+
+    @staticmethod
+    def json_open(match, stack, _parts):
+        bracket = match.group(0)
+        stack.append([bracket, None if bracket == '{' else stack[-1][1]])
+
+    def json_close(self, match, stack, _parts):
+        bracket = match.group(0)
+        self.close_container(stack, '{' if bracket == '}' else '[', "'{}'".format(bracket), match)
+
+    def json_string(self, match, stack, _parts):
+        value = json.loads(match.group(0))
+        if self.re_json_key_follows.match(match.string, match.end()):
+            stack[-1][1] = value
+            return None
+        anonymized = self.anonymize_value(stack[-1][1], value)
+        if anonymized == value:
+            return None
+        return json.dumps(anonymized, ensure_ascii=False)
+
+    def json_literal(self, match, stack, _parts):
+        # numbers, true and false are only replaced by key, eg. "admin_password": 123456
+        key = stack[-1][1]
+        token = match.group(0)
+        if not key or token == 'null':
+            return None
+        anonymized = self.anonymize_key_value(key, token)
+        if anonymized is None:
+            return None
+        return json.dumps(anonymized, ensure_ascii=False)
+
+    def anonymize_xml(self, text):
+        # [tag, name, pending] of the root and each enclosing element, name being the text of its <name> child for
+        # Hadoop *-site.xml <property><name>key</name><value>value</value></property> where the key is the <name>
+        # rather than <value>. pending are the (index in parts, token, value, is_cdata) of any <value> before the
+        # <name>. Declarations such as <?xml ...?> and <!DOCTYPE ...> have no handler so are left as they are
+        return self.walk_document(text, self.re_xml_token, {
+            'comment': self.xml_comment,
+            'cdata': self.xml_text,
+            'close': self.xml_close,
+            'open': self.xml_open,
+            'text': self.xml_text,
+            'lt': self.xml_lt,
+        }, [[None, None, []]], '<{}>')
+
+    def xml_comment(self, match, _stack, _parts):
+        # comments in configs often have example hosts and addresses
+        return '<!--' + self.apply_rules(match.group(0)[4:-3], self.pipeline) + '-->'
+
+    @staticmethod
+    def xml_lt(match, _stack, _parts):
+        raise ValueError('unescaped < at offset {}'.format(match.start()))
+
+    def xml_open(self, match, stack, _parts):
+        (tag, attributes, self_closing) = match.group(7, 8, 9)
+        if not self_closing:
+            stack.append([tag, None, []])
+        return '<{}{}{}>'.format(tag, self.anonymize_xml_attributes(attributes), self_closing)
+
+    def xml_close(self, match, stack, parts):
+        tag = match.group(0)[2:-1].strip()
+        (_, name, pending) = self.close_container(stack, tag, '</{}>'.format(tag), match)
+        for (index, token, value, is_cdata) in pending:
+            parts[index] = self.anonymize_xml_text(name or 'value', token, value, is_cdata)
+
+    def xml_text(self, match, stack, parts):
+        token = match.group(0)
+        is_cdata = match.lastgroup == 'cdata'
+        tag = stack[-1][0]
+        in_property = len(stack) > 2 and stack[-2][0].lower() == 'property'
+        if in_property and not is_cdata and tag.lower() == 'name':
+            # a key, not a value
+            stack[-2][1] = xml_unescape(token).strip()
+            return None
+        value = match.group(3) if is_cdata else xml_unescape(token)
+        if in_property and tag.lower() == 'value' and not stack[-2][1]:
+            # keyed by a <name> after it, anonymized once the <property> closes and the index in parts it will have
+            stack[-2][2].append((len(parts), token, value, is_cdata))
+            return None
+        return self.anonymize_xml_text(self.xml_key(stack), token, value, is_cdata)
+
+    def anonymize_xml_text(self, key, token, value, is_cdata):
+        anonymized = self.anonymize_value(key, value)
+        if anonymized == value:
+            return token
+        if is_cdata:
+            return '<![CDATA[{}]]>'.format(anonymized)
+        return xml_escape(anonymized)
+
+    @staticmethod
+    def xml_key(elements):
+        tag = elements[-1][0]
+        if tag and tag.lower() == 'value' and len(elements) > 2 and elements[-2][1]:
+            return elements[-2][1]
+        return tag
+
+    def anonymize_xml_attributes(self, attributes):
+        def replace(match):
+            (name, equals, quote, raw_value) = match.groups()
+            value = xml_unescape(raw_value, {'&quot;': '"', '&apos;': "'"})
+            anonymized = self.anonymize_value(name, value)
+            if anonymized == value:
+                return match.group(0)
+            quote_entity = '&quot;' if quote == '"' else '&apos;'
+            return '{}{}{}{}{}'.format(name, equals, quote, xml_escape(anonymized, {quote: quote_entity}), quote)
+        return self.re_xml_attribute.sub(replace, attributes)
+
+    def anonymize_yaml(self, text):
+        """
+        Handles block style YAML, the most common for configs, line by line. Flow style values such as
+        [a, b] or {a: b} only have the regex pipeline applied
+        """
+        # (indent, key, is_block) of the root and the enclosing mappings, list items taking the key of the list.
+        # is_block is whether the key has a | or > block scalar, whose lines are all more indented than its key
+        return self.walk_document(text, self.re_yaml_token, {'line': self.yaml_line}, [(-1, None, False)])
+
+    def yaml_line(self, match, stack, _parts):
+        line = match.group(0)
+        content = line.rstrip('\r\n')
+        ending = line[len(content):]
+        stripped = content.lstrip()
+        indent = len(content) - len(stripped)
+        if stack[-1][2]:
+            if not stripped or indent > stack[-1][0]:
+                return content[:indent] + self.anonymize_value(stack[-1][1], stripped) + ending
+            stack[-1] = stack[-1][:2] + (False,)
+        if stripped.startswith('#'):
+            return self.apply_rules(line, self.pipeline)
+        if not stripped or stripped.startswith('%') or stripped.rstrip() in ('---', '...'):
+            return None
+        (prefix, key, _, _, value) = self.re_yaml_line.match(content).groups()
+        if key:
+            key = self.yaml_key(stack, len(prefix), key, value)
+            if stack[-1][2]:
+                return None
+        else:
+            # a list item or continuation of a multi-line value
+            key = self.yaml_parent_key(stack, indent)
+        return content[:len(content) - len(value)] + self.anonymize_yaml_value(key, value) + ending
+
+    @staticmethod
+    def yaml_key(stack, indent, key, value):
+        while stack[-1][0] >= indent:
+            stack.pop()
+        key = key.strip()
+        if key[:1] in ('"', "'"):
+            key = key[1:-1]
+        stack.append((indent, key, value[:1] in ('|', '>')))
+        return key
+
+    @staticmethod
+    def yaml_parent_key(stack, indent):
+        # the root's indent of -1 is always less
+        for (key_indent, key, _) in reversed(stack):
+            if key_indent <= indent:
+                return key
+        return None
+
+    def anonymize_yaml_value(self, key, value):
+        if not value:
+            return value
+        if value[0] in ('"', "'"):
+            end = value.find(value[0], 1)
+            if end > 0:
+                return value[0] + self.anonymize_value(key, value[1:end]) + value[end:]
+        if value[0] in ('[', '{'):
+            return self.apply_rules(value, self.pipeline)
+        if value[0] in ('&', '*', '!'):
+            # anchors, aliases and tags
+            return value
+        comment = value.find(' #')
+        if comment < 0:
+            comment = len(value)
+        scalar = value[:comment].rstrip()
+        return self.anonymize_value(key, scalar) + self.apply_rules(value[len(scalar):], self.pipeline)
+
+    def detect_compression(self, magic):
+        for (compression, prefix) in self.compression_magic.items():
+            if magic.startswith(prefix):
+                return compression
+        return None
+
+    def get_file_compression(self, filename):
+        with open(filename, 'rb') as filehandle:
+            return self.detect_compression(filehandle.read(6))
+
+    def open_input(self, filename):
+        """
+        Returns a text (or binary for --bytes) filehandle for the given file or stdin
+        and its compression, if any, detected by magic bytes
+        """
+        if filename == '-':
+            binary = getattr(sys.stdin, 'buffer', None)
+            # can only peek at stdin on Python 3 without consuming it
+            if not hasattr(binary, 'peek'):
+                return (sys.stdin, None)
+            compression = self.detect_compression(binary.peek(6)[:6])
+            if not compression:
+                return (binary if self.bytes_mode else sys.stdin, None)
+        else:
+            compression = self.get_file_compression(filename)
+            if not compression:
+                return (open(filename, 'rb' if self.bytes_mode else 'r'), None)
+            binary = open(filename, 'rb')
+        log.info('decompressing %s input %s', compression, filename)
+        decompressors = {
+            # + 16 to expect a gzip header
+            'gzip': lambda: zlib.decompressobj(zlib.MAX_WBITS + 16),
+            'bz2': bz2.BZ2Decompressor,
+            'xz': lzma.LZMADecompressor if lzma else None,
+            'zstd': zstandard.ZstdDecompressor().decompressobj if zstandard else None,
+        }
+        if not decompressors[compression]:
+            die('{} is {} compressed but the {} module is not available'
+                .format(filename, compression, 'lzma' if compression == 'xz' else 'zstandard'))
+        filehandle = io.BufferedReader(DecompressingReader(binary, decompressors[compression]),
+                                       buffer_size=DecompressingReader.block_size)
+        if isPythonMinVersion(3) and not self.bytes_mode:
+            filehandle = io.TextIOWrapper(filehandle)
+        return (filehandle, compression)
+
+    @staticmethod
+    def get_output_path(filename):
+        return os.path.basename(filename) if filename != '-' else 'stdin'
+
+    def get_output_file(self, filename, compression):
+        # --recursive mirrors the path under the input directory, otherwise just the file name
+        output_path = self.output_paths.get(filename)
+        if output_path is None:
+            output_path = self.get_output_path(filename)
+        if compression and not output_path.endswith(self.compression_extensions[compression]):
+            output_path += self.compression_extensions[compression]
+        return os.path.join(self.output_dir, output_path)
+
+    def open_output(self, filename, compression, append=False):
+        if not self.output_dir:
+            if self.bytes_mode:
+                return sys.stdout.buffer
+            return sys.stdout
+        output_file = self.get_output_file(filename, compression)
+        if filename != '-' and os.path.exists(output_file) and os.path.samefile(filename, output_file):
+            die('refusing to overwrite input file {} with its anonymized output'.format(filename))
+        if filename == '-' and not append and os.path.exists(output_file):
+            # unlike a file's output this can't be a rerun on the same input
+            die('refusing to overwrite {} from a previous run on stdin, move it out of --output-dir first'
+                .format(output_file))
+        self.make_output_subdir(output_file)
+        log.info('writing anonymized output to %s', output_file)
+        # text mode on Python 3, Python 2 str is already bytes
+        mode = 'wt' if isPythonMinVersion(3) and not self.bytes_mode else 'wb'
+        if append:
+            mode = mode.replace('w', 'a')
+        return self.open_compressed_output(output_file, compression, mode)
+
+    @staticmethod
+    def make_output_subdir(output_file):
+        output_subdir = os.path.dirname(output_file)
+        if not os.path.isdir(output_subdir):
+            try:
+                os.makedirs(output_subdir)
+            except OSError:
+                # created by another --recursive worker in the meantime
+                if not os.path.isdir(output_subdir):
+                    raise
+
+    def open_compressed_output(self, output_file, compression, mode):
+        if compression == 'gzip':
+            return gzip.open(output_file, mode)
+        if compression == 'bz2':
+            if isPythonMinVersion(3):
+                return bz2.open(output_file, mode)  # pylint: disable=no-member
+            return bz2.BZ2File(output_file, 'w')
+        if compression == 'xz':
+            return lzma.open(output_file, mode)
+        if compression == 'zstd':
+            writer = zstandard.ZstdCompressor().stream_writer(open(output_file, 'wb'))
+            if self.bytes_mode:
+                return writer
+            return io.TextIOWrapper(writer)
+        return open(output_file, mode.replace('t', ''))
+
+    def process_file_windowed(self, filename, filehandle, anonymize, write):
+        # readline() with a limit so a multi-GB line is never read in to memory in one go
+        readline = filehandle.readline
+        window = self.line_window
+        lineno = 0
+        try:
+            while True:
+                line = readline(window)
+                if not line:
+                    break
+                lineno += 1
+                if line.endswith('\n') or len(line) < window:
+                    write(anonymize(line))
+                    continue
+                for piece in self.anonymize_long_line(self.read_long_line(line, readline, window)):
+                    write(piece)
         except AssertionError as _:
             raise AssertionError('{} line {}: {}'.format(filename, lineno, _))
+        except RuleTimeout as _:
+            die('{} line {}: {}'.format(filename, lineno, _))
+
+    @staticmethod
+    def read_long_line(piece, readline, size):
+        while piece:
+            yield piece
+            if piece.endswith('\n'):
+                break
+            piece = readline(size)
+
+    def process_file_blocks(self, filehandle, write):
+        anonymize_block = self.anonymize_block
+        block_size = self.block_size
+        lineno = 0
+        while True:
+            block = filehandle.read(block_size)
+            if not block:
+                break
+            # complete the last line so blocks are always line aligned
+            if not block.endswith('\n'):
+                block += filehandle.readline()
+            num_lines = block.count('\n')
+            try:
+                write(anonymize_block(block))
+            except RuleTimeout as _:
+                raise RuleTimeout('lines {}-{}: {}'.format(lineno + 1, lineno + max(num_lines, 1), _))
+            lineno += num_lines
+
+    def process_file_parallel(self, filename, filehandle, write):
+        # bounded number of chunks in flight to keep memory flat on multi-GB files,
+        # Pool.imap() would read the entire input in to its task queue as fast as it can
+        max_pending = self.jobs * 2
+        pending = deque()
+        for chunk in self.read_chunks(filename, filehandle):
+            pending.append(self.pool.apply_async(anonymize_chunk, (chunk,)))
+            if len(pending) >= max_pending:
+                self.write_chunk(pending.popleft(), write)
+        while pending:
+            self.write_chunk(pending.popleft(), write)
+
+    def write_chunk(self, result, write):
+        (output, stats) = result.get()
+        self.add_stats(stats)
+        write(output)
 
-    def anonymize(self, line):
+    def read_chunks(self, filename, filehandle):
+        chunk_size = self.chunk_size
+        lineno = 0
+        lines = []
+        size = 0
+        for line in filehandle:
+            lines.append(line)
+            size += len(line)
+            if size >= chunk_size:
+                yield (filename, lineno, lines)
+                lineno += len(lines)
+                lines = []
+                size = 0
+        if lines:
+            yield (filename, lineno, lines)
+
+    def anonymize(self, line, pipeline=None):
         #log.debug('anonymize: line: %s', line)
         match = self.re_line_ending.search(line)
         line_ending = ''
@@ -875,62 +3327,307 @@ class Anonymize(CLI):
             line = line.decode('utf-8').encode('ascii', errors='replace')
         line = strip_ansi_escape_codes(line)
         line = self.re_line_ending.sub('', line)
-        for _ in self.anonymizations:
-            if not self.anonymizations[_]:
+        if self.line_window and len(line) > self.line_window:
+            window = self.line_window
+            line = ''.join(self.anonymize_windows(line[_:_ + window] for _ in range(0, len(line), window)))
+        else:
+            line = self.apply_rules(line, pipeline or self.pipeline)
+        line += line_ending
+        return line
+
+    def anonymize_long_line(self, pieces):
+        """
+        Yields the anonymized pieces of a line read in --line-window sized pieces,
+        preprocessed the same as anonymize() without ever holding the whole line in memory
+        """
+        line_ending = ['']
+
+        def preprocess():
+            # hold back the end of each piece in case it splits an ANSI escape code or \r\n line ending
+            carry = ''
+            for piece in pieces:
+                piece = carry + piece
+                cut = max(0, len(piece) - 32)
+                escape = piece.rfind('\x1b', max(0, cut - 32), cut)
+                if escape >= 0:
+                    cut = escape
+                carry = piece[cut:]
+                piece = piece[:cut]
+                if piece:
+                    yield self.clean(piece)
+            match = self.re_line_ending.search(carry)
+            if match:
+                line_ending[0] = match.group(1)
+            if self.strip_cr:
+                line_ending[0] = '\n'
+            yield self.clean(self.re_line_ending.sub('', carry))
+
+        for piece in self.anonymize_windows(preprocess()):
+            yield piece
+        yield line_ending[0]
+
+    @staticmethod
+    def clean(text):
+        if not isPythonMinVersion(3):
+            text = text.decode('utf-8').encode('ascii', errors='replace')
+        return strip_ansi_escape_codes(text)
+
+    def anonymize_windows(self, pieces):
+        """
+        Streams the pieces of a long line through a chain of generators, one per rule in the pipeline
+        """
+        pieces = iter(pieces)
+        first = []
+        skip_host_rules = False
+        if any(self.exceptions.values()):
+            # Java exceptions / Python tracebacks are recognizable from the start of the line
+            first = [next(pieces, '')]
+            skip_host_rules = self.skip_exceptions(first[0])
+        stream = chain(first, pieces)
+        for step in self.pipeline:
+            if step[4] and skip_host_rules:
                 continue
-            method = None
+            stream = self.window_rule(step, stream)
+        return stream
+
+    def window_rule(self, step, pieces):
+        """
+        Applies a rule to a stream of pieces of a line, yielding the result in pieces
+
+        Searches windows of the text with --window-overlap chars of lookahead and as much already processed text
+        before them for lookbehinds. Matches starting in a window but running past its end in to the overlap are
+        held back until more of the line has been read so they are never cut short by the end of the window
+        """
+        window = self.line_window
+        overlap = self.window_overlap
+        needed = window
+        prefix = ''
+        buf = ''
+        final = False
+        while not final:
             try:
-                #log.debug('checking for anonymize_%s', _)
-                method = getattr(self, 'anonymize_' + _)
-            except AttributeError:
-                #log.debug('anonymize_%s not found', _)
-                pass
-            if method:
-                #log.debug('found anonymize_%s: %s', _, method)
-                line = method(line)
+                buf += next(pieces)
+            except StopIteration:
+                final = True
+            if not final and len(buf) < needed + overlap:
+                continue
+            text = prefix + buf
+            start = len(prefix)
+            limit = self.window_limit(text, start, final)
+            (result, cut) = self.window_subn(step, text, start, limit, final)
+            yield result
+            prefix = text[max(0, cut - overlap):cut]
+            buf = text[cut:]
+            # double the window while a held back match stops any progress, eg. .*$ on a long line
+            needed = window if cut > start else needed * 2
+
+    def window_limit(self, text, start, final):
+        """
+        Returns where the window of text starting at start ends, leaving --window-overlap chars of lookahead
+        """
+        limit = len(text)
+        if not final:
+            limit -= self.window_overlap
+            # cut at a token boundary which matches are unlikely to span
+            boundary = max([text.rfind(_, start, limit) for _ in ' \t,"\''])
+            if boundary > start:
+                limit = boundary
+        return limit
+
+    @staticmethod
+    def window_subn(step, text, start, limit, final):
+        """
+        Replaces the matches of a rule starting in text[start:limit]
+
+        Returns the replaced text and where it was cut, which is before any match running past the limit
+        """
+        (_, subn, replacement, required_literals, _) = step
+        search = subn.__self__.search
+        output = []
+        last = start
+        cut = limit
+        pos = start
+        if required_literals:
+            text_lower = text.lower()
+            if not [_ for _ in required_literals if _ in text_lower]:
+                pos = limit + 1
+        while pos <= limit:
+            match = search(text, pos)
+            if not match or (match.start() >= limit and not final):
+                break
+            if match.end() > limit and not final:
+                cut = match.start()
+                break
+            output.append(text[last:match.start()])
+            output.append(replacement(match) if callable(replacement) else match.expand(replacement))
+            last = match.end()
+            pos = last if last > match.start() else last + 1
+        output.append(text[last:cut])
+        return (''.join(output), cut)
+
+    def anonymize_bytes(self, line):
+        # exactly the same as text for ASCII, other lines are anonymized as text and
+        # encoded back with surrogateescape so that any invalid UTF-8 bytes are written out unchanged
+        if not is_ascii(line) or b'\x1b' in line:
+            return self.anonymize(line.decode('utf-8', 'surrogateescape')).encode('utf-8', 'surrogateescape')
+        line_ending = b''
+        if line.endswith(b'\n'):
+            line_ending = b'\r\n' if line.endswith(b'\r\n') else b'\n'
+            line = line[:-len(line_ending)]
+        if self.strip_cr:
+            line_ending = b'\n'
+        # classified once for all the segments, as text since the exception regex are not bytes
+        skip_host_rules = False
+        if self.exceptions['java_exceptions'] or self.exceptions['python_tracebacks']:
+            skip_host_rules = self.skip_exceptions(line.decode('ascii'))
+        apply_rules = self.apply_rules
+        for (is_bytes, steps) in self.bytes_pipeline:
+            if is_bytes:
+                line = apply_rules(line, steps, skip_host_rules)
             else:
-                line = self.anonymize_dynamic(_, line)
-            if line is None:
-                if method:
-                    raise AssertionError('anonymize_{} returned None'.format(_))
-                raise AssertionError('anonymize_dynamic({}, line)'.format(_))
-        line += line_ending
-        return line
+                line = apply_rules(line.decode('ascii'), steps, skip_host_rules).encode('utf-8')
+        return line + line_ending
 
-    def anonymize_dynamic(self, name, line):
-        #log.debug('anonymize_dynamic(%s, %s)', name, line)
-        if not isStr(line):
-            raise AssertionError('anonymize_dynamic: passed in non-string line: {}'.format(line))
-        line = self.dynamic_replace(name, line)
-        for i in range(2, 101):
-            name2 = '{}{}'.format(name, i)
-            if name2 in self.regex:
-                line = self.dynamic_replace(name2, line)
+    def anonymize_block(self, block):
+        """
+        Anonymizes a line aligned block of lines, applying the line safe segments of the pipeline to the whole block
+        at once with the rest applied line by line, giving the same result as anonymize() on each line
+        """
+        # carriage returns and ANSI escape codes are handled per line by anonymize()
+        if '\r' in block or '\x1b' in block:
+            lines = block.split('\n')
+            last = lines.pop()
+            output = [self.anonymize(_ + '\n') for _ in lines]
+            if last:
+                output.append(self.anonymize(last))
+            return ''.join(output)
+        block_ending = ''
+        if block.endswith('\n'):
+            block = block[:-1]
+            block_ending = '\n'
+        elif self.strip_cr:
+            block_ending = '\n'
+        if not isPythonMinVersion(3):
+            block = block.decode('utf-8').encode('ascii', errors='replace')
+        apply_rules = self.apply_rules
+        for (is_line_safe, steps) in self.block_pipeline:
+            if is_line_safe:
+                block = apply_rules(block, steps)
             else:
-                break
-        return line
+                block = '\n'.join([apply_rules(_, steps) for _ in block.split('\n')])
+        return block + block_ending
 
-    def dynamic_replace(self, name, line):
-        #log.debug('dynamic_replace: %s, %s', name, line)
-        replacement = self.replacements.get(name, '<{}>'.format(name))
-        #log.debug('%s replacement = %s', name, replacement)
-        line = self.regex[name].sub(replacement, line)
-        #line = re.sub(self.regex[name], replacement, line)
-        log.debug('dynamic_replace: %s => %s', name, line)
-        return line
+    def apply_rules(self, text, steps, skip_host_rules=None):
+        """
+        Applies the rules in steps to text in order, returning the anonymized text
 
-    def anonymize_custom(self, line):
-        i = 0
-        for regex in self.custom_anonymizations:
-            i += 1
-            line = regex.sub(r'<custom>', line)
-            #line = re.sub(regex, r'\1<custom>\2', line)
-            log.debug('anonymize_custom: %s => %s', i, line)
-        return line
+        skip_host_rules is whether this is a Java exception / Python traceback line whose host rules are skipped,
+        classified once on the first host rule unless given
+        """
+        self.apply_rules_count += 1
+        text_lower = None
+        for (name, subn, replacement, required_literals, is_host_rule) in steps:
+            # cheap substring pre-check to skip regex which cannot possibly match this text,
+            # most rules never match most lines
+            if required_literals:
+                if text_lower is None:
+                    text_lower = text.lower()
+                for literal in required_literals:
+                    if literal in text_lower:
+                        break
+                else:
+                    continue
+            if is_host_rule and skip_host_rules is None:
+                skip_host_rules = self.skip_exceptions(text)
+            if is_host_rule and skip_host_rules:
+                continue
+            (text, count) = self.subn_rule(name, subn, replacement, text)
+            if count:
+                text_lower = None
+                log.debug('anonymize: %s => %s', name, text)
+        return text
 
-    @staticmethod
-    def isGenericPythonLogLine(line):  # pylint: disable=invalid-name
-        if re.search(r'\s' + filename_regex + r'.py:\d+ - loglevel=[\w\.]+\s*$', line, re.I):
+    def subn_rule(self, name, subn, replacement, text):
+        """
+        Applies one rule to text, re-applying it in chunks if it hits --rule-timeout with --rule-timeout-chunk
+        """
+        try:
+            return subn(replacement, text)
+        except RuleTimeout:
+            if not self.rule_timeout_chunk:
+                raise
+            return self.subn_chunked(name, subn, replacement, text)
+
+    def subn_chunked(self, name, subn, replacement, text):
+        """
+        Re-applies a rule which hit --rule-timeout to whitespace aligned chunks of the text to bound the
+        backtracking, at the cost of missing any match spanning a chunk boundary, which in practice is
+        one of the runaway near matches that caused the timeout. A chunk still timing out is an error
+        """
+        chunk_size = self.rule_timeout_chunk_size
+        log.warning('rule %s exceeded --rule-timeout of %s secs on %s chars, re-applying in %s char chunks',
+                    name, self.rule_timeout, len(text), chunk_size)
+        pattern = getattr(subn.__self__, 'pattern', '')
+        if not isinstance(pattern, str):
+            pattern = pattern.decode('utf-8')
+        if self.re_end_of_line_rule.search(pattern):
+            return self.subn_chunked_to_end_of_line(subn, replacement, text)
+        # bytes with --bytes
+        space = b' ' if isinstance(text, bytes) else ' '
+        chunks = []
+        total = 0
+        start = 0
+        while start < len(text):
+            end = start + chunk_size
+            if end < len(text):
+                space_index = text.rfind(space, start + 1, end)
+                if space_index > start:
+                    end = space_index
+            # a new watchdog state per chunk so each chunk gets the full timeout
+            self.apply_rules_count += 1
+            (chunk, count) = subn(replacement, text[start:end])
+            chunks.append(chunk)
+            total += count
+            start = end
+        return (text[:0].join(chunks), total)
+
+    def subn_chunked_to_end_of_line(self, subn, replacement, text):
+        """
+        Chunked subn_chunked() for rules which redact everything to the end of the line, eg. password .*?$,
+        which in a chunk would only redact to the end of the chunk and miss a match cut by a chunk boundary
+
+        Searches overlapping windows for the next match and replaces everything from its start to the real end
+        of its line with the rule applied to the first chunk of it
+        """
+        chunk_size = self.rule_timeout_chunk_size
+        window_size = chunk_size + self.rule_timeout_chunk_overlap
+        search = subn.__self__.search
+        newline = b'\n' if isinstance(text, bytes) else '\n'
+        chunks = []
+        total = 0
+        start = 0
+        while start < len(text):
+            self.apply_rules_count += 1
+            window = text[start:start + window_size]
+            match = search(window)
+            # matches starting in the overlap are found at the start of the next window
+            if not match or (match.start() >= chunk_size and start + window_size < len(text)):
+                chunks.append(text[start:start + chunk_size])
+                start += chunk_size
+                continue
+            match_start = start + match.start()
+            end = text.find(newline, match_start)
+            if end < 0:
+                end = len(text)
+            chunks.append(text[start:match_start])
+            self.apply_rules_count += 1
+            chunks.append(subn(replacement, text[match_start:min(end, match_start + chunk_size)], 1)[0])
+            total += 1
+            start = end
+        return (text[:0].join(chunks), total)
+
+    def isGenericPythonLogLine(self, line):  # pylint: disable=invalid-name
+        if self.re_generic_python_log_line.search(line):
             return True
         return False
 
@@ -941,23 +3638,45 @@ class Anonymize(CLI):
             return True
         return False
 
-    def anonymize_hostname(self, line):
-        if self.skip_exceptions(line):
-            return line
-        line = self.anonymize_dynamic('hostname', line)
-        return line
 
-    def anonymize_domain(self, line):
-        if self.skip_exceptions(line):
-            return line
-        line = self.anonymize_dynamic('domain', line)
-        return line
+def get_anonymizer(categories, hash_hostnames=False, hash_salt=None, skip_exceptions=False, tld_lookup=False,
+                   strip_cr=False):
+    """
+    Returns an Anonymize instance with the rules for the given anonymizations compiled, for use as a library
 
-    def anonymize_fqdn(self, line):
-        if self.skip_exceptions(line):
-            return line
-        line = self.anonymize_dynamic('fqdn', line)
-        return line
+    categories are the anonymizations by name as in Anonymize.anonymizations, plus 'all' and 'host' as per the
+    command line options, eg. ['ip', 'email', 'host'], and the keyword args correspond to the same named options
+    """
+    anonymizer = Anonymize()
+    anonymizer.tld_lookup = tld_lookup
+    anonymizer.strip_cr = strip_cr
+    if hash_hostnames:
+        anonymizer.enable_hash_hostnames(hash_salt)
+        categories = list(categories) + ['host']
+    if skip_exceptions:
+        for _ in anonymizer.exceptions:
+            anonymizer.exceptions[_] = True
+    anonymizer.set_anonymizations(categories)
+    anonymizer.prepare_regex()
+    return anonymizer
+
+
+# anonymize_lines() anonymizers by args so the rules are only compiled once per process, eg. per Spark Python worker
+anonymizers = {}
+
+
+def anonymize_lines(lines, categories, **kwargs):
+    """
+    Anonymizes an iterator of lines, with or without line endings, yielding each anonymized line
+
+    Takes the same args as get_anonymizer(), reusing the anonymizer from any previous call with the same args
+    """
+    key = (tuple(sorted(categories)), tuple(sorted(kwargs.items())))
+    if key not in anonymizers:
+        anonymizers[key] = get_anonymizer(categories, **kwargs)
+    anonymize = anonymizers[key].anonymize
+    for line in lines:
+        yield anonymize(line)
 
 
 if __name__ == '__main__':
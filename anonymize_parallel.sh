@@ -31,13 +31,15 @@ usage(){
     fi
     cat >&2 <<EOF
 
-Splits a big file in to \$PARALLELISM parts (defaults to the number of CPU processors) and then runs that many parallel anonymize.py processes on the individual parts before concatenating back in to one big anonymized file
+Anonymizes big files using \$PARALLELISM anonymize.py worker processes (defaults to the number of CPU processors) writing each result to a file of the same name with a .anonymized suffix
+
+Runs anonymize.py --jobs on each file, which splits it in to line aligned chunks in memory for the workers and writes their output back out in the original order
 
 This makes it much, much faster to anonymize large log files for passing to vendors while maintaining the order of evaluation which is important for more specific matching before less specific matching
 
 usage: ${0##*/} <files>
 
--p --parallelism    Number of parts to split files in to and anonymize in parallel before reconstituting
+-p --parallelism    Number of worker processes to anonymize each file with in parallel
 -h --help           Show usage and exit
 EOF
     exit 3
@@ -64,22 +66,9 @@ for filename in $file_list; do
     echo
     echo "Processing file '$filename':"
     echo
-    echo "Removing any pre-existing parts:"
-    rm -v "$filename".* 2>/dev/null || :
-    echo
-    "$srcdir/bash-tools/split.sh" --parts "$parallelism" "$filename"
-    echo "Anonymizing parts"
-    for file_part in "$filename".*; do
-        cmd="$srcdir/anonymize.py -a $file_part > $file_part.anonymized"
-        echo "$cmd"
-    done |
-    parallel -j "$parallelism"
-    echo "Concatenating parts"
-    cat "$filename".*.anonymized > "$filename".anonymized
-    echo
-    echo "Removing parts:"
-    rm -v "$filename".*.anonymized || :
-    rm -v "$filename".[a-z0-9][a-z0-9] "$filename".[a-z0-9][a-z0-9][a-z0-9] 2>/dev/null || :
+    # anonymize.py now parallelizes natively across line aligned chunks while preserving output order,
+    # no more split part files or dependency on GNU parallel
+    "$srcdir/anonymize.py" -a --jobs "$parallelism" "$filename" > "$filename.anonymized"
     echo
     echo "Anonymized file ready: $filename.anonymized"
     echo
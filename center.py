@@ -29,12 +29,15 @@ from __future__ import print_function
 import os
 import re
 import sys
-libdir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'pylib'))
-sys.path.append(libdir)
+srcdir = os.path.abspath(os.path.dirname(__file__))
+pylib = os.path.join(srcdir, 'pylib')
+lib = os.path.join(srcdir, 'lib')
+sys.path.append(pylib)
+sys.path.append(lib)
 try:
     # pylint: disable=wrong-import-position
     from harisekhon.utils import isChars, log_option
-    from harisekhon import CLI
+    from unix_filter import UnixFilter
 except ImportError as _:
     print('module import failed: %s' % _, file=sys.stderr)
     print("Did you remember to build the project by running 'make'?", file=sys.stderr)
@@ -42,9 +45,10 @@ except ImportError as _:
     sys.exit(4)
 
 __author__ = 'Hari Sekhon'
-__version__ = '0.4.1'
+__version__ = '0.5.0'
 
-class Center(CLI):
+
+class Center(UnixFilter):
 
     def __init__(self):
         # Python 2.x
@@ -53,9 +57,12 @@ class Center(CLI):
         # super().__init__()
         self.re_bound = re.compile(r'(\b)')
         self.re_chars = re.compile(r'([^\s])(?!\s)')
-        self.timeout_default = None
+        self.width = 80
+        self.no_comment = False
+        self.space_chars = False
 
     def add_options(self):
+        super(Center, self).add_options()
         self.add_opt('-w', '--width', default=80, type='int', metavar='<num_chars>',
                      help='Target line width to center for in chars')
         self.add_opt('-n', '--no-comment', action='store_true',
@@ -63,29 +70,36 @@ class Center(CLI):
         self.add_opt('-s', '--space', action='store_true', default=False,
                      help='Space all chars out, makes bigger headings')
 
+    def process_options(self):
+        super(Center, self).process_options()
+        self.width = self.get_opt('width')
+        self.no_comment = self.get_opt('no_comment')
+        self.space_chars = self.get_opt('space')
+        log_option('width', self.width)
+        log_option('no comment prefix', self.no_comment)
+        log_option('space chars', self.space_chars)
+
     def run(self):
-        log_option('width', self.get_opt('width'))
-        log_option('no comment prefix', self.get_opt('no_comment'))
-        log_option('space chars', self.get_opt('space'))
         if self.args:
-            self.process_line(' '.join(self.args))
+            line = ' '.join(self.args)
+            if line:
+                print(self.transform_line(line))
         else:
-            for line in sys.stdin:
-                self.process_line(line)
+            self.process_file('-')
 
     def space(self, line):
         line = self.re_bound.sub(r' ', line)
         line = self.re_chars.sub(r'\1 ', line)
         return line
 
-    def process_line(self, line):
+    def transform_line(self, line):
         char = ''
-        if not line:
-            return
-        if not self.get_opt('no_comment'):
+        if not self.no_comment:
             char = ' '
             # preliminary strip() to be able to pick up # if it isn't the first char and their are spaces before it
             line = line.strip()
+            if not line:
+                return line
             if isChars(line[0], '#'):
                 char = line[0]
                 line = line.lstrip(char)
@@ -95,11 +109,12 @@ class Center(CLI):
             elif len(line) > 1 and isChars(line[0:1], '-'):
                 char = '--'
                 line = line.lstrip(char)
-        if self.get_opt('space'):
+        if self.space_chars:
             line = self.space(line)
         line = line.strip()
-        side = int(max((self.get_opt('width') - len(line)) / 2, 0))
-        print(char + ' ' * side + line)
+        side = int(max((self.width - len(line)) / 2, 0))
+        return char + ' ' * side + line
+
 
 if __name__ == '__main__':
     Center().main()
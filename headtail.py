@@ -19,6 +19,8 @@
 Tool to show the first and last N lines. Works like a standard unix filter program for all files passed as arguments
 or if no files are given then it applies to standard input.
 
+Streams the input in large blocks keeping only the first and last N lines in memory, so works on files of any size.
+
 """
 
 from __future__ import absolute_import
@@ -26,14 +28,18 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import deque
 import os
 import sys
-libdir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'pylib'))
-sys.path.append(libdir)
+srcdir = os.path.abspath(os.path.dirname(__file__))
+pylib = os.path.join(srcdir, 'pylib')
+lib = os.path.join(srcdir, 'lib')
+sys.path.append(pylib)
+sys.path.append(lib)
 try:
     # pylint: disable=wrong-import-position
-    from harisekhon.utils import die, ERRORS, log_option, isInt
-    from harisekhon import CLI
+    from harisekhon.utils import log_option, isInt
+    from unix_filter import UnixFilter
 except ImportError as _:
     print('module import failed: %s' % _, file=sys.stderr)
     print("Did you remember to build the project by running 'make'?", file=sys.stderr)
@@ -41,9 +47,10 @@ except ImportError as _:
     sys.exit(4)
 
 __author__ = 'Hari Sekhon'
-__version__ = '0.3.2'
+__version__ = '0.4.0'
+
 
-class HeadTail(CLI):
+class HeadTail(UnixFilter):
 
     def __init__(self):
         # Python 2.x
@@ -60,9 +67,11 @@ class HeadTail(CLI):
         self.sep = '-' * 80
         self.docsep = '=' * 80
         self.quiet = False
-        self.timeout_default = None
+        # collects the head and tail itself rather than filtering blocks, so there is nothing to parallelize
+        self.parallel = False
 
     def add_options(self):
+        super(HeadTail, self).add_options()
         #self.timeout_default = 300
         self.add_opt('-n', '--num', metavar='number_of_lines',
                      type=int, default=self.num_lines,
@@ -73,43 +82,49 @@ class HeadTail(CLI):
         self.add_opt('-q', '--quiet', action='store_true',
                      default=False, help="Don't print separators in output")
 
-    def run(self):
+    def process_options(self):
+        super(HeadTail, self).process_options()
         self.num_lines = self.get_opt('num')
         log_option('number of lines', self.num_lines)
         self.quiet = self.get_opt('quiet')
         log_option('quiet', self.quiet)
-        if not self.args:
-            self.args.append('-')
-        for arg in self.args:
-            if arg == '-':
-                continue
-            if not os.path.exists(arg):
-                print("'%s' not found" % arg)
-                sys.exit(ERRORS['WARNING'])
-            if os.path.isfile(arg):
-                log_option('file', arg)
-            elif os.path.isdir(arg):
-                log_option('directory', arg)
-            else:
-                die("path '%s' could not be determined as either a file or directory" % arg)
-        for filename in self.args:
-            if filename == '-':
-                self.headtail(sys.stdin.read())
-            else:
-                with open(filename) as _:
-                    self.headtail(_.read())
-            if not self.quiet and len(self.args) > 1:
-                print(self.docsep)
-
-    def headtail(self, content):
-        lines = content.split(os.linesep)
-        if self.num_lines >= len(lines) / 2:
-            print(content, end='')
+
+    def process_file(self, filename):
+        super(HeadTail, self).process_file(filename)
+        if not self.quiet and len(self.args) > 1:
+            self.write((self.docsep + '\n').encode('utf-8'))
+
+    def process_filehandle(self, filehandle):
+        num_lines = self.num_lines
+        head = []
+        # the lines after the head, of which only the last ones are kept
+        tail = deque(maxlen=num_lines)
+        count = 0
+        last = b''
+        for block in self.read_blocks(filehandle):
+            # blocks end in a newline except possibly the last, so this is the final line of the input if any
+            lines = block.split(b'\n')
+            last = lines.pop()
+            count += len(lines)
+            missing = num_lines - len(head)
+            if missing > 0:
+                head.extend(lines[:missing])
+                lines = lines[missing:]
+            tail.extend(lines)
+        # the final line after the last newline counts even if empty, as when splitting the whole content
+        count += 1
+        if len(head) < num_lines:
+            head.append(last)
+        else:
+            tail.append(last)
+        if num_lines >= count / 2:
+            # everything after the head fits in the tail, so this is the whole input
+            self.write(b'\n'.join(head + list(tail)))
         else:
-            print(os.linesep.join(lines[:self.num_lines]))
+            self.write(b'\n'.join(head) + b'\n')
             if not self.quiet:
-                print(self.sep)
-            print(os.linesep.join(lines[-self.num_lines:]).rstrip(os.linesep))
+                self.write((self.sep + '\n').encode('utf-8'))
+            self.write(b'\n'.join(tail).rstrip(b'\n') + b'\n')
 
 
 if __name__ == '__main__':
@@ -26,6 +26,9 @@ printing to stdout for piping or redirecting to a file as per unix filter comman
 Works like a standard unix filter program - if no files are passed as arguments or '-' is passed then reads from
 standard input
 
+Reads and writes large blocks of lines at a time, numbering the digits and letters of each line in a single
+vectorized pass over the block with NumPy if available, otherwise character by character
+
 """
 
 from __future__ import absolute_import
@@ -34,7 +37,12 @@ from __future__ import print_function
 #from __future__ import unicode_literals
 
 import os
+import string
 import sys
+try:
+    import numpy as np
+except ImportError:
+    np = None
 libdir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'pylib'))
 sys.path.append(libdir)
 try:
@@ -47,7 +55,7 @@ except ImportError as _:
     sys.exit(4)
 
 __author__ = 'Hari Sekhon'
-__version__ = '0.1.0'
+__version__ = '0.2.0'
 
 
 class HexAnonymize(CLI):
@@ -59,6 +67,18 @@ class HexAnonymize(CLI):
         # super().__init__()
         self.preserve_case = False
         self.only_hex_alphas = False
+        # approximate bytes of whole lines to read and anonymize at a time
+        self.block_size = 1024 * 1024
+        # the digits and letters of each line are replaced with these in turn
+        self.digits = '1234567890'
+        self.letters = 'abcdef'
+        # NumPy lookup tables by byte value of which bytes are digits / letters to replace,
+        # and how much to subtract from the replacement letter to match the case of uppercase letters
+        self.digit_lookup = None
+        self.letter_lookup = None
+        self.case_lookup = None
+        self.digit_values = None
+        self.letter_values = None
 
     def add_options(self):
         super(HexAnonymize, self).add_options()
@@ -70,30 +90,80 @@ class HexAnonymize(CLI):
         super(HexAnonymize, self).process_options()
         self.preserve_case = self.get_opt('case')
         self.only_hex_alphas = self.get_opt('hex_only')
-
-    def hexanonymize(self, filehandle):
-        preserve_case = self.preserve_case
-        only_hex_alphas = self.only_hex_alphas
-        hex_alphas = ['a', 'b', 'c', 'd', 'e', 'f']
-        for line in filehandle:
-            integer = 1
-            letter = 'a'
-            for char in line:
-                if char.isdigit():
-                    char = integer
-                    integer += 1
-                    if integer > 9:
-                        integer = 0
-                elif (not only_hex_alphas and char.isalpha()) or char.lower() in hex_alphas:
-                    if preserve_case and char.isupper():
-                        char = letter.upper()
-                    else:
-                        char = letter
-                    letter = chr(ord(char) + 1)
-                    if letter.lower() not in hex_alphas:
-                        letter = 'a'
-                print(char, end='')
-
+        if np is not None:
+            self.build_lookups()
+
+    @staticmethod
+    def byte_values(chars):
+        return np.frombuffer(chars.encode('ascii'), dtype=np.uint8)
+
+    def build_lookups(self):
+        self.digit_values = self.byte_values(self.digits)
+        self.letter_values = self.byte_values(self.letters)
+        self.digit_lookup = np.zeros(256, dtype=bool)
+        self.digit_lookup[self.byte_values(string.digits)] = True
+        self.letter_lookup = np.zeros(256, dtype=bool)
+        self.letter_lookup[self.byte_values('abcdefABCDEF' if self.only_hex_alphas else string.ascii_letters)] = True
+        self.case_lookup = np.zeros(256, dtype=np.uint8)
+        if self.preserve_case:
+            self.case_lookup[self.byte_values(string.ascii_uppercase)] = ord('a') - ord('A')
+
+    def hexanonymize(self, filehandle, write):
+        while True:
+            lines = filehandle.readlines(self.block_size)
+            if not lines:
+                break
+            block = b''.join(lines)
+            if np is not None:
+                data = np.frombuffer(block, dtype=np.uint8)
+                # non-ASCII digits and letters are multi-byte so need decoding
+                if not (data & 0x80).any():
+                    write(self.hexanonymize_ascii(data))
+                    continue
+            if bytes is str:
+                # Python 2 - bytes, as this has always anonymized
+                write(self.hexanonymize_text(block))
+            else:
+                write(self.hexanonymize_text(block.decode('utf-8', 'surrogateescape'))
+                      .encode('utf-8', 'surrogateescape'))
+
+    def hexanonymize_ascii(self, data):
+        output = data.copy()
+        newlines = data == ord('\n')
+        digits = self.digit_lookup[data]
+        output[digits] = self.digit_values[self.line_index(digits, newlines) % len(self.digit_values)]
+        letters = self.letter_lookup[data]
+        output[letters] = self.letter_values[self.line_index(letters, newlines) % len(self.letter_values)] - \
+                          self.case_lookup[data[letters]]
+        return output.tobytes()
+
+    @staticmethod
+    def line_index(mask, newlines):
+        """
+        Returns the index within its line of each position set in the mask, eg. 0 for the first digit of each line
+        """
+        counts = np.cumsum(mask)
+        # the count at the end of the previous line, carried forward as the counts never decrease
+        line_start_counts = np.maximum.accumulate(np.where(newlines, counts, 0))
+        return (counts - line_start_counts - 1)[mask]
+
+    def hexanonymize_text(self, text):
+        chars = []
+        digit_count = 0
+        letter_count = 0
+        for char in text:
+            if char.isdigit():
+                char = self.digits[digit_count % len(self.digits)]
+                digit_count += 1
+            elif char.isalpha() and (not self.only_hex_alphas or char in 'abcdefABCDEF'):
+                letter = self.letters[letter_count % len(self.letters)]
+                char = letter.upper() if self.preserve_case and char.isupper() else letter
+                letter_count += 1
+            elif char == '\n':
+                digit_count = 0
+                letter_count = 0
+            chars.append(char)
+        return ''.join(chars)
 
     def run(self):
         if not self.args:
@@ -104,12 +174,13 @@ class HexAnonymize(CLI):
             if not os.path.exists(arg):
                 print("'%s' not found" % arg)
                 sys.exit(1)
+        write = getattr(sys.stdout, 'buffer', sys.stdout).write
         for arg in self.args:
             if arg == '-':
-                self.hexanonymize(sys.stdin)
+                self.hexanonymize(getattr(sys.stdin, 'buffer', sys.stdin), write)
             else:
-                with open(arg) as filehandle:
-                    self.hexanonymize(filehandle)
+                with open(arg, 'rb') as filehandle:
+                    self.hexanonymize(filehandle, write)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+#  vim:ts=4:sts=4:sw=4:et
+#
+#  Author: Hari Sekhon
+#  Date: 2020-03-14 11:02:16 +0000 (Sat, 14 Mar 2020)
+#
+#  https://github.com/harisekhon/devops-python-tools
+#
+#  License: see accompanying Hari Sekhon LICENSE file
+#
+#  If you're using my code you're welcome to connect with me on LinkedIn
+#  and optionally send me feedback to help steer this or other code I publish
+#
+#  https://www.linkedin.com/in/harisekhon
+#
+
+"""
+
+Base class for unix filter programs which read files or standard input and write to standard output
+
+Reads large binary blocks of whole lines and writes each filtered block with a single write, optionally
+filtering blocks in parallel worker processes with --jobs while preserving their order
+
+Subclasses override transform() to filter a chunk of many lines at once, or transform_line() which it applies to
+each line by default, and may set trigger_chars to only decode and transform the lines containing one of those
+chars, all other lines being passed straight through as bytes
+
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+from multiprocessing import cpu_count
+import os
+import re
+import sys
+libdir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'pylib'))
+sys.path.append(libdir)
+try:
+    # pylint: disable=wrong-import-position
+    from harisekhon.utils import die, ERRORS, isPythonMinVersion, log, log_option, validate_int
+    from harisekhon import CLI
+except ImportError as _:
+    print('module import failed: %s' % _, file=sys.stderr)
+    print("Did you remember to build the project by running 'make'?", file=sys.stderr)
+    print("Alternatively perhaps you tried to copy this program out without it's adjacent libraries?", file=sys.stderr)
+    sys.exit(4)
+
+__author__ = 'Hari Sekhon'
+__version__ = '0.1.0'
+
+# set to the filter instance before forking --jobs worker processes, which inherit it
+worker_filter = None
+
+
+def worker_filter_block(block):
+    return worker_filter.filter_block(block)
+
+
+class UnixFilter(CLI):
+
+    def __init__(self):
+        # Python 2.x
+        super(UnixFilter, self).__init__()
+        # Python 3.x
+        # super().__init__()
+        self.block_size = 1024 * 1024
+        self.jobs = 1
+        # bytes of which a line must contain at least one to be transformed, eg. ESC for ANSI escape codes
+        self.trigger_chars = None
+        self.trigger_regex = None
+        # False for subclasses which override process_filehandle() without filtering blocks, so have no --jobs
+        self.parallel = True
+        self.write = getattr(sys.stdout, 'buffer', sys.stdout).write
+        self.timeout_default = None
+
+    def add_options(self):
+        super(UnixFilter, self).add_options()
+        if not self.parallel:
+            return
+        self.add_opt('-j', '--jobs', default=1, type='int', metavar='<num>',
+                     help='Number of parallel worker processes to filter blocks of input with, ' + \
+                          'output order is preserved (default: 1, 0 means one per CPU core: {})'.format(cpu_count()))
+
+    def process_options(self):
+        super(UnixFilter, self).process_options()
+        if self.parallel:
+            self.process_options_jobs()
+        if self.trigger_chars:
+            chars = re.escape(self.trigger_chars)
+            # runs of consecutive lines each containing at least one of the trigger chars, excluding the last newline
+            line = b'[^\n' + chars + b']*[' + chars + b'][^\n]*'
+            self.trigger_regex = re.compile(b'(?m)^' + line + b'(?:\n' + line + b')*')
+
+    def process_options_jobs(self):
+        self.jobs = self.get_opt('jobs')
+        validate_int(self.jobs, 'jobs', 0, 1000)
+        self.jobs = int(self.jobs)
+        if self.jobs == 0:
+            self.jobs = cpu_count()
+        if self.jobs > 1 and not hasattr(os, 'fork'):
+            self.usage('--jobs requires an operating system which supports fork()')
+
+    def run(self):
+        if not self.args:
+            self.args.append('-')
+        for arg in self.args:
+            if arg == '-':
+                continue
+            if not os.path.exists(arg):
+                print("'%s' not found" % arg)
+                sys.exit(ERRORS['WARNING'])
+            if os.path.isfile(arg):
+                log_option('file', arg)
+            elif os.path.isdir(arg):
+                log_option('directory', arg)
+            else:
+                die("path '%s' could not be determined as either a file or directory" % arg)
+        for filename in self.args:
+            self.process_file(filename)
+
+    def process_file(self, filename):
+        if filename == '-':
+            self.process_filehandle(sys.stdin)
+        else:
+            with open(filename, 'rb') as filehandle:
+                self.process_filehandle(filehandle)
+
+    def process_filehandle(self, filehandle):
+        if self.jobs > 1:
+            pool = self.create_pool()
+            try:
+                blocks = pool.imap(worker_filter_block, self.read_blocks(filehandle))
+                self.write_blocks(blocks)
+            finally:
+                pool.terminate()
+        else:
+            self.write_blocks(self.filter_block(_) for _ in self.read_blocks(filehandle))
+
+    def create_pool(self):
+        global worker_filter  # pylint: disable=global-statement
+        log.info('starting %s worker processes', self.jobs)
+        worker_filter = self
+        try:
+            context = multiprocessing.get_context('fork')
+        except AttributeError:
+            # Python 2 always forks on Unix
+            context = multiprocessing
+        return context.Pool(processes=self.jobs)
+
+    def write_blocks(self, blocks):
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        for block in blocks:
+            self.write(block)
+            # flushed per block so interactive use at a terminal still gets each line back as it is typed
+            stdout.flush()
+
+    def read_blocks(self, filehandle):
+        """
+        Yields blocks of up to block_size bytes of whole lines, ending in a newline unless the input doesn't
+
+        Reads straight from the file descriptor, which returns as soon as any input is available rather than
+        waiting for the whole block to fill up on a pipe or terminal
+        """
+        fileno = filehandle.fileno()
+        partial = b''
+        while True:
+            data = os.read(fileno, self.block_size)
+            if not data:
+                break
+            end = data.rfind(b'\n') + 1
+            if not end:
+                partial += data
+                continue
+            yield partial + data[:end]
+            partial = data[end:]
+        if partial:
+            yield partial
+
+    def filter_block(self, block):
+        if self.trigger_regex is None:
+            if block.endswith(b'\n'):
+                return self.transform_bytes(block[:-1]) + b'\n'
+            return self.transform_bytes(block)
+        parts = []
+        last = 0
+        for match in self.trigger_regex.finditer(block):
+            parts.append(block[last:match.start()])
+            parts.append(self.transform_bytes(match.group(0)))
+            last = match.end()
+        if not parts:
+            return block
+        parts.append(block[last:])
+        return b''.join(parts)
+
+    def transform_bytes(self, chunk):
+        if isPythonMinVersion(3):
+            # keeps any bytes which aren't valid UTF-8 intact
+            return self.transform(chunk.decode('utf-8', 'surrogateescape')).encode('utf-8', 'surrogateescape')
+        return self.transform(chunk)
+
+    def transform(self, text):
+        """
+        Returns the filtered text of one or more lines joined by newlines, without a trailing newline
+
+        This is the hook subclasses override to filter a whole chunk of lines at once,
+        the default applies transform_line() to each line
+        """
+        return '\n'.join(map(self.transform_line, text.split('\n')))
+
+    def transform_line(self, line):  # pylint: disable=no-self-use
+        """
+        Returns the filtered line, unchanged unless overridden by the subclass
+        """
+        return line
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#  vim:ts=4:sts=4:sw=4:et
+#
+#  Author: Hari Sekhon
+#  Date: 2026-10-17 12:00:00 +0100 (Sat, 17 Oct 2026)
+#
+#  https://github.com/harisekhon/devops-python-tools
+#
+#  License: see accompanying Hari Sekhon LICENSE file
+#
+#  If you're using my code you're welcome to connect with me on LinkedIn and optionally send me feedback
+#  to help improve or steer this or other code I publish
+#
+#  https://www.linkedin.com/in/harisekhon
+#
+
+"""
+
+PySpark program to anonymize text file(s) such as logs using the same rules as anonymize.py,
+for data too big to anonymize on one host even with anonymize_parallel.sh
+
+The anonymization settings are broadcast to the executors, which anonymize each partition using anonymize.py as a
+library, compiling the rules once per Python worker
+
+anonymize.py and its pylib must be importable on the executors, which they are in local mode
+and on clusters where this repo is at the same path on every node
+
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+srcdir = os.path.abspath(os.path.dirname(__file__))
+libdir = os.path.join(srcdir, 'pylib')
+sys.path.append(libdir)
+try:
+    # pylint: disable=wrong-import-position
+    from harisekhon.utils import log, die, getenv, pyspark_path
+    from harisekhon import CLI
+    from anonymize import Anonymize, anonymize_lines
+except ImportError as _:
+    print('module import failed: %s' % _, file=sys.stderr)
+    print("Did you remember to build the project by running 'make'?", file=sys.stderr)
+    print("Alternatively perhaps you tried to copy this program out without it's adjacent libraries?", file=sys.stderr)
+    sys.exit(4)
+pyspark_path()
+from pyspark import SparkContext    # pylint: disable=wrong-import-position,import-error
+from pyspark import SparkConf       # pylint: disable=wrong-import-position,import-error
+
+__author__ = 'Hari Sekhon'
+__version__ = '0.1.0'
+
+
+class SparkAnonymize(CLI):
+
+    def __init__(self):
+        # Python 2.x
+        super(SparkAnonymize, self).__init__()
+        # Python 3.x
+        # super().__init__()
+        self.verbose_default = 2
+        self.timeout_default = 86400
+
+    # @override
+    def add_options(self):
+        self.add_opt('-i', '--input', metavar='<file/dir>',
+                     help='Text input file/dir ($INPUT)',
+                     default=getenv('INPUT'))
+        self.add_opt('-o', '--output-dir', metavar='<dir>',
+                     help='Anonymized text output dir ($OUTPUTDIR)',
+                     default=getenv('OUTPUTDIR'))
+        self.add_opt('-c', '--categories', metavar='<list>', default='all',
+                     help='Comma separated anonymizations to apply as named in anonymize.py, ' + \
+                          'eg. ip,email,host (default: all)')
+        self.add_opt('--hash-hostnames', action='store_true',
+                     help='Hash hostnames / FQDNs instead of replacing them with placeholders, see anonymize.py')
+        self.add_opt('-e', '--skip-exceptions', action='store_true',
+                     help="Skip Java exception and Python traceback lines' hostname anonymization, see anonymize.py")
+
+    def parse_args(self):
+        self.no_args()
+        if not self.get_opt('input'):
+            self.usage('--input not defined')
+        if not self.get_opt('output_dir'):
+            self.usage('--output-dir not defined')
+        categories = [_.strip() for _ in self.get_opt('categories').split(',') if _.strip()]
+        anonymizations = list(Anonymize().anonymizations) + ['all', 'host']
+        for _ in categories:
+            if _ not in anonymizations:
+                self.usage('invalid anonymization {}, must be one of: {}'.format(_, ', '.join(anonymizations)))
+        if not categories:
+            self.usage('--categories not defined')
+
+    def run(self):
+        input_path = self.get_opt('input')
+        output_dir = self.get_opt('output_dir')
+        # let Spark fail if the paths aren't available
+        # can't check paths exist as want to remain generically portable
+        # to HDFS, local filesystm or any other uri scheme Spark supports
+        log.info("Input: %s" % input_path)
+        log.info("Output: %s" % output_dir)
+        settings = {
+            'categories': [_.strip() for _ in self.get_opt('categories').split(',') if _.strip()],
+            'hash_hostnames': bool(self.get_opt('hash_hostnames')),
+            'skip_exceptions': bool(self.get_opt('skip_exceptions')),
+        }
+        # fail fast on the driver for invalid settings rather than in every task
+        try:
+            Anonymize().set_anonymizations(settings['categories'])
+        except ValueError as _:
+            die(str(_))
+
+        conf = SparkConf().setAppName('HS PySpark Anonymize')
+        conf.setIfMissing('spark.master', 'local[*]')
+        # so the executors' Python workers can import anonymize.py and its pylib
+        conf.setIfMissing('spark.executorEnv.PYTHONPATH',
+                          os.pathsep.join([srcdir, libdir] + [_ for _ in [os.environ.get('PYTHONPATH')] if _]))
+        sc = SparkContext(conf=conf) # pylint: disable=invalid-name
+        if self.verbose < 3 and 'setLogLevel' in dir(sc):
+            sc.setLogLevel('WARN')
+        log.info('Spark version detected as %s' % sc.version)
+        sc.addPyFile(os.path.join(srcdir, 'anonymize.py'))
+        broadcast = sc.broadcast(settings)
+        sc.textFile(input_path)\
+          .mapPartitions(lambda lines: anonymize_lines(lines, **broadcast.value))\
+          .saveAsTextFile(output_dir)
+
+
+if __name__ == '__main__':
+    SparkAnonymize().main()
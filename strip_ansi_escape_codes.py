@@ -20,6 +20,8 @@ Strip ANSI Escape Codes from Text String input
 
 Works as a standard unix filter program, reading from file arguments or standard input and printing to standard output
 
+Only lines containing an escape char are decoded and stripped, the rest are passed straight through in large blocks
+
 """
 
 from __future__ import absolute_import
@@ -29,12 +31,15 @@ from __future__ import unicode_literals
 
 import os
 import sys
-libdir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'pylib'))
-sys.path.append(libdir)
+srcdir = os.path.abspath(os.path.dirname(__file__))
+pylib = os.path.join(srcdir, 'pylib')
+lib = os.path.join(srcdir, 'lib')
+sys.path.append(pylib)
+sys.path.append(lib)
 try:
     # pylint: disable=wrong-import-position
-    from harisekhon.utils import die, ERRORS, log_option, strip_ansi_escape_codes
-    from harisekhon import CLI
+    from harisekhon.utils import strip_ansi_escape_codes
+    from unix_filter import UnixFilter
 except ImportError as _:
     print('module import failed: %s' % _, file=sys.stderr)
     print("Did you remember to build the project by running 'make'?", file=sys.stderr)
@@ -42,42 +47,21 @@ except ImportError as _:
     sys.exit(4)
 
 __author__ = 'Hari Sekhon'
-__version__ = '0.2'
-
+__version__ = '0.3'
 
-# pylint: disable=too-few-public-methods
 
-class StripAnsiEscapeCodes(CLI):
+class StripAnsiEscapeCodes(UnixFilter):
 
-#    def __init__(self):
-#        # Python 2.x
-#        super(StripAnsiEscapeCodes, self).__init__()
-#        # Python 3.x
-#        # super().__init__()
+    def __init__(self):
+        # Python 2.x
+        super(StripAnsiEscapeCodes, self).__init__()
+        # Python 3.x
+        # super().__init__()
+        # lines without an ESC char are passed straight through
+        self.trigger_chars = b'\x1b'
 
-    def run(self):
-        if not self.args:
-            self.args.append('-')
-        for arg in self.args:
-            if arg == '-':
-                continue
-            if not os.path.exists(arg):
-                print("'%s' not found" % arg)
-                sys.exit(ERRORS['WARNING'])
-            if os.path.isfile(arg):
-                log_option('file', arg)
-            elif os.path.isdir(arg):
-                log_option('directory', arg)
-            else:
-                die("path '%s' could not be determined as either a file or directory" % arg)
-        for filename in self.args:
-            if filename == '-':
-                for line in sys.stdin:
-                    print(strip_ansi_escape_codes(line), end='')
-            else:
-                with open(filename) as filehandle:
-                    for line in filehandle:
-                        print(strip_ansi_escape_codes(line), end='')
+    def transform_line(self, line):
+        return strip_ansi_escape_codes(line)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#  vim:ts=4:sts=4:sw=4:et
+#
+#  Benchmarks the worst case time of each anonymize.py rule against adversarial inputs of increasing line length
+#  to catch regex which backtrack pathologically (ReDoS) on long lines full of near matches
+#
+#  Usage: tests/benchmark_anonymize.py [--lengths 1000,4000,16000] [--rules password,aws] [--max-seconds 1]
+#
+#  Exits 1 if any rule exceeds --max-seconds on any input, or its time grows faster than --max-growth times
+#  the growth in line length between the shortest and longest lengths, ie. worse than roughly linear
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import signal
+import sys
+from timeit import default_timer
+
+srcdir = os.path.abspath(os.path.dirname(__file__))
+
+sys.path.insert(0, os.path.join(srcdir, '..'))
+from anonymize import Anonymize  # pylint: disable=wrong-import-position
+
+# fillers repeated up to the line length, each a near miss for some family of rules
+fillers = [
+    'a',
+    'a ',
+    'a.',
+    'a-',
+    'a.b-',
+    '1.',
+    '1.2.3.',
+    'a:',
+    '1:',
+    'a=',
+    'a@',
+    'a/',
+    'a\\',
+    '%%',
+    'A0/+',
+    'aB3=',
+    '-a ',
+    '"a" ',
+    'cn=a,',
+    'curl -a ',
+    'username a ',
+    'password ',
+    'user a ',
+    'host.domain ',
+    'at a.b(',
+]
+
+
+class BenchmarkTimeout(Exception):
+    pass
+
+
+def alarm_handler(signum, frame):  # pylint: disable=unused-argument
+    raise BenchmarkTimeout()
+
+
+def adversarial_inputs(literals, length):
+    """
+    Yields (description, line) for each filler repeated to length, both on its own and seeded with the rule's
+    required literals so the rule actually runs (anonymize.py skips rules whose literals aren't in the line)
+    """
+    seeds = ['']
+    if literals:
+        seeds += ['{} '.format(_) for _ in literals]
+    for seed in seeds:
+        for filler in fillers:
+            line = (seed + filler) * (length // len(seed + filler) + 1)
+            yield ('({!r} + {!r}) * n'.format(seed, filler), line[:length])
+
+
+def time_rule(subn, replacement, line, max_seconds):
+    signal.setitimer(signal.ITIMER_REAL, max_seconds)
+    start = default_timer()
+    try:
+        subn(replacement, line)
+    except BenchmarkTimeout:
+        return None
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return default_timer() - start
+
+
+def get_anonymizer():
+    anonymizer = Anonymize()
+    for _ in anonymizer.anonymizations:
+        anonymizer.anonymizations[_] = True
+    anonymizer.regex_cache_dir = None
+    anonymizer.prepare_regex()
+    return anonymizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark anonymize.py rules against adversarial inputs')
+    parser.add_argument('--lengths', default='1000,4000,16000',
+                        help='Comma separated line lengths in chars (default: %(default)s)')
+    parser.add_argument('--rules', help='Comma separated rule names or prefixes to benchmark (default: all)')
+    parser.add_argument('--max-seconds', type=float, default=1.0,
+                        help='Fail any rule taking longer than this on a single line (default: %(default)s)')
+    parser.add_argument('--max-growth', type=float, default=4.0,
+                        help='Fail any rule whose time grows more than this many times faster than the ' + \
+                             'line length (default: %(default)s)')
+    args = parser.parse_args()
+    lengths = sorted([int(_) for _ in args.lengths.split(',')])
+    rules = args.rules.split(',') if args.rules else None
+    signal.signal(signal.SIGALRM, alarm_handler)
+
+    anonymizer = get_anonymizer()
+    failures = []
+    row = '{:<16} {:>10} {:>10} {:>8}  {}'
+    print(row.format('rule', 'length', 'seconds', 'growth', 'worst input'))
+    for (name, subn, replacement, literals, _) in anonymizer.pipeline:
+        if rules and not [_ for _ in rules if name.startswith(_)]:
+            continue
+        worst = {}
+        for length in lengths:
+            worst[length] = (0, None)
+            for (description, line) in adversarial_inputs(literals, length):
+                seconds = time_rule(subn, replacement, line, args.max_seconds)
+                if seconds is None:
+                    worst[length] = (None, description)
+                    break
+                if seconds > worst[length][0]:
+                    worst[length] = (seconds, description)
+            if worst[length][0] is None:
+                break
+        for length in lengths:
+            if length not in worst:
+                continue
+            (seconds, description) = worst[length]
+            growth = ''
+            if seconds is None:
+                failures.append('{} exceeded {} secs on {} chars of {}'
+                                .format(name, args.max_seconds, length, description))
+                print(row.format(name, length, 'TIMEOUT', growth, description))
+                continue
+            shortest = worst[lengths[0]][0]
+            if length != lengths[0] and shortest:
+                growth = (seconds / shortest) / (length / lengths[0])
+                if growth > args.max_growth and seconds > 0.01:
+                    failures.append('{} time grew {:.1f}x faster than line length up to {} chars of {}'
+                                    .format(name, growth, length, description))
+                growth = '{:.1f}'.format(growth)
+            print(row.format(name, length, '{:.4f}'.format(seconds), growth, description))
+    print()
+    for failure in failures:
+        print('FAILED: {}'.format(failure))
+    if failures:
+        sys.exit(1)
+    print('all rules within {} secs and {}x growth'.format(args.max_seconds, args.max_growth))
+
+
+if __name__ == '__main__':
+    main()
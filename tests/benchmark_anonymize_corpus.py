@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+#  vim:ts=4:sts=4:sw=4:et
+#
+#  Benchmarks the throughput of anonymize.py in process on synthetic golden corpora of Hadoop / HBase logs,
+#  Cisco configs, LDAP dumps and AWS CLI output, for each anonymization on its own and for --all
+#
+#  Usage: tests/benchmark_anonymize_corpus.py [--lines 10000] [--corpora hadoop,cisco] [--categories email,all]
+#                                             [--save baseline.json] [--compare baseline.json] [--threshold 10]
+#
+#  The corpora are generated from a fixed --seed so they are the same on every run, and the sha1 of each anonymized
+#  output is saved with its lines/sec and MB/sec so that --compare catches changes in output as well as speed
+#
+#  Exits 1 with --compare if any run is more than --threshold percent slower in lines/sec than the baseline,
+#  or its output differs from the baseline's
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+from hashlib import sha1
+import json
+import os
+import platform
+import random
+import sys
+from timeit import default_timer
+
+srcdir = os.path.abspath(os.path.dirname(__file__))
+
+sys.path.insert(0, os.path.join(srcdir, '..'))
+import anonymize  # pylint: disable=wrong-import-position
+
+first_names = ['hari', 'alice', 'bob', 'carol', 'dave', 'erin', 'frank', 'grace', 'heidi', 'ivan']
+last_names = ['sekhon', 'smith', 'jones', 'taylor', 'brown', 'wilson', 'evans', 'thomas', 'roberts', 'walker']
+domains = ['internal.net', 'prod.example.com', 'corp.acme.co.uk', 'eu-west-1.compute.internal']
+daemons = ['org.apache.hadoop.hdfs.server.datanode.DataNode', 'org.apache.hadoop.hdfs.server.namenode.FSNamesystem',
+           'org.apache.hadoop.yarn.server.resourcemanager.ResourceManager', 'org.apache.hadoop.ipc.Server',
+           'org.apache.hadoop.hbase.regionserver.HRegionServer', 'org.apache.hadoop.hbase.master.HMaster',
+           'org.apache.zookeeper.ClientCnxn']
+
+
+def ip(rng):
+    return '10.{}.{}.{}'.format(rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254))
+
+
+def host(rng):
+    return '{}{:02d}.{}'.format(rng.choice(['nn', 'dn', 'rs', 'zk', 'edge', 'master']), rng.randint(1, 99),
+                                rng.choice(domains))
+
+
+def user(rng):
+    return rng.choice(first_names) + rng.choice(['', '.' + rng.choice(last_names)])
+
+
+def hexstring(rng, length):
+    return ''.join(rng.choice('0123456789abcdef') for _ in range(length))
+
+
+def alphanumeric(rng, length, chars='ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'):
+    return ''.join(rng.choice(chars) for _ in range(length))
+
+
+def timestamp(rng):
+    return '2019-03-{:02d} {:02d}:{:02d}:{:02d},{:03d}'.format(rng.randint(1, 28), rng.randint(0, 23),
+                                                               rng.randint(0, 59), rng.randint(0, 59),
+                                                               rng.randint(0, 999))
+
+
+def hadoop_lines(rng):
+    templates = [
+        lambda: '{} INFO {}: Receiving BP-{}-{}-1552345678901:blk_10737{}_{} src: /{}:{} dest: /{}:50010'
+                .format(timestamp(rng), daemons[0], rng.randint(1, 99999), ip(rng), rng.randint(10000, 99999),
+                        rng.randint(1000, 9999), ip(rng), rng.randint(30000, 60000), ip(rng)),
+        lambda: '{} INFO org.apache.hadoop.security.UserGroupInformation: Login successful for user ' \
+                'hbase/{}@CORP.ACME.COM using keytab file /etc/security/keytabs/hbase.service.keytab'
+                .format(timestamp(rng), host(rng)),
+        lambda: '{} WARN {}: Call From {}/{} to {}:8020 failed on connection exception: ' \
+                'java.net.ConnectException: Connection refused'
+                .format(timestamp(rng), rng.choice(daemons), host(rng), ip(rng), host(rng)),
+        lambda: '\tat org.apache.hadoop.ipc.Client.call(Client.java:{})'.format(rng.randint(1000, 1600)),
+        lambda: '{} INFO {}: Serving as {},16020,1552345678901, RpcServer on {}/{}:16020, sessionid=0x{}'
+                .format(timestamp(rng), daemons[4], host(rng), host(rng), ip(rng), hexstring(rng, 16)),
+        lambda: '{} INFO {}: allowed=true ugi={} (auth:KERBEROS) ip=/{} cmd=open src=/user/{}/data/part-{:05d} ' \
+                'dst=null perm=null proto=rpc'
+                .format(timestamp(rng), daemons[1], user(rng), ip(rng), user(rng), rng.randint(0, 99999)),
+        lambda: '{} INFO org.apache.hadoop.hbase.util.JvmPauseMonitor: Detected pause in JVM or host machine ' \
+                '(eg GC): pause of approximately {}ms'.format(timestamp(rng), rng.randint(1000, 9000)),
+        lambda: '{} INFO {}: Opening socket connection to server {}/{}:2181'
+                .format(timestamp(rng), daemons[6], host(rng), ip(rng)),
+    ]
+    while True:
+        yield rng.choice(templates)()
+
+
+def cisco_lines(rng):
+    templates = [
+        lambda: 'hostname {}'.format(host(rng).split('.')[0]),
+        lambda: 'interface GigabitEthernet0/{}'.format(rng.randint(0, 48)),
+        lambda: ' description uplink to {}'.format(host(rng)),
+        lambda: ' ip address {} 255.255.255.0'.format(ip(rng)),
+        lambda: ' mac-address {}.{}.{}'.format(hexstring(rng, 4), hexstring(rng, 4), hexstring(rng, 4)),
+        lambda: 'username {} privilege 15 secret 5 $1${}${}'
+                .format(user(rng), alphanumeric(rng, 4), alphanumeric(rng, 22)),
+        lambda: 'enable secret 5 $1${}${}'.format(alphanumeric(rng, 4), alphanumeric(rng, 22)),
+        lambda: 'snmp-server community {} RO'.format(alphanumeric(rng, 12)),
+        lambda: 'snmp-server contact {}@{}'.format(user(rng), rng.choice(domains)),
+        lambda: 'ntp server {}'.format(ip(rng)),
+        lambda: 'logging host {}'.format(ip(rng)),
+        lambda: ' switchport access vlan {}'.format(rng.randint(1, 4094)),
+        lambda: '!',
+    ]
+    while True:
+        yield rng.choice(templates)()
+
+
+def ldap_lines(rng):
+    while True:
+        first = rng.choice(first_names)
+        last = rng.choice(last_names)
+        dc = rng.choice(domains).split('.')
+        base = ','.join('DC=' + _ for _ in dc)
+        for line in (
+                'dn: CN={} {},OU=Users,{}'.format(first.title(), last.title(), base),
+                'objectClass: user',
+                'cn: {} {}'.format(first.title(), last.title()),
+                'sn: {}'.format(last.title()),
+                'givenName: {}'.format(first.title()),
+                'sAMAccountName: {}{}'.format(first[0], last),
+                'userPrincipalName: {}{}@{}'.format(first[0], last, '.'.join(dc).upper()),
+                'mail: {}.{}@{}'.format(first, last, '.'.join(dc)),
+                'memberOf: CN=hadoop-admins,OU=Groups,{}'.format(base),
+                'objectSid: S-1-5-21-{}-{}-{}-{}'.format(rng.randint(10**9, 4 * 10**9), rng.randint(10**9, 4 * 10**9),
+                                                         rng.randint(10**9, 4 * 10**9), rng.randint(1000, 99999)),
+                'homeDirectory: \\\\{}\\home\\{}'.format(host(rng), first),
+                'uidNumber: {}'.format(rng.randint(10000, 60000)),
+                ''):
+            yield line
+
+
+def aws_lines(rng):
+    while True:
+        private_ip = ip(rng)
+        for line in (
+                '            "Instances": [',
+                '                {',
+                '                    "InstanceId": "i-0{}",'.format(hexstring(rng, 16)),
+                '                    "PrivateDnsName": "ip-{}.eu-west-1.compute.internal",'
+                .format(private_ip.replace('.', '-')),
+                '                    "PrivateIpAddress": "{}",'.format(private_ip),
+                '                    "PublicIpAddress": "52.{}.{}.{}",'
+                .format(rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254)),
+                '                    "IamInstanceProfile": {',
+                '                        "Arn": "arn:aws:iam::{}:instance-profile/{}-role"'
+                .format(rng.randint(10**11, 10**12 - 1), user(rng)),
+                '                    },',
+                '                    "KeyName": "{}-key",'.format(user(rng)),
+                '                    "LaunchTime": "2019-03-{:02d}T{:02d}:00:00.000Z"'
+                .format(rng.randint(1, 28), rng.randint(0, 23)),
+                '                },',
+                'aws_access_key_id = AKIA{}'.format(alphanumeric(rng, 16)),
+                'aws_secret_access_key = {}'.format(
+                    alphanumeric(rng, 40, 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789/+'))):
+            yield line
+
+
+corpora = OrderedDict([
+    ('hadoop', hadoop_lines),
+    ('cisco', cisco_lines),
+    ('ldap', ldap_lines),
+    ('aws', aws_lines),
+])
+
+
+def generate_corpus(name, lines, seed):
+    # seeded per corpus so that selecting a subset of --corpora doesn't change them
+    rng = random.Random('{}:{}'.format(seed, name))
+    generator = corpora[name](rng)
+    return [next(generator) + '\n' for _ in range(lines)]
+
+
+def time_category(category, lines, repeat):
+    """
+    Returns the best time of --repeat runs of the anonymizer for the category over the lines,
+    and the sha1 of its output
+    """
+    anonymizer = anonymize.get_anonymizer([category])
+    anonymize_line = anonymizer.get_line_anonymizer()
+    best = None
+    output = None
+    for _ in range(repeat):
+        start = default_timer()
+        output = [anonymize_line(line) for line in lines]
+        seconds = default_timer() - start
+        if best is None or seconds < best:
+            best = seconds
+    return (best, sha1(''.join(output).encode('utf-8')).hexdigest())
+
+
+def compare(results, baseline, threshold):
+    failures = []
+    for corpus in results:
+        for category in results[corpus]:
+            result = results[corpus][category]
+            previous = baseline['results'].get(corpus, {}).get(category)
+            if not previous:
+                continue
+            change = 100 * (result['lines_per_sec'] - previous['lines_per_sec']) / previous['lines_per_sec']
+            result['change'] = change
+            if change < -threshold:
+                failures.append('{} {} slowed down {:.1f}% from {:.0f} to {:.0f} lines/sec'
+                                .format(corpus, category, -change, previous['lines_per_sec'],
+                                        result['lines_per_sec']))
+            if result['sha1'] != previous['sha1']:
+                failures.append('{} {} output differs from the baseline'.format(corpus, category))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark anonymize.py throughput on synthetic corpora')
+    parser.add_argument('--lines', type=int, default=10000,
+                        help='Lines to generate per corpus (default: %(default)s, or the baseline\'s with --compare)')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Random seed for generating the corpora (default: %(default)s, ' + \
+                             'or the baseline\'s with --compare)')
+    parser.add_argument('--corpora', help='Comma separated corpora to benchmark (default: {})'
+                        .format(','.join(corpora)))
+    parser.add_argument('--categories',
+                        help='Comma separated anonymizations to benchmark (default: each on its own and all)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of each category to take the best time of (default: %(default)s)')
+    parser.add_argument('--save', metavar='<file>', help='Save the results to this file as a JSON baseline')
+    parser.add_argument('--compare', metavar='<file>', help='Compare the results to this JSON baseline')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Fail --compare if any run is this percent slower in lines/sec (default: %(default)s)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as filehandle:
+            baseline = json.load(filehandle)
+        # must be the same corpora for the output checksums to be comparable
+        args.lines = baseline['lines']
+        args.seed = baseline['seed']
+        if baseline['python'] != platform.python_version():
+            print('WARNING: baseline was run on Python {}, comparing on Python {}'
+                  .format(baseline['python'], platform.python_version()), file=sys.stderr)
+    names = args.corpora.split(',') if args.corpora else list(corpora)
+    for name in names:
+        if name not in corpora:
+            parser.error('unknown corpus {}, must be one of: {}'.format(name, ', '.join(corpora)))
+    if args.categories:
+        categories = args.categories.split(',')
+    else:
+        categories = [_ for _ in anonymize.Anonymize().anonymizations] + ['all']
+
+    results = OrderedDict()
+    row = '{:<8} {:<12} {:>12} {:>10} {:>8}'
+    for name in names:
+        lines = generate_corpus(name, args.lines, args.seed)
+        megabytes = len(''.join(lines).encode('utf-8')) / 1024 / 1024
+        results[name] = OrderedDict()
+        for category in categories:
+            (seconds, checksum) = time_category(category, lines, args.repeat)
+            results[name][category] = {
+                'seconds': seconds,
+                'lines_per_sec': len(lines) / seconds,
+                'mb_per_sec': megabytes / seconds,
+                'sha1': checksum,
+            }
+    failures = compare(results, baseline, args.threshold) if baseline else []
+
+    print(row.format('corpus', 'category', 'lines/sec', 'MB/sec', 'change'))
+    for name in results:
+        for category in results[name]:
+            result = results[name][category]
+            change = '{:+.1f}%'.format(result.pop('change')) if 'change' in result else ''
+            print(row.format(name, category, '{:.0f}'.format(result['lines_per_sec']),
+                             '{:.2f}'.format(result['mb_per_sec']), change))
+    if args.save:
+        with open(args.save, 'w') as filehandle:
+            json.dump(OrderedDict([
+                ('version', anonymize.__version__),
+                ('python', platform.python_version()),
+                ('lines', args.lines),
+                ('seed', args.seed),
+                ('results', results),
+            ]), filehandle, indent=4)
+            filehandle.write('\n')
+        print('saved baseline to {}'.format(args.save))
+    if baseline:
+        print()
+        for failure in failures:
+            print('FAILED: {}'.format(failure))
+        if failures:
+            sys.exit(1)
+        print('all runs within {}% of the baseline {} with the same output'.format(args.threshold, args.compare))
+
+
+if __name__ == '__main__':
+    main()
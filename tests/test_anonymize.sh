@@ -616,6 +616,366 @@ if [ -z "$test_nums" ]; then
     run_grep "<user>@<domain>" $anonymize --email <<< "hari@domain.com"
     run_grep "<user>@<domain>" $anonymize -E <<< "hari@domain.com"
 
+    echo "checking --jobs parallel output matches serial output:"
+    run++
+    if [ "$($anonymize -ae --jobs 4 README.md)" = "$($anonymize -ae README.md)" ]; then
+        echo "SUCCEEDED - anonymized README.md with --jobs 4 identically to serial"
+    else
+        echo "FAILED - anonymized README.md with --jobs 4 differs from serial"
+        exit 1
+    fi
+    hr
+
+    run_grep "<user>@<domain>" $anonymize --email --jobs 2 <<< "hari@domain.com"
+
+    echo "checking --block-size output matches line by line output:"
+    run++
+    if [ "$($anonymize -ae --block-size 1 README.md)" = "$($anonymize -ae README.md)" ]; then
+        echo "SUCCEEDED - anonymized README.md with --block-size 1 identically to line by line"
+    else
+        echo "FAILED - anonymized README.md with --block-size 1 differs from line by line"
+        exit 1
+    fi
+    hr
+
+    run_grep "^<user>@<domain>$" $anonymize --email --block-size 1 <<< "hari@domain.com"
+
+    echo "checking --bytes output matches text output:"
+    run++
+    if [ "$($anonymize -ae --bytes README.md)" = "$($anonymize -ae README.md)" ]; then
+        echo "SUCCEEDED - anonymized README.md with --bytes identically to text"
+    else
+        echo "FAILED - anonymized README.md with --bytes differs from text"
+        exit 1
+    fi
+    hr
+
+    echo "checking --bytes --hash-hostnames output matches text output:"
+    run++
+    if [ "$($anonymize -ae --hash-hostnames --bytes README.md)" = "$($anonymize -ae --hash-hostnames README.md)" ]; then
+        echo "SUCCEEDED - anonymized README.md with --bytes --hash-hostnames identically to text"
+    else
+        echo "FAILED - anonymized README.md with --bytes --hash-hostnames differs from text"
+        exit 1
+    fi
+    hr
+
+    run_grep "^myhost.domain.com main.py:74 - loglevel=logging.INFO$" $anonymize -ae --bytes <<< "myhost.domain.com main.py:74 - loglevel=logging.INFO"
+
+    echo "checking --bytes keeps invalid UTF-8 bytes intact:"
+    run++
+    if printf 'bad \xff hari@domain.com\n' | $anonymize --email --bytes | cmp -s - <(printf 'bad \xff <user>@<domain>\n'); then
+        echo "SUCCEEDED - --bytes kept invalid UTF-8 bytes intact"
+    else
+        echo "FAILED - --bytes did not keep invalid UTF-8 bytes intact"
+        exit 1
+    fi
+    hr
+
+    echo "checking gzip compressed input is decompressed and --output-dir output is compressed the same:"
+    run++
+    compress_dir="$(mktemp -d /tmp/anonymize_compressed.XXXXXX)"
+    gzip -c README.md > "$compress_dir/README.md.gz"
+    if [ "$($anonymize -ae "$compress_dir/README.md.gz")" = "$($anonymize -ae README.md)" ] &&
+       $anonymize -ae --output-dir "$compress_dir/out" "$compress_dir/README.md.gz" &&
+       [ "$(gzip -dc "$compress_dir/out/README.md.gz")" = "$($anonymize -ae README.md)" ]; then
+        echo "SUCCEEDED - anonymized gzip compressed README.md identically and wrote gzip compressed output"
+    else
+        echo "FAILED - gzip compressed README.md was not anonymized identically or output was not gzip compressed"
+        exit 1
+    fi
+    hr
+
+    echo "checking --output-dir refuses to write two inputs with the same name to the same output file:"
+    run++
+    mkdir -p "$compress_dir/a" "$compress_dir/b"
+    echo "hari@domain.com" > "$compress_dir/a/app.log"
+    echo "10.1.2.3" > "$compress_dir/b/app.log"
+    if ! $anonymize -ae --output-dir "$compress_dir/out2" "$compress_dir/a/app.log" "$compress_dir/b/app.log" &>/dev/null &&
+       ! [ -e "$compress_dir/out2/app.log" ]; then
+        echo "SUCCEEDED - --output-dir refused the colliding output file names"
+    else
+        echo "FAILED - --output-dir overwrote one input's output with another's"
+        exit 1
+    fi
+    hr
+
+    echo "checking truncated gzip compressed input fails:"
+    run++
+    head -c 1000 "$compress_dir/README.md.gz" > "$compress_dir/truncated.md.gz"
+    if ! $anonymize -ae "$compress_dir/truncated.md.gz" >/dev/null 2>&1; then
+        echo "SUCCEEDED - truncated gzip compressed input failed"
+    else
+        echo "FAILED - truncated gzip compressed input succeeded with partial output"
+        exit 1
+    fi
+    rm -fr "$compress_dir"
+    hr
+
+    # retries the given command every 0.2 secs for up to 10 secs until it succeeds
+    retry(){
+        for _ in {1..50}; do
+            "$@" && return 0
+            sleep 0.2
+        done
+        return 1
+    }
+
+    # the --follow output has reached the given number of lines
+    follow_output_lines(){
+        [ "$(grep -c . "$follow_dir/out/app.log" 2>/dev/null)" = "$1" ]
+    }
+
+    echo "checking --follow anonymizes appended lines and resumes from --checkpoint-file:"
+    run++
+    follow_dir="$(mktemp -d /tmp/anonymize_follow.XXXXXX)"
+    echo "hari@domain.com" > "$follow_dir/app.log"
+    $anonymize --email --follow --poll-interval 0.1 --checkpoint-file "$follow_dir/checkpoint.json" --output-dir "$follow_dir/out" "$follow_dir/app.log" &
+    follow_pid=$!
+    retry follow_output_lines 1 || :
+    echo "other@domain.com" >> "$follow_dir/app.log"
+    retry follow_output_lines 2 || :
+    kill "$follow_pid"
+    wait "$follow_pid" || :
+    echo "last@domain.com" >> "$follow_dir/app.log"
+    $anonymize --email --follow --poll-interval 0.1 --checkpoint-file "$follow_dir/checkpoint.json" --output-dir "$follow_dir/out" "$follow_dir/app.log" &
+    follow_pid=$!
+    retry follow_output_lines 3 || :
+    kill "$follow_pid"
+    wait "$follow_pid" || :
+    if [ "$(cat "$follow_dir/out/app.log")" = "$(printf '<user>@<domain>\n<user>@<domain>\n<user>@<domain>')" ] &&
+       python -c "import json, os, sys; assert json.load(open(sys.argv[1]))[os.path.abspath(sys.argv[2])]['offset'] == os.path.getsize(sys.argv[2])" "$follow_dir/checkpoint.json" "$follow_dir/app.log"; then
+        echo "SUCCEEDED - --follow anonymized each appended line exactly once across a restart"
+    else
+        echo "FAILED - --follow output or checkpoint was wrong across a restart"
+        exit 1
+    fi
+    rm -fr "$follow_dir"
+    hr
+
+    echo "checking --client output from an --serve daemon matches direct output:"
+    run++
+    serve_socket="/tmp/anonymize_test.$$.sock"
+    $anonymize -ae --serve "$serve_socket" &
+    serve_pid=$!
+    retry [ -S "$serve_socket" ] || :
+    if [ "$($anonymize --client "$serve_socket" README.md)" = "$($anonymize -ae README.md)" ] &&
+       [ "$($anonymize --email --client "$serve_socket" <<< "hari@domain.com 10.1.2.3")" = "<user>@<domain> 10.1.2.3" ]; then
+        echo "SUCCEEDED - --client anonymized README.md via --serve identically and with only the requested --email"
+    else
+        echo "FAILED - --client output via --serve differs from direct output"
+        kill "$serve_pid"
+        exit 1
+    fi
+    kill "$serve_pid"
+    wait "$serve_pid" || :
+    hr
+
+    echo "checking --serve refuses to replace a path which is not a socket:"
+    run++
+    not_socket="$(mktemp /tmp/anonymize_not_socket.XXXXXX)"
+    if ! $anonymize -ae --serve "$not_socket" &>/dev/null && [ -f "$not_socket" ]; then
+        echo "SUCCEEDED - --serve refused to replace $not_socket"
+    else
+        echo "FAILED - --serve replaced or ignored existing file $not_socket"
+        exit 1
+    fi
+    rm -f "$not_socket"
+    hr
+
+    echo "checking --recursive mirrors a directory tree in to --output-dir and skips up to date files:"
+    run++
+    tree_dir="$(mktemp -d /tmp/anonymize_tree.XXXXXX)"
+    mkdir -p "$tree_dir/in/sub"
+    cp README.md "$tree_dir/in/"
+    echo "hari@domain.com" > "$tree_dir/in/sub/app.log"
+    echo "192.168.1.1" > "$tree_dir/in/app.log"
+    if $anonymize -ae --recursive --jobs 2 --output-dir "$tree_dir/out" "$tree_dir/in" 2>&1 | grep -q "^total 3 files: " &&
+       [ "$(cat "$tree_dir/out/README.md")" = "$($anonymize -ae README.md)" ] &&
+       [ "$(cat "$tree_dir/out/sub/app.log")" = "<user>@<domain>" ] &&
+       [ "$(cat "$tree_dir/out/app.log")" = "<ip_x.x.x.x>" ] &&
+       $anonymize -ae --recursive --jobs 2 --output-dir "$tree_dir/out" "$tree_dir/in" 2>&1 | grep -q "^total 0 files: "; then
+        echo "SUCCEEDED - --recursive anonymized the tree to matching paths and skipped them on rerun"
+    else
+        echo "FAILED - --recursive output tree was wrong or up to date files were not skipped"
+        exit 1
+    fi
+    rm -fr "$tree_dir"
+    hr
+
+    echo "checking --line-window output matches whole line output on a long line:"
+    run++
+    long_line="$(python -c 'print(", ".join(["hari@domain.com 10.1.2.3 host.domain.com:8080 {}".format(_) for _ in range(20000)]))')"
+    if [ "$($anonymize -ae --line-window 10000 <<< "$long_line")" = "$($anonymize -ae <<< "$long_line")" ]; then
+        echo "SUCCEEDED - anonymized long line with --line-window 10000 identically to whole line"
+    else
+        echo "FAILED - anonymized long line with --line-window 10000 differs from whole line"
+        exit 1
+    fi
+    hr
+
+    echo "checking --line-window below the default --window-overlap works without setting --window-overlap:"
+    run++
+    if [ "$($anonymize -ae --line-window 1000 <<< "$long_line")" = "$($anonymize -ae <<< "$long_line")" ]; then
+        echo "SUCCEEDED - anonymized long line with --line-window 1000 identically to whole line"
+    else
+        echo "FAILED - --line-window 1000 failed or differs from whole line"
+        exit 1
+    fi
+    hr
+
+    echo "checking --line-cache output matches uncached output:"
+    run++
+    if [ "$($anonymize -ae --line-cache 100 README.md 2>/dev/null)" = "$($anonymize -ae README.md)" ]; then
+        echo "SUCCEEDED - anonymized README.md with --line-cache 100 identically to uncached"
+    else
+        echo "FAILED - anonymized README.md with --line-cache 100 differs from uncached"
+        exit 1
+    fi
+    hr
+
+    echo "checking --line-cache reports hits and misses:"
+    run++
+    if printf 'hari@domain.com\nhari@domain.com\n' | $anonymize --email --line-cache 10 2>&1 >/dev/null | grep -q "^line cache: 1 hits, 1 misses"; then
+        echo "SUCCEEDED - --line-cache reported 1 hit and 1 miss"
+    else
+        echo "FAILED - --line-cache did not report 1 hit and 1 miss"
+        exit 1
+    fi
+    hr
+
+    run_grep "^<user>@<domain>$" $anonymize --email --rule-timeout 5 <<< "hari@domain.com"
+    run_grep "^<user>@<domain>$" $anonymize --email --rule-timeout 5 --jobs 2 <<< "hari@domain.com"
+
+    echo "checking --rule-timeout never leaks the rest of a line redacted to its end, with or without --rule-timeout-chunk:"
+    run++
+    long_secret="$(mktemp /tmp/anonymize_long_secret.XXXXXX)"
+    python -c "print('enable password ' + 'TOPSECRET ' * 600000)" > "$long_secret"
+    if ! $anonymize --cisco --rule-timeout 0.02 "$long_secret" | grep -q TOPSECRET &&
+       ! $anonymize --cisco --rule-timeout 0.02 --rule-timeout-chunk "$long_secret" | grep -q TOPSECRET &&
+       ! $anonymize --cisco --rule-timeout 0.02 --rule-timeout-chunk --bytes "$long_secret" | grep -q TOPSECRET; then
+        echo "SUCCEEDED - no part of the password was output"
+    else
+        echo "FAILED - part of the password was output after --rule-timeout"
+        exit 1
+    fi
+    rm -f "$long_secret"
+    hr
+
+    echo "checking --hash-hostnames records hashes in --host-map consistently with --hash-salt and --jobs:"
+    run++
+    host_map="$(mktemp -d /tmp/anonymize_host_map.XXXXXX)/host_map.tsv"
+    hashed="$($anonymize --hash-hostnames --hash-salt test --host-map "$host_map" <<< "myhost.internal.net")"
+    if [ -n "$hashed" ] &&
+       [ "$(printf 'myhost.internal.net\n%.0s' {1..1000} | $anonymize --hash-hostnames --hash-salt test --host-map "$host_map" --jobs 2 | sort -u)" = "$hashed" ] &&
+       [ "$(grep -c "myhost.internal.net" "$host_map")" = 1 ] &&
+       grep -q "^$hashed	myhost.internal.net$" "$host_map"; then
+        echo "SUCCEEDED - --host-map recorded the hostname once with the same hash across runs and workers"
+    else
+        echo "FAILED - --host-map hashes were inconsistent or the hostname was not recorded exactly once"
+        exit 1
+    fi
+    rm -fr "$(dirname "$host_map")"
+    hr
+
+    run_grep "^<user>@<domain>$" $anonymize --email --regex-engine re <<< "hari@domain.com"
+    run_grep "^<user>@<domain>$" $anonymize --email --regex-engine re2 <<< "hari@domain.com"
+    run_grep "^re .* same as re$" $anonymize -ae --benchmark-regex-engines README.md
+
+    echo "checking tests/benchmark_anonymize_corpus.py saves a baseline and compares against it:"
+    run++
+    baseline="$(mktemp /tmp/anonymize_baseline.XXXXXX)"
+    if tests/benchmark_anonymize_corpus.py --lines 100 --repeat 1 --categories email,all --save "$baseline" &&
+       tests/benchmark_anonymize_corpus.py --categories email,all --compare "$baseline" --threshold 1000 | grep -q "^all runs within "; then
+        echo "SUCCEEDED - corpus benchmark output matched its own baseline"
+    else
+        echo "FAILED - corpus benchmark did not save or compare its baseline"
+        exit 1
+    fi
+    rm -f "$baseline"
+    hr
+
+    run_grep '^  "javax.jdo.option.ConnectionPassword" : "<password>",$' $anonymize -a --format json <<< '{
+  "javax.jdo.option.ConnectionPassword" : "my secret",
+  "hive.server2.thrift.port" : 10000
+}'
+    run_grep '^    <value>&lt;fqdn&gt;:8020</value>$' $anonymize -a --format xml <<< '<configuration>
+  <property>
+    <name>dfs.namenode.rpc-address</name>
+    <value>nn1.internal.net:8020</value>
+  </property>
+</configuration>'
+    run_grep '^  password: "<password>"  # ldap$' $anonymize -a --format yaml <<< 'ldap:
+  password: "my secret"  # ldap'
+    run_grep '^  "admin_password": "<password>",$' $anonymize -a --format json <<< '{
+  "admin_password": 123456,
+  "port": 8080
+}'
+    run_grep '^    <value>&lt;password&gt;</value>$' $anonymize -a --format xml <<< '<configuration>
+  <property>
+    <value>my secret</value>
+    <name>javax.jdo.option.ConnectionPassword</name>
+  </property>
+</configuration>'
+
+    echo "checking --format preserves the layout of documents and fails on invalid ones:"
+    run++
+    document='{ "hosts" : [ { "fqdn" : "node1.internal.net" } ],	"port":8080 }'
+    if [ "$($anonymize -a --format json <<< "$document")" = '{ "hosts" : [ { "fqdn" : "<fqdn>" } ],	"port":8080 }' ] &&
+       ! $anonymize -a --format xml <<< "<configuration><property></configuration>" &>/dev/null; then
+        echo "SUCCEEDED - --format preserved the layout and rejected the invalid document"
+    else
+        echo "FAILED - --format changed the layout or accepted an invalid document"
+        exit 1
+    fi
+    hr
+
+    echo "checking --profile-rules reports email rule substitutions and writes --profile-json:"
+    run++
+    profile_json="$(mktemp /tmp/anonymize_profile.XXXXXX)"
+    if $anonymize --email --profile-json "$profile_json" 2>&1 >/dev/null <<< "hari@domain.com" | grep -Eq "^email +email +[0-9.]+ +[0-9.]+ +1 +1$" &&
+       python -c "import json, sys; assert json.load(open(sys.argv[1]))['rules']['email']['substitutions'] == 1" "$profile_json"; then
+        echo "SUCCEEDED - --profile-rules reported email rule and wrote $profile_json"
+    else
+        echo "FAILED - --profile-rules did not report email rule or write $profile_json"
+        exit 1
+    fi
+    rm -f "$profile_json"
+    hr
+
+    run_grep "^connect to <fqdn> from <hostname>:8080$" $anonymize -H --tld-lookup <<< "connect to host.domain.com from myHost:8080"
+    run_grep "^at org.apache.Foo.bar\(Foo.java:12\)$" $anonymize -H --tld-lookup <<< "at org.apache.Foo.bar(Foo.java:12)"
+    run_grep "^at com.foo.MyClass.method:20 blah$" $anonymize -H --tld-lookup <<< "at com.foo.MyClass.method:20 blah"
+    run_grep "^use db.table:5$" $anonymize -H --tld-lookup <<< "use db.table:5"
+
+    regex_cache_dir="$(mktemp -d /tmp/anonymize_regex_cache.XXXXXX)"
+    run_grep "^<user>@<domain>$" $anonymize --email --regex-cache-dir "$regex_cache_dir" <<< "hari@domain.com"
+    echo "checking regex cache file was written:"
+    run++
+    if ls "$regex_cache_dir"/anonymize-*.json &>/dev/null; then
+        echo "SUCCEEDED - found regex cache file"
+    else
+        echo "FAILED - regex cache file not found in $regex_cache_dir"
+        exit 1
+    fi
+    hr
+    # second run loads from the cache
+    run_grep "^<user>@<domain>$" $anonymize --email --regex-cache-dir "$regex_cache_dir" <<< "hari@domain.com"
+    echo "checking only the newest regex cache files are kept:"
+    run++
+    for i in {1..20}; do
+        touch -d "2020-01-01" "$regex_cache_dir/anonymize-old$i.json"
+    done
+    $anonymize --ip --regex-cache-dir "$regex_cache_dir" <<< "1.2.3.4" >/dev/null
+    if [ "$(ls "$regex_cache_dir" | wc -l)" -eq 10 ]; then
+        echo "SUCCEEDED - old regex cache files were pruned"
+    else
+        echo "FAILED - old regex cache files were not pruned in $regex_cache_dir"
+        exit 1
+    fi
+    hr
+    rm -fr "$regex_cache_dir"
+
     src[800]="4.3.2.1"
     dest[800]="<ip_x.x.x>.1"
 
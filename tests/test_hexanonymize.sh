@@ -34,6 +34,12 @@ check_output "xyz123456rst789012abC" hexanonymize.py -c -o <<< "xyz987654rst6543
 run++
 check_output "xyz123456rst789012abc" hexanonymize.py -o <<< "xyz987654rst654321caD"
 
+run++
+check_output "ABCDefa123" hexanonymize.py -c <<< "AKIAxyz987"
+
+run++
+check_output "$(printf 'abc12\nabc12')" hexanonymize.py <<< "$(printf 'xyz98\nxyz98')"
+
 echo
 # $run_count defined in lib
 # shellcheck disable=SC2154
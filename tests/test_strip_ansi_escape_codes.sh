@@ -62,6 +62,20 @@ tee /dev/stderr |
     echo "ANSI escape code stripping FAILED"
     exit 1
 fi
+hr
+
+echo
+echo "checking stripping with parallel --jobs preserves line order"
+run++
+if for i in $(seq 1000); do echo "line $i highlighted"; done |
+    grep --color=yes highlighted |
+    ./strip_ansi_escape_codes.py --jobs 2 |
+    diff - <(for i in $(seq 1000); do echo "line $i highlighted"; done); then
+    echo "ANSI escape code stripping with --jobs SUCCEEDED"
+ else
+    echo "ANSI escape code stripping with --jobs FAILED"
+    exit 1
+fi
 
 echo
 # $run_count defined in lib
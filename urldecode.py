@@ -27,12 +27,15 @@ from __future__ import print_function
 
 import os
 import sys
-libdir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'pylib'))
-sys.path.append(libdir)
+srcdir = os.path.abspath(os.path.dirname(__file__))
+pylib = os.path.join(srcdir, 'pylib')
+lib = os.path.join(srcdir, 'lib')
+sys.path.append(pylib)
+sys.path.append(lib)
 try:
     # pylint: disable=wrong-import-position
-    from harisekhon import CLI
     from harisekhon.utils import isPythonMinVersion
+    from unix_filter import UnixFilter
 except ImportError as _:
     print('module import failed: %s' % _, file=sys.stderr)
     print("Did you remember to build the project by running 'make'?", file=sys.stderr)
@@ -46,36 +49,28 @@ else:
     from urllib import unquote_plus as unquote
 
 __author__ = 'Hari Sekhon'
-__version__ = '0.1.1'
+__version__ = '0.2.0'
 
 
-class URLDecode(CLI):
+class URLDecode(UnixFilter):
 
     def __init__(self):
         # Python 2.x
         super(URLDecode, self).__init__()
         # Python 3.x
         # super().__init__()
-        self.timeout_default = None
+        # lines without any of these are already decoded, other than stripping carriage returns
+        self.trigger_chars = b'%+\r'
 
     def run(self):
-        if len(sys.argv) > 1:
-            for arg in sys.argv[1:]:
-                self.decode(arg)
+        if self.args:
+            for arg in self.args:
+                print(unquote(arg))
         else:
-            # buffered - Control-D char meshes with late output
-            #for line in sys.stdin:
-            while True:
-                line = sys.stdin.readline()
-                if not line:
-                    break
-                line = line.rstrip('\n').rstrip('\r')
-                self.decode(line)
+            self.process_file('-')
 
-    @staticmethod
-    def decode(string):
-        print(unquote(string))
-        sys.stdout.flush()
+    def transform_line(self, line):
+        return unquote(line.rstrip('\r'))
 
 
 if __name__ == '__main__':
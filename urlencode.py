@@ -27,12 +27,15 @@ from __future__ import print_function
 
 import os
 import sys
-libdir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'pylib'))
-sys.path.append(libdir)
+srcdir = os.path.abspath(os.path.dirname(__file__))
+pylib = os.path.join(srcdir, 'pylib')
+lib = os.path.join(srcdir, 'lib')
+sys.path.append(pylib)
+sys.path.append(lib)
 try:
     # pylint: disable=wrong-import-position
-    from harisekhon import CLI
     from harisekhon.utils import isPythonMinVersion
+    from unix_filter import UnixFilter
 except ImportError as _:
     print('module import failed: %s' % _, file=sys.stderr)
     print("Did you remember to build the project by running 'make'?", file=sys.stderr)
@@ -46,37 +49,26 @@ else:
     from urllib import quote_plus as quote
 
 __author__ = 'Hari Sekhon'
-__version__ = '0.1.1'
+__version__ = '0.2.0'
 
 
-class URLEncode(CLI):
+class URLEncode(UnixFilter):
 
     def __init__(self):
         # Python 2.x
         super(URLEncode, self).__init__()
         # Python 3.x
         # super().__init__()
-        self.timeout_default = None
 
     def run(self):
-        if len(sys.argv) > 1:
-            for arg in sys.argv[1:]:
-                self.encode(arg)
+        if self.args:
+            for arg in self.args:
+                print(quote(arg))
         else:
-            # buffered - Control-D char meshes with late output
-            #for line in sys.stdin:
-            while True:
-                line = sys.stdin.readline()
-                if not line:
-                    break
-                line = line.rstrip('\n').rstrip('\r')
-                self.encode(line)
+            self.process_file('-')
 
-    @staticmethod
-    def encode(string):
-        #print(urllib.parse.quote(string))
-        print(quote(string))
-        sys.stdout.flush()
+    def transform_line(self, line):
+        return quote(line.rstrip('\r'))
 
 
 if __name__ == '__main__':